@@ -1,10 +0,0 @@
-import anomaly.dirty_read
-import anomaly.non_repeatable_read
-import anomaly.non_repeatable_read_snapshot
-import anomaly.phantom_read
-import anomaly.phantom_read_insert
-import anomaly.serialization_anomaly
-import anomaly.serialization_anomaly_insert
-import anomaly.serialization_anomaly_update
-import anomaly.serialization_anomaly_concurrent_update
-import anomaly.serialization_anomaly_select_update
@@ -1,27 +1,294 @@
+import sys
+import time
 from abc import ABC, abstractmethod
-from asyncio import Event, wait_for
-from typing import Any, Awaitable, Dict, List
+from asyncio import Event, Future, ensure_future, wait, wait_for
+from typing import Any, Awaitable, Callable, Dict, List, TextIO
 
 from psycopg import AsyncConnection, AsyncCursor, IsolationLevel
+from psycopg.rows import tuple_row
+
+from anomaly.history import History
+from anomaly.manifest import PIPELINE, SIMPLE
+from anomaly.metrics import Metrics
+from anomaly.retry import RetryCost, RetryPolicy, retry
+from anomaly.table import LIMIT, format_table
+
+
+# How transactions talk to the database: "simple" sends every statement on its own, as `begin transaction` followed by
+# `set transaction isolation level ...` (with `read only` and `deferrable` added for read only transactions) to open
+# a transaction; "pipeline" opens it with a single `begin isolation level ...` and, where statements run back to
+# back (`--stress`), sends the ones that don't need each other's results in one round trip (psycopg pipeline mode).
+
+
+# statement opening a transaction with the given characteristics
+def begin_statement(level: IsolationLevel, read_only: bool = False, deferrable: bool = False) -> str:
+    return f"begin isolation level {level.name.lower().replace('_', ' ')}{access_mode(read_only, deferrable)}"
+
+
+# transaction modes following the isolation level in `begin` or `set transaction`
+def access_mode(read_only: bool = False, deferrable: bool = False) -> str:
+    return (" read only" if read_only else "") + (" deferrable" if deferrable else "")
+
+
+# all transactions of a run share the same printer, so steps are numbered per run
+# and runs writing to different outputs can happen at the same time
+# With a `history`, the statements are also recorded there (see `anomaly.history`), and with `metrics` their latency
+# (see `anomaly.metrics`), as part of the run started by `start_run`.
+# Query results are printed up to `max_rows` rows (None for all).
+class Printer:
+
+    count: int
+    history: History | None
+    metrics: Metrics | None
+    max_rows: int | None
+    run: int
+    _anomaly: str
+    _isolation_level: str
+    _out: TextIO | None
+
+    def __init__(
+        self,
+        out: TextIO | None = None,
+        history: History | None = None,
+        metrics: Metrics | None = None,
+        max_rows: int | None = LIMIT,
+    ):
+        self.count = 0
+        self.history = history
+        self.metrics = metrics
+        self.max_rows = max_rows
+        self.run = 0
+        self._anomaly = ""
+        self._isolation_level = ""
+        self._out = out
+
+    def start_run(self, anomaly: str, isolation_level: str) -> None:
+        (self._anomaly, self._isolation_level) = (anomaly, isolation_level)
+        if self.history is not None:
+            self.run = self.history.start_run(anomaly, isolation_level)
+
+    @property
+    def out(self) -> TextIO:
+        return self._out if self._out is not None else sys.stdout
+
+    def print_step(self, name: str, query: str, text: str | None = None) -> None:
+        self.count += 1
+        print(f"[{self.count:0>2}:{name}]: {query}", file=self.out)
+        if text:
+            print(text, "\n", file=self.out)
+
+    # records a statement, as the last printed step. Metrics are kept by `statement`, the template `query` was formatted
+    # from (by default `query` itself), so that its values don't make a series each
+    def record(
+        self,
+        name: str,
+        query: str,
+        start: float,
+        read: int = 0,
+        written: int = 0,
+        blocked: float = 0.0,
+        error: str | None = None,
+        statement: str | None = None,
+    ) -> None:
+        end = time.monotonic()
+        if self.history is not None:
+            self.history.record(self.run, name, self.count, query, read, written, start, end, blocked, error)
+        if self.metrics is not None:
+            key = statement if statement is not None else query
+            self.metrics.observe(self._anomaly, self._isolation_level, name, key, end - start, blocked)
+
+
+# side connection used to tell when a statement sent by a transaction is waiting for a lock held by another one
+class LockMonitor:
+
+    conn: AsyncConnection
+    interval: float
+    _waited: Dict[int, float]
+
+    def __init__(self, conn: AsyncConnection, interval: float = 0.001):
+        self.conn = conn
+        self.interval = interval
+        self._waited = {}
+
+    async def is_blocked(self, pid: int) -> bool:
+        async with self.conn.cursor(row_factory=tuple_row) as cursor:
+            # waiting for a lock, or for a safe snapshot (serializable read only deferrable transactions)
+            await cursor.execute(
+                "select cardinality(pg_blocking_pids(%s)) + cardinality(pg_safe_snapshot_blocking_pids(%s)) > 0;",
+                (pid, pid),
+            )
+            (blocked,) = await cursor.fetchone()
+            return blocked
+
+    # starts running `statement`, whose end `wait_until_blocked` then watches
+    def start(self, statement: Awaitable[Any]) -> Future:
+        return ensure_future(statement)
+
+    # `conns` run the transactions of a scheduler, which decides when each one runs (see `Scheduler` and
+    # `anomaly.explorer`): they don't need to let the others run at every statement, nothing to do for a server
+    def scheduled(self, conns: List[AsyncConnection]):
+        pass
+
+    # returns True as soon as the backend `pid` is blocked, False if `statement` finished (or `timeout` expired) first
+    async def wait_until_blocked(self, pid: int, statement: Future, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while not statement.done() and time.monotonic() < deadline:
+            if await self.is_blocked(pid):
+                return True
+            await wait({statement}, timeout=self.interval)
+
+        return False
+
+    # seconds the backend `pid` spent waiting for locks so far, as seen by `sample`
+    def lock_wait(self, pid: int) -> float:
+        return self._waited.get(pid, 0.0)
+
+    # Polls pg_stat_activity every `interval` seconds until `stop` is set: backends `pids` found waiting for a lock are
+    # counted as waiting since the previous poll.
+    async def sample(self, pids: List[int], stop: Event, interval: float = 0.005):
+        last = time.monotonic()
+        async with self.conn.cursor(row_factory=tuple_row) as cursor:
+            while not stop.is_set():
+                await cursor.execute(
+                    "select pid from pg_stat_activity where wait_event_type = 'Lock' and pid = any(%s);", (pids,)
+                )
+                now = time.monotonic()
+                for (pid,) in await cursor.fetchall():
+                    self._waited[pid] = self._waited.get(pid, 0.0) + now - last
+                last = now
+                try:
+                    await wait_for(stop.wait(), timeout=interval)
+                except TimeoutError:
+                    pass
+
+
+# Token passing between the transactions of a run: only the holder of the token runs and, when it yields,
+# it hands the token to a given transaction or to the next one still running (in registration order).
+# Every transaction waits on its own event and the running ones are kept in a ring, so switching is O(1)
+# regardless of how many transactions take part.
+# Suspended transactions (waiting for the others to end, see `wait_for_snapshot`) are skipped, the token goes to the
+# first one to resume when no other transaction can take it.
+class Scheduler:
+
+    names: List[str]
+    _events: List[Event]
+    _running: int
+    _finished: List[bool]
+    _suspended: List[bool]
+    _idle: bool
+    _next: List[int]
+    _prev: List[int]
+
+    def __init__(self, participants: int):
+        self.names = [f"T{i + 1}" for i in range(participants)]
+        self._events = [Event() for _ in range(participants)]
+        self._running = participants
+        self._finished = [False] * participants
+        self._suspended = [False] * participants
+        self._idle = False
+        self._next = [(i + 1) % participants for i in range(participants)]
+        self._prev = [(i - 1) % participants for i in range(participants)]
+        self._events[0].set()
+
+    def index(self, name: str) -> int:
+        try:
+            return self.names.index(name)
+        except ValueError:
+            raise ValueError(f"Unknown transaction {name}, expected one of {', '.join(self.names)}.") from None
+
+    async def wait(self, index: int):
+        await self._events[index].wait()
+        self._events[index].clear()
+
+    def pass_token(self, index: int, to: int | None = None):
+        if self._running == 0:
+            return
+
+        target = self._next[index] if to is None else to
+        # finished transactions keep pointing to their successor when they leave the ring
+        seen = set()
+        while self._finished[target] or self._suspended[target]:
+            if target in seen:
+                self._idle = True
+                return
+            seen.add(target)
+            target = self._next[target]
+        self._events[target].set()
+
+    def suspend(self, index: int):
+        self._suspended[index] = True
+
+    def resume(self, index: int):
+        self._suspended[index] = False
+        if self._idle:
+            self._idle = False
+            self._events[index].set()
+
+    def finish(self, index: int):
+        self._finished[index] = True
+        self._running -= 1
+        (prev_index, next_index) = (self._prev[index], self._next[index])
+        self._next[prev_index] = next_index
+        self._prev[next_index] = prev_index
+        self.pass_token(index)
 
 
 class ConcurrentTransactionExample(ABC):
 
     conn: AsyncConnection
+    name: str
+    outcome: str | None
+    # attempts and wasted work, for transactions run with a retry policy
+    cost: RetryCost | None
     _isolation_level: IsolationLevel
-    _self_event: Event
-    _other_event: Event
+    _scheduler: Scheduler
+    _index: int
+    _printer: Printer
+    _monitor: LockMonitor | None
+    _timeout: float
+    _retry: RetryPolicy | None
+    _transport: str
+    _read_only: bool
+    _deferrable: bool
+    # the first statement is still to run and may wait for a safe snapshot, see `wait_for_snapshot`
+    _snapshot_pending: bool
+    # time at which the running statement was seen waiting for a lock, until it finishes or fails (see `_end_wait`)
+    _blocked_since: float | None
 
-    _global_printer_count: int = 0
-
-    def __init__(self, conn: AsyncConnection, level: IsolationLevel, self_event: Event, other_event: Event):
+    def __init__(
+        self,
+        conn: AsyncConnection,
+        level: IsolationLevel,
+        scheduler: Scheduler,
+        index: int,
+        printer: Printer | None = None,
+        monitor: LockMonitor | None = None,
+        timeout: float = 2,
+        retry: RetryPolicy | None = None,
+        transport: str = SIMPLE,
+        read_only: bool = False,
+        deferrable: bool = False,
+    ):
         self.conn = conn
+        self.name = scheduler.names[index]
+        self.outcome = None
+        self.cost = None
         self._isolation_level = level
-        self._self_event = self_event
-        self._other_event = other_event
+        self._scheduler = scheduler
+        self._index = index
+        self._printer = printer if printer is not None else Printer()
+        self._monitor = monitor
+        self._timeout = timeout
+        self._retry = retry
+        self._transport = transport
+        self._read_only = read_only
+        self._deferrable = deferrable
+        self._snapshot_pending = False
+        self._blocked_since = None
 
     async def __call__(self):
-        self.print_text(f"BEGIN")
+        modes = (" READ ONLY" if self._read_only else "") + (" DEFERRABLE" if self._deferrable else "")
+        self.print_text(f"BEGIN{modes}")
         await self._wait()
         await self.run()
         self._done()
@@ -32,63 +299,162 @@ class ConcurrentTransactionExample(ABC):
         ...
 
     async def begin_transaction_with_isolation_level(self, cursor: AsyncCursor):
+        self._snapshot_pending = (
+            self._read_only and self._deferrable and self._isolation_level == IsolationLevel.SERIALIZABLE
+        )
+        if self._transport == PIPELINE:
+            await cursor.execute(begin_statement(self._isolation_level, self._read_only, self._deferrable))
+            return
+
         await cursor.execute("begin transaction")
+        modes = access_mode(self._read_only, self._deferrable)
         match self._isolation_level:
             case IsolationLevel.READ_UNCOMMITTED:
-                await cursor.execute("set transaction isolation level read uncommitted")
+                await cursor.execute(f"set transaction isolation level read uncommitted{modes}")
             case IsolationLevel.READ_COMMITTED:
-                await cursor.execute("set transaction isolation level read committed")
+                await cursor.execute(f"set transaction isolation level read committed{modes}")
             case IsolationLevel.REPEATABLE_READ:
-                await cursor.execute("set transaction isolation level repeatable read")
+                await cursor.execute(f"set transaction isolation level repeatable read{modes}")
             case IsolationLevel.SERIALIZABLE:
-                await cursor.execute("set transaction isolation level serializable")
+                await cursor.execute(f"set transaction isolation level serializable{modes}")
             case _:
                 raise ValueError(f"Unknown isolation level {self._isolation_level}.")
 
     # syncing helpers
 
     async def _wait(self):
-        await self._self_event.wait()
-        self._self_event.clear()
+        await self._scheduler.wait(self._index)
 
     def _done(self):
-        self._other_event.set()
+        self._scheduler.finish(self._index)
 
-    async def yield_for_another_task(self, awaitable: Awaitable[Any] | None = None):
-        self._other_event.set()
+    # `awaitable` is a statement that may block on a lock held by another transaction.
+    # With a lock monitor, control is handed over as soon as the statement is waiting for the lock (or has finished),
+    # otherwise it is handed over right away. `timeout` is just a safety net for statements that never finish.
+    # `to` names the transaction that runs next (e.g. "T3"), by default it is the next one still running.
+    # Returns the seconds the statement waited for the lock, as seen by the lock monitor.
+    async def yield_for_another_task(self, awaitable: Awaitable[Any] | None = None, to: str | None = None) -> float:
+        target = self._scheduler.index(to) if to is not None else None
+        blocked = 0.0
         try:
-            if awaitable is not None:
-                await wait_for(awaitable, timeout=2)
+            if awaitable is None:
+                self._scheduler.pass_token(self._index, target)
+            else:
+                statement = self._start(awaitable)
+                await self._wait_until_blocked(statement)
+                self._scheduler.pass_token(self._index, target)
+                await wait_for(statement, timeout=self._timeout)
+                blocked = self._end_wait()
 
-            await wait_for(self._self_event.wait(), timeout=2)
+            await wait_for(self._scheduler.wait(self._index), timeout=self._timeout)
         except TimeoutError:
             self.print_text("yield_to_other", "TIMEOUT")
-        self._self_event.clear()
+            blocked = blocked or self._end_wait()
+
+        return blocked
+
+    # Like `yield_for_another_task(awaitable)`, but it resumes as soon as the statement finishes instead of waiting
+    # for the token to come back. Useful when several transactions wait for the same lock, since the database
+    # (and not the scheduler) decides which one gets it first.
+    async def wait_for_lock(self, awaitable: Awaitable[Any], to: str | None = None) -> float:
+        target = self._scheduler.index(to) if to is not None else None
+        statement = self._start(awaitable)
+        await self._wait_until_blocked(statement)
+        self._scheduler.pass_token(self._index, target)
+        try:
+            await wait_for(statement, timeout=self._timeout)
+        except TimeoutError:
+            self.print_text("wait_for_lock", "TIMEOUT")
+
+        return self._end_wait()
+
+    # A serializable read only deferrable transaction waits, at its first statement, for the serializable transactions
+    # running at that time to end, until it gets a snapshot that can't take part in a serialization anomaly. The
+    # transaction is suspended meanwhile (see `Scheduler.suspend`), and runs again once it has the token back.
+    # Any other statement runs as is. Returns the seconds the statement waited, as seen by the lock monitor.
+    async def wait_for_snapshot(self, awaitable: Awaitable[Any]) -> float:
+        if not self._snapshot_pending:
+            await awaitable
+            return 0.0
+
+        self._snapshot_pending = False
+        statement = self._start(awaitable)
+        if await self._wait_until_blocked(statement) is None:
+            await statement
+            return 0.0
+
+        self._scheduler.suspend(self._index)
+        self._scheduler.pass_token(self._index)
+        blocked = 0.0
+        try:
+            await wait_for(statement, timeout=self._timeout)
+            blocked = self._end_wait()
+            self._scheduler.resume(self._index)
+            await wait_for(self._scheduler.wait(self._index), timeout=self._timeout)
+        except TimeoutError:
+            self.print_text("wait_for_snapshot", "TIMEOUT")
+            blocked = blocked or self._end_wait()
+
+        return blocked
+
+    def _start(self, awaitable: Awaitable[Any]) -> Future:
+        return self._monitor.start(awaitable) if self._monitor is not None else ensure_future(awaitable)
+
+    # time at which the statement was seen waiting for a lock, None if it finished first (or there is no monitor)
+    async def _wait_until_blocked(self, statement: Future) -> float | None:
+        self._blocked_since = None
+        if self._monitor is not None:
+            if await self._monitor.wait_until_blocked(self.conn.info.backend_pid, statement, self._timeout):
+                self._blocked_since = time.monotonic()
+        return self._blocked_since
+
+    # Seconds the running statement waited for a lock until now, 0 if it wasn't seen waiting. Called once it finished,
+    # by the methods above, or by the error path of a statement failing after the wait.
+    def _end_wait(self) -> float:
+        (since, self._blocked_since) = (self._blocked_since, None)
+        return time.monotonic() - since if since is not None else 0.0
+
+    # Runs `attempt` (a whole transaction, counting its statements in the cost) again when it fails with a serialization
+    # failure or a deadlock, as long as the retry policy allows it. `on_abort` rolls the failed attempt back.
+    async def with_retry(
+        self,
+        attempt: Callable[[RetryCost], Awaitable[None]],
+        on_abort: Callable[[Exception], Awaitable[None]],
+    ) -> RetryCost:
+        self.cost = await retry(self._retry or RetryPolicy(max_attempts=1), attempt, on_abort)
+        return self.cost
 
     # printing helpers
 
     def print_text(self, query: str, text: str | None = None) -> None:
-        ConcurrentTransactionExample._global_printer_count += 1
-        print(f"[{ConcurrentTransactionExample._global_printer_count:0>2}:{self.__class__.__name__}]: {query}")
-        if text:
-            print(text, "\n")
+        # examples print "COMMIT"/"ROLLBACK" right after ending the transaction, so it is the outcome of the run
+        if query in ("COMMIT", "ROLLBACK"):
+            self.outcome = query
+        self._printer.print_step(self.name, query, text)
 
     def print_query_result(self, query: str, records: List[Dict]) -> None:
-        ConcurrentTransactionExample._global_printer_count += 1
-        print(f"[{ConcurrentTransactionExample._global_printer_count:0>2}:{self.__class__.__name__}]: {query}")
-        print(format_table(records), "\n")
-
-
-def format_table(records: List[Dict]) -> str:
-    if not records:
-        return "EMPTY"
+        self._printer.print_step(self.name, query, format_table(records, self._printer.max_rows))
 
-    # https://stackoverflow.com/a/9536084
-    # results in |{:<12}|{:<12}|...| to format as many fields as in the first record
-    fmt = ("|{:>12}" * len(records[0])) + "|"
-    formatted = fmt.format(*list(records[0].keys()))
-    for record in records:
-        values = map(lambda x: x if x is not None else "NULL", record.values())
-        formatted += "\n" + fmt.format(*list(values))
+    # records the statement `query`, started at `start` (time.monotonic()), in the history of the run if any, and in
+    # the metrics under `statement` (see `Printer.record`)
+    def record(
+        self,
+        query: str,
+        start: float,
+        read: int = 0,
+        written: int = 0,
+        blocked: float = 0.0,
+        error: BaseException | None = None,
+        statement: str | None = None,
+    ) -> None:
+        self._printer.record(
+            self.name,
+            query,
+            start,
+            read,
+            written,
+            blocked,
+            error.__class__.__name__ if error is not None else None,
+            statement,
+        )
 
-    return formatted
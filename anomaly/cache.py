@@ -0,0 +1,107 @@
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Tuple
+
+from anomaly.manifest import SCENARIOS
+
+
+# Results of matrix cells (see `anomaly.runner.run_matrix`) kept on disk, so that running the matrix again only runs the
+# cells whose inputs changed. The key of a cell is a hash of everything its output depends on: the source of the module
+# of its scenario, the isolation level, the dataset, the server version and the options of the run, and the source of
+# the rest of the package (transactions, backends, tables...), whose changes run every cell again.
+# One JSON file per cell, named after its key. Reading a file touches it and, once they add up to more than
+# `max_bytes`, the least recently used ones are removed.
+
+DEFAULT_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "txiso")
+
+MAX_BYTES = 16 * 1024 * 1024
+
+_PACKAGE = os.path.dirname(os.path.abspath(__file__))
+
+
+class OutcomeCache:
+
+    path: str
+    max_bytes: int
+    hits: int
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        file = self._file(key)
+        try:
+            with open(file) as f:
+                value = json.load(f)
+            os.utime(file)
+        except (OSError, ValueError):
+            return None
+
+        self.hits += 1
+        return value
+
+    # written to a temporary file first, so that processes sharing the cache never read half a file
+    def put(self, key: str, value: Dict[str, Any]):
+        os.makedirs(self.path, exist_ok=True)
+        (fd, temporary) = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(temporary, self._file(key))
+        self._evict()
+
+    def _evict(self):
+        files: List[Tuple[float, int, str]] = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for (_, size, _) in files)
+        for (_, size, path) in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+
+# `parts` must be JSON serializable
+def cell_key(anomaly_module: str, *parts: Any) -> str:
+    digest = hashlib.sha256()
+    digest.update(_package_source().encode())
+    digest.update(_module_source(anomaly_module).encode())
+    digest.update(json.dumps(parts, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+# hash of the modules of the package but the scenarios, read once
+@functools.cache
+def _package_source() -> str:
+    scenarios = {module.rsplit(".", 1)[-1] + ".py" for module in SCENARIOS.values()}
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(_PACKAGE)):
+        if name.endswith(".py") and name not in scenarios:
+            with open(os.path.join(_PACKAGE, name), "rb") as f:
+                digest.update(name.encode() + b"\0" + f.read())
+    return digest.hexdigest()
+
+
+@functools.cache
+def _module_source(module: str) -> str:
+    spec = importlib.util.find_spec(module)
+    if spec is None or spec.origin is None:
+        return module
+    with open(spec.origin, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
@@ -0,0 +1,333 @@
+import bisect
+import collections
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+
+# Dependency graph of the committed transactions of a history (Adya, "Weak Consistency: A Generalized Theory and
+# Optimistic Implementations for Distributed Transactions"), built as transactions commit:
+# - ww: T1 installed a version of a row and T2 installed the next one
+# - wr: T2 read a version installed by T1
+# - rw: T1 read a version of a row (by id, or as part of a predicate read) and T2 installed the next one
+# A cycle means the history is not serializable, its edges tell which anomaly it is:
+# only ww edges is G0 (dirty write), ww/wr edges G1c, with rw edges G2-item or, if one of them comes from a predicate
+# read, G2 (phantom).
+#
+# Transactions are ordered by commit (where most edges point to already), and that order is kept topological as edges
+# are added (Pearce and Kelly), so an edge only costs a search when it points backwards, and the search only visits the
+# transactions committed in between. An edge closing a cycle is reported and left out of the graph.
+#
+# Snapshots are told in commits: a snapshot sees the transactions committed before it was taken. Edges only point to a
+# committed transaction from a snapshot that did not see it, so once every running transaction took its first snapshot
+# after a transaction committed, and after the ones with edges into it, no new cycle can go through it and it is
+# dropped: the graph and the readers kept for the next versions stay the size of the concurrent transactions.
+WW = "ww"
+WR = "wr"
+RW = "rw"
+# rw edge from a predicate read
+PREDICATE_RW = "prw"
+
+G0 = "G0"
+G1C = "G1c"
+G2_ITEM = "G2-item"
+G2 = "G2"
+
+# when a pair of transactions has several kinds of edges, cycles are classified with the weakest one
+_STRENGTH = {WW: 0, WR: 1, RW: 2, PREDICATE_RW: 3}
+
+
+class Edge(NamedTuple):
+    source: Any
+    target: Any
+    kind: str
+    # row the dependency is about
+    key: Any
+
+
+class Anomaly(NamedTuple):
+    kind: str
+    cycle: Tuple[Edge, ...]
+
+
+class _Read(NamedTuple):
+    key: Any
+    # transaction that installed the version read
+    writer: Any
+    predicate: bool
+
+
+class _PredicateRead(NamedTuple):
+    # commits seen by the snapshot of the read
+    snapshot: int
+    # keys of the rows it saw
+    keys: Set[Any]
+
+
+class _Transaction:
+
+    def __init__(self, label: Any):
+        self.label = label
+        self.reads: List[_Read] = []
+        self.writes: List[Any] = []
+        self.predicate_reads: List[_PredicateRead] = []
+        # commits seen by the first and the last snapshot taken
+        self.first_snapshot: int | None = None
+        self.snapshot: int | None = None
+        # place in the commits, once committed
+        self.sequence: int | None = None
+
+
+class Checker:
+
+    anomalies: List[Anomaly]
+
+    def __init__(self):
+        self.anomalies = []
+        self._pending: Dict[Any, _Transaction] = {}
+        # committed transactions still in the graph
+        self._committed: Dict[Any, _Transaction] = {}
+        self._commits = 0
+        # committed transactions in commit order, until every running transaction took a snapshot after them
+        self._settling: collections.deque = collections.deque()
+        # committed versions of every row (their writers), in version order, from the last one of a dropped transaction
+        self._versions: Dict[Any, List[Any]] = {}
+        # new rows (sequence of the commit, key and writer), in commit order, from the first snapshot still running
+        self._created: List[Tuple[int, Any, Any]] = []
+        # committed readers of the last version of every row, with whether they only read it as part of a predicate
+        self._readers: Dict[Tuple[Any, Any], Dict[Any, bool]] = {}
+        # committed transactions with predicate reads, which no new row was seen by
+        self._predicate_readers: Dict[Any, None] = {}
+        self._order: Dict[Any, int] = {}
+        self._successors: Dict[Any, Dict[Any, Edge]] = {}
+        self._predecessors: Dict[Any, Set[Any]] = {}
+        # edges left out since they close a cycle, by source
+        self._rejected: Dict[Any, Set[Any]] = {}
+
+    # `label` names the transaction in the reported cycles
+    def begin(self, t: Any, label: Any = None) -> None:
+        self._pending[t] = _Transaction(t if label is None else label)
+
+    # `t` took a snapshot, which sees the transactions committed so far
+    def snapshot(self, t: Any) -> None:
+        transaction = self._pending[t]
+        transaction.snapshot = self._commits
+        if transaction.first_snapshot is None:
+            transaction.first_snapshot = self._commits
+
+    # `t` read the version of row `key` installed by `writer`
+    def read(self, t: Any, key: Any, writer: Any) -> None:
+        self._pending[t].reads.append(_Read(key, writer, False))
+
+    # `t` read the rows matching a predicate with its last snapshot and `versions` are the writers of the rows it could
+    # see
+    def predicate_read(self, t: Any, versions: Dict[Any, Any]) -> None:
+        transaction = self._pending[t]
+        for (key, writer) in versions.items():
+            transaction.reads.append(_Read(key, writer, True))
+        transaction.predicate_reads.append(_PredicateRead(transaction.snapshot, set(versions)))
+
+    # `t` installed a new version of `key` (new rows and deletes included)
+    def write(self, t: Any, key: Any) -> None:
+        self._pending[t].writes.append(key)
+
+    def abort(self, t: Any) -> None:
+        self._pending.pop(t, None)
+        self._prune()
+
+    def commit(self, t: Any) -> None:
+        transaction = self._pending.pop(t)
+        transaction.sequence = self._commits
+        self._commits += 1
+        self._committed[t] = transaction
+        self._settling.append(t)
+        self._order[t] = transaction.sequence
+        self._successors[t] = {}
+        self._predecessors[t] = set()
+
+        for read in transaction.reads:
+            if read.writer == t:
+                continue
+            if read.writer in self._order:
+                self._add(Edge(read.writer, t, WR, read.key))
+
+            versions = self._versions.get(read.key, [])
+            position = _index(versions, read.writer)
+            if position is None:
+                continue
+            if position + 1 < len(versions):
+                # a later version already committed
+                self._add(Edge(t, versions[position + 1], PREDICATE_RW if read.predicate else RW, read.key))
+            else:
+                readers = self._readers.setdefault((read.key, read.writer), {})
+                readers[t] = readers.get(t, True) and read.predicate
+
+        for key in dict.fromkeys(transaction.writes):
+            versions = self._versions.setdefault(key, [])
+            if versions:
+                previous = versions[-1]
+                self._add(Edge(previous, t, WW, key))
+                for (reader, predicate) in self._readers.pop((key, previous), {}).items():
+                    self._add(Edge(reader, t, PREDICATE_RW if predicate else RW, key))
+            else:
+                # a new row, which earlier predicate reads did not see
+                for reader in self._predicate_readers:
+                    self._add(Edge(reader, t, PREDICATE_RW, key))
+                self._created.append((transaction.sequence, key, t))
+            versions.append(t)
+
+        for read in transaction.predicate_reads:
+            # rows created by transactions that committed after the snapshot (the rows it did not see that were
+            # created before were deleted by then)
+            for (_, key, writer) in self._created[bisect.bisect_left(self._created, (read.snapshot,)):]:
+                if writer != t and key not in read.keys:
+                    self._add(Edge(t, writer, PREDICATE_RW, key))
+        if transaction.predicate_reads:
+            self._predicate_readers[t] = None
+            transaction.predicate_reads = []
+
+        self._prune()
+
+    # anomaly found that is forbidden by the weakest isolation level (G0 first, G2 last), None if the history is
+    # serializable so far
+    def worst(self) -> str | None:
+        kinds = {a.kind for a in self.anomalies}
+        for kind in (G0, G1C, G2_ITEM, G2):
+            if kind in kinds:
+                return kind
+        return None
+
+    def _add(self, edge: Edge):
+        (source, target) = (edge.source, edge.target)
+        # a dropped transaction is on no cycle
+        if source == target or source not in self._order or target not in self._order:
+            return
+
+        successors = self._successors[source]
+        if target in self._rejected.get(source, ()):
+            return
+        if target in successors:
+            if _STRENGTH[edge.kind] < _STRENGTH[successors[target].kind]:
+                successors[target] = edge
+            return
+
+        if self._order[source] > self._order[target]:
+            path = self._reorder(source, target)
+            if path is not None:
+                self._rejected.setdefault(source, set()).add(target)
+                cycle = (*path, edge)
+                self.anomalies.append(Anomaly(_classify(cycle), tuple(self._labelled(e) for e in cycle)))
+                return
+
+        successors[target] = edge
+        self._predecessors[target].add(source)
+
+    # Makes room for the edge source -> target, with target before source in the current order: the transactions
+    # reachable from target (up to source) have to move after the ones reaching source (down to target).
+    # Returns the path target -> source instead if there is one, since the edge would close a cycle.
+    def _reorder(self, source: Any, target: Any) -> Tuple[Edge, ...] | None:
+        (lower, upper) = (self._order[target], self._order[source])
+
+        forward: Dict[Any, Any] = {target: None}
+        stack = [target]
+        while stack:
+            node = stack.pop()
+            for successor in self._successors[node]:
+                if successor == source:
+                    forward[successor] = node
+                    return self._path(forward, source)
+                if successor not in forward and self._order[successor] < upper:
+                    forward[successor] = node
+                    stack.append(successor)
+
+        backward = {source}
+        stack = [source]
+        while stack:
+            node = stack.pop()
+            for predecessor in self._predecessors[node]:
+                if predecessor not in backward and self._order[predecessor] > lower:
+                    backward.add(predecessor)
+                    stack.append(predecessor)
+
+        moved = sorted(backward, key=self._order.get) + sorted(forward, key=self._order.get)
+        slots = sorted(self._order[node] for node in moved)
+        for (node, slot) in zip(moved, slots):
+            self._order[node] = slot
+        return None
+
+    def _path(self, parents: Dict[Any, Any], end: Any) -> Tuple[Edge, ...]:
+        edges = []
+        node = end
+        while parents[node] is not None:
+            parent = parents[node]
+            edges.append(self._successors[parent][node])
+            node = parent
+        return tuple(reversed(edges))
+
+    def _labelled(self, edge: Edge) -> Edge:
+        return edge._replace(source=self._committed[edge.source].label, target=self._committed[edge.target].label)
+
+    # Drops the committed transactions no new edge can reach: the ones that committed before the first snapshot of every
+    # running transaction, once the ones with edges into them are dropped.
+    def _prune(self):
+        horizon = min(
+            (p.first_snapshot for p in self._pending.values() if p.first_snapshot is not None), default=self._commits
+        )
+        dropped = []
+        while self._settling and self._committed[self._settling[0]].sequence < horizon:
+            t = self._settling.popleft()
+            if not self._predecessors[t]:
+                dropped.append(t)
+        while dropped:
+            t = dropped.pop()
+            for successor in self._successors.pop(t):
+                predecessors = self._predecessors[successor]
+                predecessors.discard(t)
+                if not predecessors and self._committed[successor].sequence < horizon:
+                    dropped.append(successor)
+            del self._predecessors[t]
+            del self._order[t]
+            self._forget(t)
+        del self._created[:bisect.bisect_left(self._created, (horizon,))]
+
+    def _forget(self, t: Any):
+        transaction = self._committed.pop(t)
+        self._predicate_readers.pop(t, None)
+        for read in transaction.reads:
+            readers = self._readers.get((read.key, read.writer))
+            if readers is not None:
+                readers.pop(t, None)
+                if not readers:
+                    del self._readers[(read.key, read.writer)]
+        # the versions before its own are not read anymore, its own may still be (and lead to the next one)
+        for key in dict.fromkeys(transaction.writes):
+            versions = self._versions[key]
+            position = _index(versions, t)
+            if position:
+                del versions[:position]
+        self._rejected.pop(t, None)
+
+
+def _classify(cycle: Tuple[Edge, ...]) -> str:
+    kinds = {e.kind for e in cycle}
+    if PREDICATE_RW in kinds:
+        return G2
+    if RW in kinds:
+        return G2_ITEM
+    if WR in kinds:
+        return G1C
+    return G0
+
+
+def _index(versions: List[Any], writer: Any) -> int | None:
+    # versions read are almost always among the last ones
+    for i in range(len(versions) - 1, -1, -1):
+        if versions[i] == writer:
+            return i
+    return None
+
+
+def format_anomaly(anomaly: Anomaly, names: Dict[Any, str] | None = None) -> str:
+    names = names or {}
+    cycle = " ".join(
+        f"{names.get(e.source, e.source)} -{e.kind}{'' if e.key is None else f'[{e.key}]'}->" for e in anomaly.cycle
+    )
+    return f"{anomaly.kind}: {cycle} {names.get(anomaly.cycle[0].source, anomaly.cycle[0].source)}"
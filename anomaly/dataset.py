@@ -0,0 +1,65 @@
+import random
+import struct
+from typing import List, NamedTuple, Tuple
+
+
+# Rows of the `account` table at the beginning of every run. The examples are written for two rows (ids 1 and 2,
+# ACCOUNT_BALANCES); to run them against a table of a realistic size (predicate locks, index or sequential scans, lock
+# memory...), `Dataset` adds `rows - 2` more whose balances follow `distribution`, between 0 and FILLER_MAX so that
+# the predicates of the examples (`balance > 30`) match the same rows whatever the size, plus `indexes`.
+# Balances are drawn from a fixed seed: datasets with the same parameters are the same, and so are their fingerprints
+# (see `anomaly.diff`).
+
+ACCOUNT_BALANCES: List[int] = [67, 31]
+
+# payloads of the rows of the `job` table at the beginning of every run, all pending (see `anomaly.work_queue`): the
+# examples claim the first two, whatever the dataset
+JOBS: List[str] = ["job 1", "job 2"]
+
+FILLER_MAX = 30
+
+# see `anomaly.manifest.DISTRIBUTIONS`
+UNIFORM = "uniform"
+# balance b with a probability proportional to 1 / (b + 1)
+ZIPF = "zipf"
+
+# `copy ... (format binary)` framing: signature, flags and header extension length, then per row its field count, the
+# length and the value of its int4 balance, and -1 at the end
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_COPY_ROW = struct.Struct(">hii")
+_COPY_TRAILER = struct.pack(">h", -1)
+
+
+class Dataset(NamedTuple):
+    rows: int = len(ACCOUNT_BALANCES)
+    distribution: str = UNIFORM
+    # column lists, one per index (besides the primary key on id)
+    indexes: Tuple[Tuple[str, ...], ...] = ()
+    seed: int = 0
+
+    def balances(self) -> List[int]:
+        count = self.rows - len(ACCOUNT_BALANCES)
+        if count < 0:
+            raise ValueError(f"The examples need at least {len(ACCOUNT_BALANCES)} rows, got {self.rows}")
+
+        rng = random.Random(self.seed)
+        values = range(FILLER_MAX + 1)
+        if self.distribution == UNIFORM:
+            fillers = rng.choices(values, k=count)
+        elif self.distribution == ZIPF:
+            fillers = rng.choices(values, weights=[1 / (b + 1) for b in values], k=count)
+        else:
+            raise ValueError(f"Unknown distribution {self.distribution}")
+
+        return ACCOUNT_BALANCES + fillers
+
+    # `copy account (balance) from stdin (format binary)` payload
+    def copy_payload(self) -> bytes:
+        return b"".join([_COPY_HEADER, *(_COPY_ROW.pack(1, 4, b) for b in self.balances()), _COPY_TRAILER])
+
+    def __str__(self) -> str:
+        indexes = ", ".join(f"({', '.join(columns)})" for columns in self.indexes) or "none"
+        return f"{self.rows} rows ({self.distribution}), indexes: {indexes}"
+
+
+DEFAULT = Dataset()
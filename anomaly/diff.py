@@ -0,0 +1,141 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, NamedTuple, TextIO, Tuple
+
+from psycopg import AsyncConnection
+from psycopg.rows import tuple_row
+
+from anomaly.table import LIMIT, write_query, write_table
+
+
+# State of the `account` table before and after a run: `snapshot` keeps a 64-bit hash per row (the first 8 bytes of the
+# md5 of the text of its id and balance, e.g. "(1,67)"), `write_diff` then prints only the rows inserted, deleted or
+# changed since:
+# |  change|id|balance|
+# | changed| 1|     10|
+# | deleted| 2|   NULL|
+# Both come with a fingerprint of the whole table (row count and xor of the row hashes), the same for equal tables
+# whatever the backend or the physical order of the rows: equal fingerprints skip the diff, and runs can be compared by
+# their fingerprint alone.
+
+_SNAPSHOT_TABLE = "account_snapshot"
+
+# hash of the row `a` (its id and balance, the version is left out), as a signed bigint
+_HASH = "('x' || left(md5(row(a.id, a.balance)::text), 16))::bit(64)::bigint"
+
+_MASK = (1 << 64) - 1
+
+_UNCHANGED = "UNCHANGED"
+
+
+class Fingerprint(NamedTuple):
+    rows: int
+    # xor of the row hashes, 0 for an empty table
+    hash: int
+
+    def __str__(self) -> str:
+        return f"{self.rows} row{'s' if self.rows != 1 else ''}, fingerprint {self.hash & _MASK:016x}"
+
+
+# Hashes computed by the server: the snapshot is a table of (id, hash) in the schema of the run and the diff a join of
+# it with `account`, streamed through a server side cursor. The client only holds the rows it prints.
+class StateDiff:
+
+    _conn: AsyncConnection
+    _before: Fingerprint | None
+
+    def __init__(self, conn: AsyncConnection):
+        self._conn = conn
+        self._before = None
+
+    async def snapshot(self) -> Fingerprint:
+        async with self._conn.cursor(row_factory=tuple_row) as c:
+            await c.execute(f"drop table if exists {_SNAPSHOT_TABLE};")
+            await c.execute(f"create unlogged table {_SNAPSHOT_TABLE} as select id, {_HASH} as hash from account a;")
+            await c.execute(f"select count(*), coalesce(bit_xor(hash), 0) from {_SNAPSHOT_TABLE};")
+            self._before = Fingerprint(*await c.fetchone())
+
+        return self._before
+
+    async def fingerprint(self) -> Fingerprint:
+        async with self._conn.cursor(row_factory=tuple_row) as c:
+            await c.execute(f"select count(*), coalesce(bit_xor({_HASH}), 0) from account a;")
+            return Fingerprint(*await c.fetchone())
+
+    # rows changed since `snapshot`, ordered by id, `after` being the fingerprint of the table now
+    async def write_diff(self, out: TextIO, after: Fingerprint, limit: int | None = LIMIT):
+        if after == self._before:
+            out.write(f"{_UNCHANGED}\n")
+            return
+
+        await write_query(
+            self._conn,
+            f"""
+                select
+                    case when s.id is null then 'inserted' when a.id is null then 'deleted' else 'changed' end
+                        as change,
+                    coalesce(a.id, s.id) as id,
+                    a.balance
+                from {_SNAPSHOT_TABLE} s full join account a on a.id = s.id
+                where s.hash is distinct from {_HASH}
+                order by 2;
+            """,
+            out,
+            limit,
+            empty=_UNCHANGED,
+        )
+
+
+# Same output with the hashes computed by the client, for backends only running the statements of the examples (see
+# `anomaly.memory`): the snapshot is a dict of the row hashes by id. The rows hashed by `fingerprint` are kept for the
+# diff that follows.
+class ClientStateDiff(StateDiff):
+
+    _hashes: Dict[int, int]
+    _after: Dict[int, Tuple[int, int]]
+
+    def __init__(self, conn: AsyncConnection):
+        super().__init__(conn)
+        self._hashes = {}
+        self._after = {}
+
+    async def snapshot(self) -> Fingerprint:
+        self._hashes = {id: _hash(id, balance) for (id, balance) in await self._rows()}
+        self._before = _fingerprint(self._hashes.values())
+        return self._before
+
+    async def fingerprint(self) -> Fingerprint:
+        self._after = {id: (_hash(id, balance), balance) for (id, balance) in await self._rows()}
+        return _fingerprint(h for (h, _) in self._after.values())
+
+    async def write_diff(self, out: TextIO, after: Fingerprint, limit: int | None = LIMIT):
+        if after == self._before:
+            out.write(f"{_UNCHANGED}\n")
+            return
+
+        changes: List[Tuple[int, str, Any]] = []
+        for (id, (h, balance)) in self._after.items():
+            before = self._hashes.get(id, None)
+            if before != h:
+                changes.append((id, "inserted" if before is None else "changed", balance))
+        changes += [(id, "deleted", None) for id in self._hashes.keys() - self._after.keys()]
+
+        records = ({"change": c, "id": id, "balance": b} for (id, c, b) in sorted(changes))
+        write_table(records, out, limit, empty=_UNCHANGED)
+
+    async def _rows(self) -> List[Tuple]:
+        async with self._conn.cursor(row_factory=tuple_row) as c:
+            await c.execute("select id, balance from account;")
+            return await c.fetchall()
+
+
+# same as _HASH, the text of a row of integers being the same as PostgreSQL's
+def _hash(id: int, balance: int) -> int:
+    return int.from_bytes(hashlib.md5(b"(%d,%d)" % (id, balance)).digest()[:8], "big", signed=True)
+
+
+def _fingerprint(hashes: Iterable[int]) -> Fingerprint:
+    (rows, xor) = (0, 0)
+    for h in hashes:
+        rows += 1
+        xor ^= h
+    return Fingerprint(rows, xor)
@@ -1,56 +1,27 @@
-from anomaly.base import ConcurrentTransactionExample
+from anomaly.steps import commit, modify, select, transaction, yield_to
 from anomaly import registry
 
 
-class T1(ConcurrentTransactionExample):
+T1 = transaction(
+    select("select balance from account where id = 1;"),
+    yield_to(),
+    modify("update account set balance = 10 where id = 1;"),
+    select("select balance from account where id = 1;"),
+    yield_to(),
+    commit(),
+    yield_to(),
+)
 
-    async def run(self):
-        async with self.conn.cursor() as cursor:
-            await self.begin_transaction_with_isolation_level(cursor)
+T2 = transaction(
+    select("select balance from account where id = 1;"),
+    yield_to(),
+    select("select balance from account where id = 1;"),
+    commit(),
+    yield_to(),
+)
 
-            query = "select balance from account where id = 1;"
-            await cursor.execute(query)
-            self.print_query_result(query, await cursor.fetchall())
 
-            await self.yield_for_another_task()
-
-            query = "update account set balance = 10 where id = 1;"
-            await cursor.execute(query)
-            self.print_text(query, f"MODIFIED: {cursor.rowcount}")
-
-            query = "select balance from account where id = 1;"
-            await cursor.execute(query)
-            self.print_query_result(query, await cursor.fetchall())
-
-            await self.yield_for_another_task()
-
-            await cursor.execute("commit;")
-            self.print_text("COMMIT")
-            await self.yield_for_another_task()
-
-
-class T2(ConcurrentTransactionExample):
-
-    async def run(self):
-        async with self.conn.cursor() as cursor:
-            await self.begin_transaction_with_isolation_level(cursor)
-
-            query = "select balance from account where id = 1;"
-            await cursor.execute(query)
-            self.print_query_result(query, await cursor.fetchall())
-
-            await self.yield_for_another_task()
-
-            query = "select balance from account where id = 1;"
-            await cursor.execute(query)
-            self.print_query_result(query, await cursor.fetchall())
-
-            await cursor.execute("commit;")
-            self.print_text("COMMIT")
-            await self.yield_for_another_task()
-
-
-registry.register("dirty-read", T1, T2, description="""
+registry.register_transactions("dirty-read", T1, T2, description="""
 In this example, T1 updates de DB and, before it commits the transaction, T2 reads the same value.
 If the DB accepts reading uncommitted data, it should read the value updated by T1 even though it wasn't commited yet.
 Because of implementation details, this anomaly doesn't happen in PostgreSQL (regardless of the isolation level).
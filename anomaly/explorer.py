@@ -0,0 +1,380 @@
+import asyncio
+import re
+from collections import deque
+from typing import Any, Deque, Dict, FrozenSet, Iterator, List, NamedTuple, Tuple
+
+import psycopg
+from psycopg import AsyncConnection, AsyncCursor, IsolationLevel
+from psycopg.rows import tuple_row
+
+from anomaly.base import LockMonitor, access_mode
+from anomaly.pool import SessionPool
+from anomaly.runner import BACKENDS, ISOLATION_LEVELS
+from anomaly.steps import Step, StepKind, Transaction, check_expected
+from anomaly import registry
+
+
+# Runs every interleaving of the steps of an example, instead of the one fixed by its `yield_to` steps.
+# Interleavings that only swap independent steps (reads of the same rows, or steps touching different rows) give the
+# same outcome, so only one interleaving of each equivalence class (its lexicographically smallest one) is run.
+
+# footprint of a step that may touch any row, inserts included: the id they take depends on the inserts before them
+# and the row they create may be the one a point read looks for
+ALL = "*"
+
+_ROW_ID = re.compile(r"\bwhere\s+id\s*=\s*(\d+)\s*;?\s*$", re.IGNORECASE)
+
+# selects taking locks, that other transactions may wait for
+_LOCKING = re.compile(r"\bfor\s+update\b|\bpg_advisory_xact_lock\b", re.IGNORECASE)
+
+_FAILURES = (
+    psycopg.errors.SerializationFailure, psycopg.errors.DeadlockDetected, psycopg.errors.LockNotAvailable
+)
+
+
+# a step of an interleaving, `step` is its position in the transaction
+class Action(NamedTuple):
+    transaction: int
+    step: int
+    write: bool
+    footprint: FrozenSet
+
+
+class Outcome(NamedTuple):
+    # COMMIT or ROLLBACK, per transaction
+    status: Tuple[str, ...]
+    # rows returned by each select, per transaction
+    reads: Tuple[Tuple[Tuple[Tuple[Any, ...], ...], ...], ...]
+    final: Tuple[Tuple[Any, ...], ...]
+    # transaction of every statement run, in the order they started, and whether it waited for a lock
+    started: Tuple[Tuple[int, bool], ...] = ()
+
+    def __str__(self) -> str:
+        status = " ".join(f"T{i + 1}:{s}" for (i, s) in enumerate(self.status))
+        reads = " ".join(
+            f"T{i + 1}:" + ",".join("[" + " ".join(_format_row(r) for r in rows) + "]" for rows in t)
+            for (i, t) in enumerate(self.reads) if t
+        )
+        final = " ".join(_format_row(r) for r in self.final)
+        return f"{status} | reads {reads} | final {final}"
+
+
+class Exploration(NamedTuple):
+    anomaly: str
+    isolation_level: str
+    # all interleavings, equivalent ones included
+    total: int
+    explored: int
+    truncated: bool
+    # interleavings (as transaction numbers, e.g. "1212") by outcome
+    outcomes: Dict[str, List[str]]
+
+
+# steps that run statements, without the ones that only coordinate transactions
+def statements(transaction: Transaction) -> List[Step]:
+    return [s for s in transaction.steps if s.kind != StepKind.YIELD]
+
+
+def actions(transactions: Tuple[Transaction, ...], level: IsolationLevel) -> List[List[Action]]:
+    snapshot = level in (IsolationLevel.REPEATABLE_READ, IsolationLevel.SERIALIZABLE)
+    result = []
+    for (t, transaction) in enumerate(transactions):
+        steps = statements(transaction)
+        writes = frozenset().union(*[_footprint(s) for s in steps if _is_write(s)])
+        # the first statement waits for the serializable transactions running then to end (a safe snapshot)
+        deferrable = transaction.read_only and transaction.deferrable and level == IsolationLevel.SERIALIZABLE
+        acts = []
+        for (i, step) in enumerate(steps):
+            footprint = _footprint(step)
+            if step.kind in (StepKind.COMMIT, StepKind.ROLLBACK):
+                # ending a transaction publishes (or discards) its writes and releases its locks
+                footprint = writes
+            if (snapshot and i == 0) or level == IsolationLevel.SERIALIZABLE:
+                # the first statement takes the snapshot used by all the following ones and serializable
+                # predicate locks may cover the whole table, so these conflict with any write
+                footprint = frozenset([ALL])
+            write = _is_write(step) or step.kind in (StepKind.COMMIT, StepKind.ROLLBACK) or (deferrable and i == 0)
+            acts.append(Action(t, i, write, footprint))
+        result.append(acts)
+
+    return result
+
+
+def independent(a: Action, b: Action) -> bool:
+    if a.transaction == b.transaction:
+        return False
+    if not a.write and not b.write:
+        return True
+    if not a.footprint or not b.footprint:
+        return True
+
+    return ALL not in a.footprint and ALL not in b.footprint and not (a.footprint & b.footprint)
+
+
+def count_interleavings(lengths: List[int]) -> int:
+    total = 1
+    placed = 0
+    for n in lengths:
+        for k in range(1, n + 1):
+            placed += 1
+            total = total * placed // k
+
+    return total
+
+
+# Lexicographically smallest interleaving of each equivalence class (Anisimov-Knuth normal form): an action is only
+# appended if it can't be moved, over the actions it is independent of, before an action of a later transaction.
+def interleavings(acts: List[List[Action]], reduce: bool = True) -> Iterator[Tuple[Action, ...]]:
+    positions = [0] * len(acts)
+    sequence: List[Action] = []
+    total = sum(len(a) for a in acts)
+
+    def extend() -> Iterator[Tuple[Action, ...]]:
+        if len(sequence) == total:
+            yield tuple(sequence)
+            return
+
+        for (t, transaction) in enumerate(acts):
+            if positions[t] == len(transaction):
+                continue
+
+            action = transaction[positions[t]]
+            if reduce and not _in_normal_form(sequence, action):
+                continue
+
+            sequence.append(action)
+            positions[t] += 1
+            yield from extend()
+            positions[t] -= 1
+            sequence.pop()
+
+    yield from extend()
+
+
+def _in_normal_form(sequence: List[Action], action: Action) -> bool:
+    for previous in reversed(sequence):
+        if not independent(previous, action):
+            return True
+        if previous.transaction > action.transaction:
+            return False
+
+    return True
+
+
+async def explore_matrix(
+    anomalies: List[str],
+    isolation_levels: List[str],
+    concurrency: int,
+    limit: int,
+    timeout: float = 2,
+    backend: str = "postgres",
+) -> List[Exploration]:
+    participants = max(len(registry.resolve(anomaly)[0]) for anomaly in anomalies)
+    async with BACKENDS[backend](concurrency, participants) as pool:
+        return await asyncio.gather(*[
+            explore(pool, anomaly, level, limit, timeout) for anomaly in anomalies for level in isolation_levels
+        ])
+
+
+async def explore(
+    pool: SessionPool,
+    anomaly: str,
+    isolation_level: str,
+    limit: int,
+    timeout: float = 2,
+) -> Exploration:
+    transactions = registry.resolve_transactions(anomaly)
+    if transactions is None:
+        raise ValueError(f"Anomaly {anomaly} is not described as a list of steps, it can't be explored")
+
+    level = ISOLATION_LEVELS[isolation_level]
+    acts = actions(transactions, level)
+    total = count_interleavings([len(a) for a in acts])
+    schedules = []
+    truncated = False
+    for interleaving in interleavings(acts):
+        if len(schedules) == limit:
+            truncated = True
+            break
+        schedules.append(tuple(a.transaction for a in interleaving))
+
+    results = await asyncio.gather(*[
+        execute(pool, transactions, schedule, level, timeout) for schedule in schedules
+    ])
+
+    outcomes: Dict[str, List[str]] = {}
+    for (schedule, outcome) in zip(schedules, results):
+        outcomes.setdefault(str(outcome), []).append("".join(str(t + 1) for t in schedule))
+
+    return Exploration(anomaly, isolation_level, total, len(schedules), truncated, outcomes)
+
+
+# Runs the statements of `transactions` in the order given by `schedule` (transaction indexes).
+# When a statement blocks, the following steps of its transaction wait for it while the other transactions go on.
+async def execute(
+    pool: SessionPool,
+    transactions: Tuple[Transaction, ...],
+    schedule: Tuple[int, ...],
+    level: IsolationLevel,
+    timeout: float = 2,
+) -> Outcome:
+    async with pool.session(len(transactions)) as session:
+        session.monitor.scheduled(session.transactions)
+        run = _ScheduleRun(session.transactions, session.monitor, transactions, level, timeout)
+        await run.execute(schedule)
+
+        async with session.transactions[0].cursor(row_factory=tuple_row) as cursor:
+            await cursor.execute("select id, balance from account order by id;")
+            final = tuple(await cursor.fetchall())
+
+        return Outcome(tuple(run.status), tuple(tuple(r) for r in run.reads), final, tuple(run.started))
+
+
+class _ScheduleRun:
+
+    def __init__(
+        self,
+        conns: List[AsyncConnection],
+        monitor: LockMonitor,
+        transactions: Tuple[Transaction, ...],
+        level: IsolationLevel,
+        timeout: float,
+    ):
+        self._conns = conns
+        self._monitor = monitor
+        self._transactions = transactions
+        self._steps = [deque(statements(t)) for t in transactions]
+        self._level = level
+        self._timeout = timeout
+        self._cursors: List[AsyncCursor | None] = [None] * len(transactions)
+        self._values: List[Dict[str, Any]] = [{} for _ in transactions]
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._backlog: List[Deque[Step]] = [deque() for _ in transactions]
+        self.status = ["-"] * len(transactions)
+        self.reads: List[List[Tuple]] = [[] for _ in transactions]
+        self.started: List[Tuple[int, bool]] = []
+
+    async def execute(self, schedule: Tuple[int, ...]):
+        try:
+            for t in schedule:
+                step = self._steps[t].popleft()
+                if t in self._pending or self._backlog[t]:
+                    self._backlog[t].append(step)
+                else:
+                    await self._start(t, step)
+                await self._drain()
+
+            while self._pending:
+                await asyncio.wait(self._pending.values(), timeout=self._timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not any(task.done() for task in self._pending.values()):
+                    raise TimeoutError("Statements still blocked at the end of the schedule")
+                await self._drain()
+        finally:
+            for cursor in self._cursors:
+                if cursor is not None:
+                    await cursor.close()
+
+    # starts a statement and returns once it finished or it is waiting for a lock
+    async def _start(self, t: int, step: Step):
+        if self.status[t] == "ROLLBACK":
+            return
+
+        task = self._monitor.start(self._run_step(t, step))
+        await self._monitor.wait_until_blocked(self._conns[t].info.backend_pid, task, self._timeout)
+        self.started.append((t, not task.done()))
+        if task.done():
+            await self._finish(t, task)
+        else:
+            self._pending[t] = task
+
+    # Finishes the statements that are done and starts the steps that waited for them. A step ending a transaction
+    # (or failing one) releases the statements waiting for it: they first run until they finish or wait for a lock
+    # again, so the next step of the schedule starts after them whatever the backend takes to wake them up.
+    async def _drain(self):
+        progress = True
+        while progress:
+            progress = False
+            for (t, task) in list(self._pending.items()):
+                await self._monitor.wait_until_blocked(self._conns[t].info.backend_pid, task, self._timeout)
+            for (t, task) in list(self._pending.items()):
+                if task.done():
+                    del self._pending[t]
+                    await self._finish(t, task)
+                    progress = True
+
+            for t in range(len(self._backlog)):
+                if t not in self._pending and self._backlog[t]:
+                    await self._start(t, self._backlog[t].popleft())
+                    progress = True
+
+    async def _finish(self, t: int, task: asyncio.Future):
+        try:
+            task.result()
+        except _FAILURES:
+            await self._cursors[t].execute("rollback;")
+            self.status[t] = "ROLLBACK"
+            self._backlog[t].clear()
+
+    async def _run_step(self, t: int, step: Step):
+        cursor = self._cursors[t]
+        if cursor is None:
+            cursor = self._cursors[t] = self._conns[t].cursor()
+            await cursor.execute("begin transaction")
+            modes = access_mode(self._transactions[t].read_only, self._transactions[t].deferrable)
+            await cursor.execute(
+                f"set transaction isolation level {self._level.name.lower().replace('_', ' ')}{modes}"
+            )
+
+        values = self._values[t]
+        query = step.sql.format(**values) if values else step.sql
+        await cursor.execute(query)
+        check_expected(step, cursor.rowcount)
+        match step.kind:
+            case StepKind.SELECT:
+                records = await cursor.fetchall()
+                self.reads[t].append(tuple(tuple(r.values()) for r in records))
+                if step.bind:
+                    values[step.bind] = records[0][step.bind]
+            case StepKind.BLOCKING | StepKind.QUEUED if step.bind:
+                # a locking select
+                records = await cursor.fetchall()
+                self.reads[t].append(tuple(tuple(r.values()) for r in records))
+                values[step.bind] = records[0][step.bind]
+            case StepKind.COMMIT | StepKind.ROLLBACK:
+                self.status[t] = step.kind.name
+
+
+def format_exploration(exploration: Exploration) -> str:
+    lines = [
+        f"{exploration.anomaly} : {exploration.isolation_level} "
+        f"({exploration.total} interleavings, {exploration.explored} explored"
+        f"{', truncated' if exploration.truncated else ''})"
+    ]
+    for (outcome, schedules) in sorted(exploration.outcomes.items(), key=lambda o: -len(o[1])):
+        lines.append(f"  {len(schedules):>5} x {outcome}")
+        lines.append("          " + " ".join(schedules))
+
+    return "\n".join(lines)
+
+
+def _is_write(step: Step) -> bool:
+    if step.kind == StepKind.SELECT:
+        return _LOCKING.search(step.sql) is not None
+    return step.kind in (StepKind.MODIFY, StepKind.BLOCKING, StepKind.QUEUED)
+
+
+def _footprint(step: Step) -> FrozenSet:
+    if step.sql is None or step.kind in (StepKind.COMMIT, StepKind.ROLLBACK):
+        return frozenset()
+    if step.sql.lstrip().lower().startswith("insert"):
+        return frozenset([ALL])
+
+    match = _ROW_ID.search(step.sql)
+    if match:
+        return frozenset([int(match.group(1))])
+
+    return frozenset([ALL])
+
+
+def _format_row(row: Tuple[Any, ...]) -> str:
+    return "(" + ",".join("NULL" if v is None else str(v) for v in row) + ")" if len(row) > 1 else str(row[0])
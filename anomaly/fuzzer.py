@@ -0,0 +1,484 @@
+import asyncio
+import itertools
+import random
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from psycopg import IsolationLevel
+
+from anomaly.dataset import Dataset
+from anomaly.explorer import Outcome, execute, statements
+from anomaly.pool import SessionPool
+from anomaly.runner import ISOLATION_LEVELS, create_pool
+from anomaly.steps import Step, StepKind, Transaction, blocking, commit, modify, select, transaction, yield_to
+from anomaly.table import format_table
+
+
+# Random transaction programs over the `account` table, run with a random interleaving of their statements at every
+# isolation level (see `anomaly.explorer.execute`), and checked by oracles:
+# - serializability: the reads of the committed transactions and the final table are the ones of running them one
+#   after the other, in some order (rows inserted by the transactions are compared by balance, their ids depend on the
+#   order they were inserted in)
+# - lost-update: every row ends up with its initial balance plus the transfers of the committed transactions
+# - balance-sum: the table adds up to its initial balance, as every operation moves money without creating any
+#
+# Operations (`OPERATIONS`) are point reads, range predicates (like `phantom_read`), sums, transfers between two rows
+# (blind or read-modify-write), opening an account (insert) with money taken from a row, and closing one (delete)
+# after moving its balance to another row. Accounts that get closed are left out of the other writes, so that any
+# serial execution keeps the oracles true and a failure is the isolation level at work.
+#
+# Case `seed` is generated from `random.Random(seed)` alone, the same programs and interleaving at every level, so
+# any failing case is run again with its seed. A failing case is shrunk as long as the same oracle still fails: removing
+# transactions and operations, narrowing reads (point reads instead of ranges and sums, ranges over fewer rows) and
+# running the statements of a transaction in fewer runs, then printed as a scenario to register (see `format_scenario`).
+
+SERIALIZABILITY = "serializability"
+LOST_UPDATE = "lost-update"
+BALANCE_SUM = "balance-sum"
+ORACLES = (SERIALIZABILITY, LOST_UPDATE, BALANCE_SUM)
+
+READ = "read"
+PREDICATE = "predicate"
+SUM = "sum"
+TRANSFER = "transfer"
+READ_MODIFY_WRITE = "read-modify-write"
+OPEN = "open"
+CLOSE = "close"
+OPERATIONS = (READ, PREDICATE, SUM, TRANSFER, READ_MODIFY_WRITE, OPEN, CLOSE)
+
+# rows of the table when the fuzzer is not given a dataset
+ROWS = 4
+
+_MAX_TRANSACTIONS = 3
+_MAX_OPERATIONS = 3
+_MAX_AMOUNT = 20
+
+
+class Operation(NamedTuple):
+    kind: str
+    steps: Tuple[Step, ...]
+    # TRANSFER, READ_MODIFY_WRITE and CLOSE: from `source` to `target`, OPEN: from `source`
+    source: int | None = None
+    target: int | None = None
+    # moved by TRANSFER, READ_MODIFY_WRITE and OPEN, CLOSE moves the balance it reads
+    amount: int = 0
+    # PREDICATE: reads the rows with a greater balance
+    bound: int | None = None
+
+
+class Case(NamedTuple):
+    seed: int
+    transactions: Tuple[Tuple[Operation, ...], ...]
+    # transaction of every statement, in the order they run
+    schedule: Tuple[int, ...]
+
+    @property
+    def size(self) -> int:
+        return len(self.schedule)
+
+
+class CaseResult(NamedTuple):
+    case: Case
+    isolation_level: str
+    outcome: Outcome | None
+    # oracle -> what it saw
+    violations: Dict[str, str]
+    error: str | None = None
+
+
+class Finding(NamedTuple):
+    oracle: str
+    isolation_level: str
+    # shrunk case, and the result of running it
+    result: CaseResult
+    # statements of the case first found
+    original: int
+    runs: int
+
+
+class FuzzReport(NamedTuple):
+    seeds: range
+    results: List[CaseResult]
+    findings: List[Finding]
+
+
+def generate(seed: int, rows: int = ROWS) -> Case:
+    rng = random.Random(seed)
+    ids = list(range(1, rows + 1))
+    # accounts that may be closed, at most one operation each, the others can be written to
+    closable = rng.sample(ids, rng.randint(0, max(0, rows - 2)))
+    accounts = [i for i in ids if i not in closable]
+
+    transactions = []
+    for _ in range(rng.randint(2, _MAX_TRANSACTIONS)):
+        operations = []
+        for _ in range(rng.randint(1, _MAX_OPERATIONS)):
+            kinds = [READ, PREDICATE, SUM, OPEN, TRANSFER, READ_MODIFY_WRITE]
+            if closable:
+                kinds.append(CLOSE)
+            operations.append(_operation(rng, rng.choice(kinds), ids, accounts, closable))
+        transactions.append(tuple(operations))
+
+    # every interleaving of the statements is as likely
+    remaining = [len(_transaction(operations).steps) for operations in transactions]
+    schedule = []
+    while any(remaining):
+        t = rng.choices(range(len(remaining)), weights=remaining)[0]
+        remaining[t] -= 1
+        schedule.append(t)
+
+    return Case(seed, tuple(transactions), tuple(schedule))
+
+
+def _operation(rng: random.Random, kind: str, ids: List[int], accounts: List[int], closable: List[int]) -> Operation:
+    amount = rng.randint(1, _MAX_AMOUNT)
+    match kind:
+        case "read":
+            return _read(rng.choice(ids))
+        case "predicate":
+            return _predicate(rng.randint(0, 70))
+        case "sum":
+            return Operation(kind, (select("select sum(balance) from account;"),))
+        case "open":
+            source = rng.choice(accounts)
+            steps = (
+                modify(f"update account set balance = balance - {amount} where id = {source};"),
+                modify(f"insert into account (balance) values ({amount});"),
+            )
+            return Operation(kind, steps, source, amount=amount)
+        case "transfer":
+            (source, target) = rng.sample(accounts, 2)
+            steps = (
+                modify(f"update account set balance = balance - {amount} where id = {source};"),
+                modify(f"update account set balance = balance + {amount} where id = {target};"),
+            )
+            return Operation(kind, steps, source, target, amount)
+        case "read-modify-write":
+            (source, target) = rng.sample(accounts, 2)
+            steps = (
+                select(f"select balance from account where id = {source};", bind="balance"),
+                modify(f"update account set balance = {{balance}} - {amount} where id = {source};"),
+                modify(f"update account set balance = balance + {amount} where id = {target};"),
+            )
+            return Operation(kind, steps, source, target, amount)
+        case "close":
+            (source, target) = (closable.pop(), rng.choice(accounts))
+            steps = (
+                select(f"select balance from account where id = {source};", bind="balance"),
+                modify(f"update account set balance = balance + {{balance}} where id = {target};"),
+                modify(f"delete from account where id = {source};"),
+            )
+            return Operation(kind, steps, source, target)
+        case _:
+            raise ValueError(f"Unknown operation {kind}")
+
+
+def _read(id: int) -> Operation:
+    return Operation(READ, (select(f"select balance from account where id = {id};"),))
+
+
+def _predicate(bound: int) -> Operation:
+    query = f"select balance from account where balance > {bound} order by balance;"
+    return Operation(PREDICATE, (select(query),), bound=bound)
+
+
+def _transaction(operations: Tuple[Operation, ...]) -> Transaction:
+    return transaction(*[step for operation in operations for step in operation.steps], commit())
+
+
+async def fuzz(
+    seeds: range,
+    isolation_levels: List[str],
+    concurrency: int,
+    dataset: Dataset,
+    timeout: float = 2,
+    backend: str = "postgres",
+    shrink: bool = True,
+) -> FuzzReport:
+    async with create_pool(backend, concurrency, _MAX_TRANSACTIONS, dataset=dataset) as pool:
+        cases = [generate(seed, dataset.rows) for seed in seeds]
+        initial = dict(enumerate(dataset.balances(), 1))
+        results = await asyncio.gather(*[
+            run_case(pool, case, level, initial, timeout) for case in cases for level in isolation_levels
+        ])
+
+        # the first (smallest) failing case of every oracle and level
+        first: Dict[Tuple[str, str], CaseResult] = {}
+        for result in sorted(results, key=lambda r: r.case.size):
+            for oracle in result.violations:
+                first.setdefault((oracle, result.isolation_level), result)
+        findings = []
+        if shrink:
+            findings = await asyncio.gather(*[
+                _shrink(pool, result, oracle, initial, timeout) for ((oracle, _), result) in first.items()
+            ])
+
+    return FuzzReport(seeds, results, sorted(findings, key=lambda f: (f.oracle, f.isolation_level)))
+
+
+async def run_case(
+    pool: SessionPool,
+    case: Case,
+    isolation_level: str,
+    initial: Dict[int, int],
+    timeout: float = 2,
+) -> CaseResult:
+    level = ISOLATION_LEVELS[isolation_level]
+    transactions = tuple(_transaction(operations) for operations in case.transactions)
+    try:
+        outcome = await execute(pool, transactions, case.schedule, level, timeout)
+        violations = _check(case, outcome, initial)
+        if not await _serializable(pool, transactions, outcome, level, initial, timeout):
+            violations[SERIALIZABILITY] = "no serial order of the committed transactions gives the same reads and table"
+    except Exception as exc:
+        return CaseResult(case, isolation_level, None, {}, f"{exc.__class__.__name__}: {exc}")
+
+    return CaseResult(case, isolation_level, outcome, violations)
+
+
+def _check(case: Case, outcome: Outcome, initial: Dict[int, int]) -> Dict[str, str]:
+    expected = dict(initial)
+    closed = set()
+    for (t, operations) in enumerate(case.transactions):
+        if outcome.status[t] != "COMMIT":
+            continue
+        reads = iter(outcome.reads[t])
+        for operation in operations:
+            values = [next(reads) for step in operation.steps if step.kind == StepKind.SELECT]
+            match operation.kind:
+                case "transfer" | "read-modify-write":
+                    expected[operation.source] -= operation.amount
+                    expected[operation.target] += operation.amount
+                case "open":
+                    expected[operation.source] -= operation.amount
+                case "close":
+                    expected[operation.target] += values[0][0][0]
+                    closed.add(operation.source)
+
+    violations = {}
+    final = dict(outcome.final)
+    lost = [
+        f"{id}: {final.get(id)} instead of {balance}"
+        for (id, balance) in expected.items() if id not in closed and final.get(id) != balance
+    ]
+    if lost:
+        violations[LOST_UPDATE] = ", ".join(lost)
+    total = sum(balance for (_, balance) in outcome.final)
+    if total != sum(initial.values()):
+        violations[BALANCE_SUM] = f"{total} instead of {sum(initial.values())}"
+    return violations
+
+
+# runs the committed transactions alone, in every order, until one gives the same reads and table
+async def _serializable(
+    pool: SessionPool,
+    transactions: Tuple[Transaction, ...],
+    outcome: Outcome,
+    level: IsolationLevel,
+    initial: Dict[int, int],
+    timeout: float,
+) -> bool:
+    committed = [t for (t, status) in enumerate(outcome.status) if status == "COMMIT"]
+    if not committed:
+        return _table(outcome.final, initial) == _table(tuple(initial.items()), initial)
+
+    for order in itertools.permutations(committed):
+        schedule = tuple(i for (i, t) in enumerate(order) for _ in statements(transactions[t]))
+        serial = await execute(pool, tuple(transactions[t] for t in order), schedule, level, timeout)
+        if (
+            all(serial.reads[i] == outcome.reads[t] for (i, t) in enumerate(order))
+            and _table(serial.final, initial) == _table(outcome.final, initial)
+        ):
+            return True
+    return False
+
+
+# rows of the initial table by id, the inserted ones by balance
+def _table(rows: Tuple[Tuple[Any, ...], ...], initial: Dict[int, int]) -> Tuple[Tuple, Tuple]:
+    return (
+        tuple(row for row in rows if row[0] in initial),
+        tuple(sorted(row[1] for row in rows if row[0] not in initial)),
+    )
+
+
+# Replaces the case by a smaller candidate (see `_candidates`) as long as `oracle` still fails, until none of them does.
+async def _shrink(
+    pool: SessionPool,
+    result: CaseResult,
+    oracle: str,
+    initial: Dict[int, int],
+    timeout: float,
+) -> Finding:
+    (original, runs) = (result.case.size, 0)
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for candidate in _candidates(result.case, initial):
+            runs += 1
+            attempt = await run_case(pool, candidate, result.isolation_level, initial, timeout)
+            if oracle in attempt.violations:
+                (result, shrunk) = (attempt, True)
+                break
+
+    return Finding(oracle, result.isolation_level, result, original, runs)
+
+
+# Cases a little smaller than `case`, the ones with fewer statements first: without a transaction or an operation, with
+# a read narrowed (a range or a sum read by id, a range over the rows of `initial` above a greater balance), or with
+# the statements of a transaction in fewer runs. Each of them makes the case smaller in one of these ways without
+# undoing any other, so shrinking ends.
+def _candidates(case: Case, initial: Dict[int, int]) -> List[Case]:
+    candidates = []
+    if len(case.transactions) > 2:
+        candidates += [_without(case, t, None) for t in range(len(case.transactions))]
+    for (t, operations) in enumerate(case.transactions):
+        if len(operations) > 1:
+            candidates += [_without(case, t, i) for i in range(len(operations))]
+
+    for (t, operations) in enumerate(case.transactions):
+        for (i, operation) in enumerate(operations):
+            if operation.kind in (PREDICATE, SUM):
+                candidates += [_replaced(case, t, i, _read(id)) for id in initial]
+            if operation.kind == PREDICATE:
+                bounds = sorted({b for b in initial.values() if b > operation.bound})
+                candidates += [_replaced(case, t, i, _predicate(b)) for b in bounds]
+
+    candidates += _merged(case)
+    return candidates
+
+
+# the case without transaction `t`, or only without its operation `operation`, the other statements in the same order
+def _without(case: Case, t: int, operation: int | None) -> Case:
+    if operation is None:
+        transactions = case.transactions[:t] + case.transactions[t + 1:]
+        schedule = tuple(u if u < t else u - 1 for u in case.schedule if u != t)
+        return Case(case.seed, transactions, schedule)
+
+    operations = case.transactions[t]
+    start = sum(len(o.steps) for o in operations[:operation])
+    removed = range(start, start + len(operations[operation].steps))
+    schedule = []
+    position = 0
+    for u in case.schedule:
+        if u == t:
+            position += 1
+            if position - 1 in removed:
+                continue
+        schedule.append(u)
+    operations = operations[:operation] + operations[operation + 1:]
+    transactions = (*case.transactions[:t], operations, *case.transactions[t + 1:])
+    return Case(case.seed, transactions, tuple(schedule))
+
+
+# the case with operation `operation` of transaction `t` replaced by `replacement`, which has as many statements
+def _replaced(case: Case, t: int, operation: int, replacement: Operation) -> Case:
+    operations = (*case.transactions[t][:operation], replacement, *case.transactions[t][operation + 1:])
+    return case._replace(transactions=(*case.transactions[:t], operations, *case.transactions[t + 1:]))
+
+
+# The case with the statements of a run of the schedule (consecutive statements of a transaction) moved right after
+# the previous run of the same transaction, for every run but the first ones: one run less, and the statements of every
+# transaction in the same order.
+def _merged(case: Case) -> List[Case]:
+    runs = [(t, len(list(group))) for (t, group) in itertools.groupby(case.schedule)]
+    cases = []
+    for (k, (t, count)) in enumerate(runs):
+        previous = next((j for j in range(k - 1, -1, -1) if runs[j][0] == t), None)
+        if previous is None:
+            continue
+        merged = runs[:previous] + [(t, runs[previous][1] + count)] + runs[previous + 1:k] + runs[k + 1:]
+        schedule = tuple(u for (u, n) in merged for _ in range(n))
+        cases.append(case._replace(schedule=schedule))
+    return cases
+
+
+def format_report(report: FuzzReport, isolation_levels: List[str]) -> str:
+    records = []
+    for level in isolation_levels:
+        results = [r for r in report.results if r.isolation_level == level]
+        record: Dict[str, Any] = {"isolation level": level, "cases": len(results)}
+        for oracle in ORACLES:
+            record[oracle] = sum(1 for r in results if oracle in r.violations)
+        record["errors"] = sum(1 for r in results if r.error is not None)
+        records.append(record)
+
+    lines = [format_table(records, None)]
+    for r in report.results:
+        if r.error is not None:
+            lines.append(f"seed {r.case.seed}, {r.isolation_level}: {r.error}")
+    # the same shrunk case can fail several oracles, at several levels
+    cases: Dict[Tuple, List[Finding]] = {}
+    for finding in report.findings:
+        case = finding.result.case
+        cases.setdefault((case.transactions, case.schedule), []).append(finding)
+    for findings in cases.values():
+        (first, case) = (findings[0], findings[0].result.case)
+        lines.append("")
+        for finding in findings:
+            lines.append(
+                f"{finding.oracle} at {finding.isolation_level}, seed {finding.result.case.seed}: shrunk from "
+                f"{finding.original} statements to {finding.result.case.size} in {finding.runs} runs"
+            )
+        lines.append(format_scenario(first, f"fuzz-{case.seed}"))
+    return "\n".join(lines)
+
+
+# Source of a module registering the case of `finding` as an example: the statements of every transaction, in the
+# order they started when the case ran, with `yield_to` steps between them (`blocking` for the ones that waited for a
+# lock), transactions numbered in the order they start. The scheduler of the examples may still order them a little
+# differently around locks, `main.py --explore` runs every interleaving, the one of the case included.
+def format_scenario(finding: Finding, name: str) -> str:
+    (case, outcome) = (finding.result.case, finding.result.outcome)
+    order = list(dict.fromkeys(case.schedule))
+    names = {t: f"T{i + 1}" for (i, t) in enumerate(order)}
+    steps = {t: statements(_transaction(case.transactions[t])) for t in order}
+
+    lines: Dict[int, List[str]] = {t: [] for t in order}
+    positions = dict.fromkeys(order, 0)
+    for (k, (t, blocked)) in enumerate(outcome.started):
+        step = steps[t][positions[t]]
+        positions[t] += 1
+        following = next((u for (u, _) in outcome.started[k + 1:] if u != t), None)
+        if blocked and following is not None:
+            lines[t].append(_source(blocking(step.sql, to=names[following])))
+            continue
+        lines[t].append(_source(step))
+        if following is not None and outcome.started[k + 1][0] != t and step.kind != StepKind.COMMIT:
+            lines[t].append(_source(yield_to(names[following])))
+    # statements of rolled back transactions that did not run
+    for t in order:
+        lines[t] += [_source(step) for step in steps[t][positions[t]:]]
+
+    interleaving = "".join(names[t][1:] for t in case.schedule)
+    source = [
+        "from anomaly.steps import blocking, commit, modify, select, transaction, yield_to",
+        "from anomaly import registry",
+        "",
+        "",
+        "registry.register_transactions(",
+        f'    "{name}",',
+        *[
+            "    transaction(\n" + "".join(f"        {line},\n" for line in lines[t]) + "    ),"
+            for t in order
+        ],
+        '    description="""',
+        f"Found by the fuzzer (seed {case.seed}) at {finding.isolation_level}, interleaving {interleaving}:",
+        f"{finding.oracle}: {finding.result.violations[finding.oracle]}",
+        '""",',
+        ")",
+    ]
+    return "\n".join(source)
+
+
+def _source(step: Step) -> str:
+    match step.kind:
+        case StepKind.SELECT:
+            bind = f', bind="{step.bind}"' if step.bind else ""
+            return f'select("{step.sql}"{bind})'
+        case StepKind.BLOCKING:
+            return f'blocking("{step.sql}", to="{step.to}")'
+        case StepKind.YIELD:
+            return f'yield_to("{step.to}")'
+        case StepKind.COMMIT:
+            return "commit()"
+        case _:
+            return f'modify("{step.sql}")'
@@ -0,0 +1,162 @@
+import json
+from array import array
+from typing import Any, Dict, Iterator, List, NamedTuple, TextIO, Tuple
+
+
+# Statements run by the transactions, stored as columns of fixed size values (about 50 bytes per statement) instead of
+# one object per statement, so the history of long runs fits in memory.
+# Strings (transaction names, queries, error classes) are stored once and referenced by index.
+
+
+class Event(NamedTuple):
+    run: int
+    anomaly: str
+    isolation_level: str
+    transaction: str
+    # number of the step in the printed output of the run
+    seq: int
+    sql: str
+    # rows returned by a select, or changed by an update/insert/delete
+    read: int
+    written: int
+    # time.monotonic() seconds, `end` is when the transaction went on after the statement
+    start: float
+    end: float
+    # seconds the statement spent waiting for a lock
+    blocked: float
+    # class of the error raised by the statement, if any
+    error: str | None
+
+
+class History:
+
+    _runs: List[Tuple[str, str]]
+    _strings: List[str]
+    _string_ids: Dict[str, int]
+
+    def __init__(self):
+        self._runs = []
+        # index 0 stands for "no string"
+        self._strings = [""]
+        self._string_ids = {"": 0}
+        self._run = array("I")
+        self._transaction = array("I")
+        self._seq = array("I")
+        self._sql = array("I")
+        self._read = array("i")
+        self._written = array("i")
+        self._start = array("d")
+        self._end = array("d")
+        self._blocked = array("d")
+        self._error = array("I")
+
+    # returns the id to record the statements of a new run with
+    def start_run(self, anomaly: str, isolation_level: str) -> int:
+        self._runs.append((anomaly, isolation_level))
+        return len(self._runs) - 1
+
+    def record(
+        self,
+        run: int,
+        transaction: str,
+        seq: int,
+        sql: str,
+        read: int,
+        written: int,
+        start: float,
+        end: float,
+        blocked: float = 0.0,
+        error: str | None = None,
+    ) -> None:
+        self._run.append(run)
+        self._transaction.append(self._string(transaction))
+        self._seq.append(seq)
+        self._sql.append(self._string(sql))
+        self._read.append(read)
+        self._written.append(written)
+        self._start.append(start)
+        self._end.append(end)
+        self._blocked.append(blocked)
+        self._error.append(self._string(error) if error else 0)
+
+    def __len__(self) -> int:
+        return len(self._seq)
+
+    def __getitem__(self, i: int) -> Event:
+        (anomaly, isolation_level) = self._runs[self._run[i]]
+        error = self._error[i]
+        return Event(
+            self._run[i],
+            anomaly,
+            isolation_level,
+            self._strings[self._transaction[i]],
+            self._seq[i],
+            self._strings[self._sql[i]],
+            self._read[i],
+            self._written[i],
+            self._start[i],
+            self._end[i],
+            self._blocked[i],
+            self._strings[error] if error else None,
+        )
+
+    def __iter__(self) -> Iterator[Event]:
+        return (self[i] for i in range(len(self)))
+
+    def write_ndjson(self, out: TextIO) -> None:
+        for event in self:
+            out.write(json.dumps(event._asdict()))
+            out.write("\n")
+
+    # needs pyarrow, which is not a dependency of the project; columns are handed over without copying them
+    def to_arrow(self) -> Any:
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+        except ImportError as exc:
+            raise RuntimeError("Exporting the history to Arrow or Parquet needs pyarrow (pip install pyarrow)") from exc
+
+        def column(values: array, type: Any) -> Any:
+            return pa.Array.from_buffers(type, len(values), [None, pa.py_buffer(values)])
+
+        def text(indices: Any, strings: List[str]) -> Any:
+            return pa.DictionaryArray.from_arrays(indices, pa.array(strings, pa.string()))
+
+        run = column(self._run, pa.uint32())
+        error = column(self._error, pa.uint32())
+        return pa.table({
+            "run": run,
+            "anomaly": text(run, [r[0] for r in self._runs]),
+            "isolation_level": text(run, [r[1] for r in self._runs]),
+            "transaction": text(column(self._transaction, pa.uint32()), self._strings),
+            "seq": column(self._seq, pa.uint32()),
+            "sql": text(column(self._sql, pa.uint32()), self._strings),
+            "read": column(self._read, pa.int32()),
+            "written": column(self._written, pa.int32()),
+            "start": column(self._start, pa.float64()),
+            "end": column(self._end, pa.float64()),
+            "blocked": column(self._blocked, pa.float64()),
+            "error": text(pc.if_else(pc.equal(error, 0), None, error), self._strings),
+        })
+
+    # the format follows the extension: .parquet, .arrow (IPC file) or NDJSON for anything else
+    def write(self, path: str) -> None:
+        if path.endswith(".parquet"):
+            table = self.to_arrow()
+            import pyarrow.parquet as pq
+            pq.write_table(table, path)
+        elif path.endswith(".arrow"):
+            import pyarrow as pa
+            table = self.to_arrow()
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            with open(path, "w") as out:
+                self.write_ndjson(out)
+
+    def _string(self, value: str) -> int:
+        id = self._string_ids.get(value)
+        if id is None:
+            id = self._string_ids[value] = len(self._strings)
+            self._strings.append(value)
+        return id
@@ -0,0 +1,269 @@
+from anomaly.steps import Transaction, blocking, commit, modify, select, transaction, yield_to
+from anomaly import registry
+
+
+# Ways of incrementing the same counter (the balance of account 1) from concurrent transactions. Each one is an example
+# of two transactions, and a benchmark with `--stress`, where the clients run T1 and T2 in turn:
+#
+#   python main.py --stress -a hot-row-for-update -l read-committed --clients 1,4,16,64
+#
+# compares commits/s, p99 and failures as the clients contending for the row grow.
+
+
+# the database computes the new balance, under the lock of the update
+ATOMIC_T1 = transaction(
+    modify("update account set balance = balance + 1 where id = 1;"),
+    yield_to(),
+    commit(),
+)
+
+ATOMIC_T2 = transaction(
+    # this will lock until T1 commits
+    blocking("update account set balance = balance + 1 where id = 1;"),
+    commit(),
+    select("select balance from account where id = 1;"),
+)
+
+
+registry.register_transactions("hot-row-atomic", ATOMIC_T1, ATOMIC_T2, description="""
+T1 and T2 increment the same balance with `balance = balance + 1`: T2 waits for the row lock of T1, then
+`read committed` increments the value T1 committed, no increment is lost. `repeatable read` and `serializable` fail
+T2 instead, the row changed after its snapshot: with them, even atomic increments have to be retried (`--retry`).
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──update balance + 1───────────────────────►│
+   │                   │                        │
+   │                   ├──update balance + 1───►│ blocks on T1
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   │                        │ T2 updates, or raises an error for `repeatable read`
+   │                   │                        │ and `serializable`
+   │                   ├──commit/rollback──────►│
+   │                   │                        │
+""")
+
+
+# the application computes the new balance from the one it read, with no lock in between
+READ_MODIFY_WRITE_T1 = transaction(
+    select("select balance from account where id = 1;", bind="balance"),
+    yield_to(),
+    modify("update account set balance = {balance} + 1 where id = 1;"),
+    commit(),
+    yield_to(),
+)
+
+READ_MODIFY_WRITE_T2 = transaction(
+    select("select balance from account where id = 1;", bind="balance"),
+    yield_to(),
+    modify("update account set balance = {balance} + 1 where id = 1;"),
+    commit(),
+    select("select balance from account where id = 1;"),
+)
+
+
+registry.register_transactions("hot-row-read-modify-write", READ_MODIFY_WRITE_T1, READ_MODIFY_WRITE_T2, description="""
+T1 and T2 read the balance, then write it back incremented: with `read committed` T2 overwrites the increment of T1
+(lost update). `repeatable read` and `serializable` fail T2, which has to start over (`--retry`) and read the balance
+again: correct, at the cost of the work thrown away, which grows with the number of clients.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──select balance───────────────────────────►│
+   │                   │                        │
+   │                   ├──select balance───────►│
+   │                   │                        │
+   ├──update balance = read + 1────────────────►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   ├──update balance───────►│ raises an error for `repeatable read` and `serializable`
+   │                   │                        │
+   │                   ├──commit/rollback──────►│ loses the increment of T1 for `read committed`
+   │                   │                        │
+""")
+
+
+# the read locks the row, the other transaction waits before reading it
+FOR_UPDATE_T1 = transaction(
+    select("select balance from account where id = 1 for update;", bind="balance"),
+    yield_to(),
+    modify("update account set balance = {balance} + 1 where id = 1;"),
+    commit(),
+)
+
+FOR_UPDATE_T2 = transaction(
+    # this will lock until T1 commits
+    blocking("select balance from account where id = 1 for update;", bind="balance"),
+    modify("update account set balance = {balance} + 1 where id = 1;"),
+    commit(),
+    select("select balance from account where id = 1;"),
+)
+
+
+registry.register_transactions("hot-row-for-update", FOR_UPDATE_T1, FOR_UPDATE_T2, description="""
+T1 and T2 read the balance with `select ... for update`, which locks the row: T2 waits for T1 to commit, then
+`read committed` reads the balance T1 committed and no increment is lost. `repeatable read` and `serializable` fail
+T2, the row changed after its snapshot.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──select balance for update────────────────►│
+   │                   │                        │
+   │                   ├──select for update────►│ blocks on T1
+   │                   │                        │
+   ├──update balance = read + 1────────────────►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   │                        │ T2 reads the balance of T1, or raises an error for
+   │                   │                        │ `repeatable read` and `serializable`
+   │                   ├──update balance───────►│
+   │                   │                        │
+   │                   ├──commit/rollback──────►│
+   │                   │                        │
+""")
+
+
+# optimistic: no lock while computing, the update only applies if the version of the row didn't change since it was
+# read, every update incrementing it
+VERSION_T1 = transaction(
+    select("select balance, version from account where id = 1;", bind="version"),
+    yield_to(),
+    modify(
+        "update account set balance = balance + 1, version = version + 1 where id = 1 and version = {version};",
+        expect=1,
+    ),
+    commit(),
+    yield_to(),
+)
+
+VERSION_T2 = transaction(
+    select("select balance, version from account where id = 1;", bind="version"),
+    yield_to(),
+    modify(
+        "update account set balance = balance + 1, version = version + 1 where id = 1 and version = {version};",
+        expect=1,
+    ),
+    commit(),
+    select("select balance, version from account where id = 1;"),
+)
+
+
+registry.register_transactions("hot-row-version", VERSION_T1, VERSION_T2, description="""
+T1 and T2 read the version of the row and update it only if it is still the one they read, incrementing it (compare
+and set): T2 modifies no row once T1 committed, and fails instead of losing the increment of T1, with every isolation
+level. Unlike comparing the balance itself, a balance changed and changed back (ABA) still changed the version. Like
+a serialization failure, the failure is retried with `--retry`.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──select version───────────────────────────►│
+   │                   │                        │
+   │                   ├──select version───────►│
+   │                   │                        │
+   ├──update, version + 1 where version = read─►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   ├──update if unchanged──►│ modifies no row (or raises an error for `repeatable read`
+   │                   │                        │ and `serializable`), T2 fails
+   │                   ├──rollback─────────────►│
+   │                   │                        │
+""")
+
+
+# an advisory lock serializes the transactions, taken before reading the balance
+ADVISORY_T1 = transaction(
+    select("select pg_advisory_xact_lock(1);"),
+    select("select balance from account where id = 1;", bind="balance"),
+    yield_to(),
+    modify("update account set balance = {balance} + 1 where id = 1;"),
+    commit(),
+)
+
+ADVISORY_T2 = transaction(
+    # this will lock until T1 commits
+    blocking("select pg_advisory_xact_lock(1);"),
+    select("select balance from account where id = 1;", bind="balance"),
+    modify("update account set balance = {balance} + 1 where id = 1;"),
+    commit(),
+    select("select balance from account where id = 1;"),
+)
+
+
+registry.register_transactions("hot-row-advisory", ADVISORY_T1, ADVISORY_T2, description="""
+T1 and T2 take the same advisory lock (`pg_advisory_xact_lock`, released when the transaction ends) before reading the
+balance: T2 waits for T1 to commit, then `read committed` reads the balance T1 committed. With `repeatable read` and
+`serializable`, the snapshot of T2 was taken by the statement waiting for the lock, before T1 committed: T2 reads the
+old balance and its update fails, the lock serializes nothing.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──pg_advisory_xact_lock(1)─────────────────►│
+   │                   │                        │
+   ├──select balance───────────────────────────►│
+   │                   │                        │
+   │                   ├──pg_advisory_xact_lock►│ blocks on T1
+   │                   │                        │
+   ├──update balance = read + 1────────────────►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   ├──select balance───────►│ reads the balance before T1 for `repeatable read` and
+   │                   │                        │ `serializable`
+   │                   ├──update balance───────►│ raises an error for `repeatable read` and `serializable`
+   │                   │                        │
+   │                   ├──commit/rollback──────►│
+   │                   │                        │
+""")
+
+
+# rows the counter is split in (shards), accounts 1 to SHARDS: the dataset needs as many rows, the default one has 2
+SHARDS = 2
+
+
+# The counter is the sum of the shards, transaction i increments shard i and the last one reads the counter. With
+# `--stress`, client i runs transaction i mod SHARDS, so it increments shard i mod SHARDS + 1.
+def _sharded(shard: int) -> Transaction:
+    steps = [
+        modify(f"update account set balance = balance + 1 where id = {shard};"),
+        yield_to(),
+        commit(),
+    ]
+    if shard == SHARDS:
+        steps.append(select(f"select sum(balance) from account where id <= {SHARDS};"))
+    return transaction(*steps)
+
+
+registry.register_transactions("hot-row-sharded", *[_sharded(i) for i in range(1, SHARDS + 1)], description=f"""
+The counter is split in {SHARDS} rows, the first {SHARDS} accounts (shards), and its value is their sum: every
+transaction increments its own shard, so none waits for the others nor fails, with every isolation level. Reading the
+counter costs a sum over the shards instead.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──update shard 1 + 1───────────────────────►│
+   │                   │                        │
+   │                   ├──update shard 2 + 1───►│ doesn't wait for T1
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   ├──commit───────────────►│
+   │                   │                        │
+   │                   ├──select sum(balance)──►│
+   │                   │                        │
+""")
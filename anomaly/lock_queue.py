@@ -0,0 +1,44 @@
+from anomaly.steps import commit, modify, queued, transaction, yield_to
+from anomaly import registry
+
+
+# how many transactions queue up for the row locked by T1
+DEPTH = 10
+
+
+HOLDER = transaction(
+    modify("update account set balance = balance + 1 where id = 1;"),
+    # the token comes back once every waiter is blocked
+    yield_to(),
+    commit(),
+)
+
+WAITER = transaction(
+    # this will lock until every transaction ahead in the queue commits or rolls back
+    queued("update account set balance = balance + 1 where id = 1;"),
+    commit(),
+)
+
+
+registry.register_transactions("lock-queue", HOLDER, *[WAITER] * DEPTH, description=f"""
+T1 updates a row and, before it commits, {DEPTH} other transactions try to update the same row, queueing up for its lock.
+Once T1 commits, the queue drains one transaction at a time: for `read committed` each one updates the latest value,
+for `repeatable read` and `serializable` they fail, since the row was changed after their snapshot.
+
+┌────┐          ┌────┐  ┌─────┐            ┌────┐
+│ T1 │          │ T2 │  │ T.. │            │ DB │
+└──┬─┘          └──┬─┘  └──┬──┘            └──┬─┘
+   │               │       │                  │
+   ├──────update balance──────────────────────►│
+   │               │       │                  │
+   │               ├───update balance─────────►│ blocks on T1
+   │               │       │                  │
+   │               │       ├──update balance──►│ blocks on T2 (and so on)
+   │               │       │                  │
+   ├───commit──────┼───────┼──────────────────►│
+   │               │       │                  │
+   │               ├──commit/rollback─────────►│
+   │               │       │                  │
+   │               │       ├─commit/rollback──►│
+   │               │       │                  │
+""")
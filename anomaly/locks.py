@@ -0,0 +1,200 @@
+from asyncio import Event, wait_for
+from typing import Callable, Dict, List, NamedTuple, Set, Tuple
+
+from psycopg import AsyncConnection
+from psycopg.rows import tuple_row
+
+from anomaly.table import format_table
+
+
+# Locks taken by the transactions of a run (--locks): a side connection polls pg_locks and pg_blocking_pids every
+# `interval` seconds while they run. Locks on the tables and indexes of the run's schema are counted by granularity
+# (relation, page, tuple), the predicate locks of serializable transactions (SIReadLock) apart from the others.
+# Between two samples:
+# - predicate locks of a transaction on a relation that got coarser (fewer locks of a finer granularity for more of a
+#   coarser one, or page locks on a table, which are never taken directly) were escalated, as PostgreSQL does past
+#   max_pred_locks_per_page / max_pred_locks_per_relation or when the predicate lock table is full
+# - transactions start waiting for others (for their locks, or for a safe snapshot)
+# Both are reported as soon as they are seen, to be printed along the steps of the run, and the peak counts of every
+# transaction are summed up at the end (see `format_locks`). Whatever lasts less than `interval` can go unseen.
+# Locks are counted by virtual transaction: a committed serializable transaction keeps its predicate locks (under the
+# pid of its connection) as long as transactions concurrent with it run, and they are not the ones of the next
+# transaction of the connection. The counts of a connection are the ones of its transaction holding the most.
+
+GRANULARITIES = ("relation", "page", "tuple")
+
+_SETTINGS = ("max_pred_locks_per_transaction", "max_pred_locks_per_relation", "max_pred_locks_per_page")
+
+
+class LockCount(NamedTuple):
+    pid: int
+    # virtual transaction holding the locks
+    transaction: str
+    # SIReadLock
+    predicate: bool
+    granularity: str
+    relation: str
+    # False for indexes
+    table: bool
+    count: int
+
+
+class LockSampler:
+
+    conn: AsyncConnection
+    interval: float
+    samples: int
+    settings: Dict[str, int]
+    # (pid, predicate, granularity) -> most locks held at once by a transaction of the connection
+    peaks: Dict[Tuple[int, bool, str], int]
+    # pid -> most predicate locks (of any granularity) held at once by a transaction of the connection
+    predicate_peaks: Dict[int, int]
+    escalations: Dict[int, int]
+    # pid -> pids it was seen waiting for
+    blocked_by: Dict[int, Set[int]]
+
+    def __init__(self, conn: AsyncConnection):
+        self.conn = conn
+        self.interval = 0.0
+        self.samples = 0
+        self.settings = {}
+        self.peaks = {}
+        self.predicate_peaks = {}
+        self.escalations = {}
+        self.blocked_by = {}
+
+    # Polls the locks of backends `names` (pid -> transaction name) until `stop` is set, calling `report` with a line
+    # for every escalation and new wait seen.
+    async def sample(self, names: Dict[int, str], stop: Event, report: Callable[[str], None], interval: float = 0.005):
+        self.interval = interval
+        self.settings = await self._settings()
+        pids = list(names)
+        # (transaction, relation) -> predicate locks by granularity, as of the previous sample
+        previous: Dict[Tuple[str, str], Dict[str, int]] = {}
+        # once more after `stop`, for the locks left by the last steps
+        while True:
+            stopped = stop.is_set()
+            (counts, blocking) = await self._sample(pids)
+            self.samples += 1
+            previous = self._record(counts, previous, names, report)
+            for (pid, blockers) in blocking.items():
+                seen = self.blocked_by.setdefault(pid, set())
+                if blockers - seen:
+                    report(f"{_name(names, pid)} waits for {_names(names, blockers - seen)}")
+                seen |= blockers
+            if stopped:
+                break
+            try:
+                await wait_for(stop.wait(), timeout=interval)
+            except TimeoutError:
+                pass
+
+    # locks held by `pids` on the relations of the current schema, and the pids each of them waits for
+    async def _sample(self, pids: List[int]) -> Tuple[List[LockCount], Dict[int, Set[int]]]:
+        async with self.conn.cursor(row_factory=tuple_row) as cursor:
+            await cursor.execute(
+                """
+                    select
+                        l.pid, l.virtualtransaction, l.mode = 'SIReadLock', l.locktype, c.relname, c.relkind <> 'i',
+                        count(*)
+                    from pg_locks l join pg_class c on c.oid = l.relation
+                    where l.pid = any(%s) and l.locktype in ('relation', 'page', 'tuple')
+                        and c.relnamespace = current_schema()::regnamespace
+                    group by 1, 2, 3, 4, 5, 6;
+                """,
+                (pids,),
+            )
+            counts = [LockCount(*row) for row in await cursor.fetchall()]
+            await cursor.execute(
+                """
+                    select pid, blockers from unnest(%s::int[]) as pid,
+                        lateral (select pg_blocking_pids(pid) || pg_safe_snapshot_blocking_pids(pid)) as b(blockers)
+                    where blockers <> '{}';
+                """,
+                (pids,),
+            )
+            blocking = {pid: set(blockers) for (pid, blockers) in await cursor.fetchall()}
+        return (counts, blocking)
+
+    async def _settings(self) -> Dict[str, int]:
+        async with self.conn.cursor(row_factory=tuple_row) as cursor:
+            await cursor.execute("select name, setting::int from pg_settings where name = any(%s);", (list(_SETTINGS),))
+            return dict(await cursor.fetchall())
+
+    def _record(
+        self,
+        counts: List[LockCount],
+        previous: Dict[Tuple[str, str], Dict[str, int]],
+        names: Dict[int, str],
+        report: Callable[[str], None],
+    ) -> Dict[Tuple[str, str], Dict[str, int]]:
+        totals: Dict[Tuple[int, str, bool, str], int] = {}
+        predicate_totals: Dict[Tuple[int, str], int] = {}
+        predicates: Dict[Tuple[str, str], Dict[str, int]] = {}
+        pids: Dict[str, int] = {}
+        tables: Set[str] = set()
+        for c in counts:
+            key = (c.pid, c.transaction, c.predicate, c.granularity)
+            totals[key] = totals.get(key, 0) + c.count
+            if c.predicate:
+                predicate_totals[(c.pid, c.transaction)] = predicate_totals.get((c.pid, c.transaction), 0) + c.count
+                by_granularity = predicates.setdefault((c.transaction, c.relation), {})
+                by_granularity[c.granularity] = by_granularity.get(c.granularity, 0) + c.count
+                pids[c.transaction] = c.pid
+                if c.table:
+                    tables.add(c.relation)
+        for ((pid, _, predicate, granularity), total) in totals.items():
+            key = (pid, predicate, granularity)
+            self.peaks[key] = max(self.peaks.get(key, 0), total)
+        for ((pid, _), total) in predicate_totals.items():
+            self.predicate_peaks[pid] = max(self.predicate_peaks.get(pid, 0), total)
+
+        for ((transaction, relation), now) in predicates.items():
+            before = previous.get((transaction, relation), {})
+            pid = pids[transaction]
+            if _escalated(before, now, relation in tables):
+                self.escalations[pid] = self.escalations.get(pid, 0) + 1
+                changes = ", ".join(
+                    f"{g} {before.get(g, 0)} -> {now.get(g, 0)}"
+                    for g in GRANULARITIES if before.get(g, 0) != now.get(g, 0)
+                )
+                report(f"{_name(names, pid)} predicate locks on {relation} escalated: {changes}")
+        return predicates
+
+
+def _escalated(before: Dict[str, int], now: Dict[str, int], table: bool) -> bool:
+    for (i, coarser) in enumerate(GRANULARITIES[:-1]):
+        if now.get(coarser, 0) <= before.get(coarser, 0):
+            continue
+        if coarser == "page" and table:
+            return True
+        if any(now.get(finer, 0) < before.get(finer, 0) for finer in GRANULARITIES[i + 1:]):
+            return True
+    return False
+
+
+def _name(names: Dict[int, str], pid: int) -> str:
+    return names.get(pid, f"pid {pid}")
+
+
+# in the order of `names`, then other backends
+def _names(names: Dict[int, str], pids: Set[int]) -> str:
+    order = {pid: i for (i, pid) in enumerate(names)}
+    return ", ".join(_name(names, pid) for pid in sorted(pids, key=lambda pid: (order.get(pid, len(order)), pid)))
+
+
+# peak lock counts of every transaction, `names` in order
+def format_locks(sampler: LockSampler, names: Dict[int, str]) -> str:
+    settings = ", ".join(f"{name} {value}" for (name, value) in sampler.settings.items())
+    header = f"{sampler.samples} samples every {sampler.interval * 1000:g}ms" + (f", {settings}" if settings else "")
+    records = []
+    for (pid, name) in names.items():
+        record = {"transaction": name}
+        for g in GRANULARITIES:
+            record[f"SIRead {g}"] = sampler.peaks.get((pid, True, g), 0)
+        for g in GRANULARITIES:
+            record[g] = sampler.peaks.get((pid, False, g), 0)
+        record["escalations"] = sampler.escalations.get(pid, 0)
+        record["waited for"] = _names(names, sampler.blocked_by.get(pid, set())) or "-"
+        records.append(record)
+    return header + "\n" + format_table(records, None)
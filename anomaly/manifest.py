@@ -0,0 +1,47 @@
+# What the command line offers, known without importing the modules implementing it (and psycopg with them), so that
+# parsing the arguments (or `-h`) stays fast however many scenarios there are. Keep it free of imports.
+
+# anomaly -> module registering it (see `anomaly.registry`), in the order they are listed
+SCENARIOS = {
+    "dirty-read": "anomaly.dirty_read",
+    "non-repeatable-read": "anomaly.non_repeatable_read",
+    "non-repeatable-read-snapshot": "anomaly.non_repeatable_read_snapshot",
+    "phantom-read": "anomaly.phantom_read",
+    "phantom-read-insert": "anomaly.phantom_read_insert",
+    "serialization-anomaly": "anomaly.serialization_anomaly",
+    "serialization-anomaly-insert": "anomaly.serialization_anomaly_insert",
+    "serialization-anomaly-update": "anomaly.serialization_anomaly_update",
+    "serialization-anomaly-concurrent-update": "anomaly.serialization_anomaly_concurrent_update",
+    "serialization-anomaly-select-update": "anomaly.serialization_anomaly_select_update",
+    "lock-queue": "anomaly.lock_queue",
+    "hot-row-atomic": "anomaly.hot_row",
+    "hot-row-read-modify-write": "anomaly.hot_row",
+    "hot-row-for-update": "anomaly.hot_row",
+    "hot-row-version": "anomaly.hot_row",
+    "hot-row-advisory": "anomaly.hot_row",
+    "hot-row-sharded": "anomaly.hot_row",
+    "queue-select": "anomaly.work_queue",
+    "queue-for-update": "anomaly.work_queue",
+    "queue-skip-locked": "anomaly.work_queue",
+    "queue-nowait": "anomaly.work_queue",
+    "queue-advisory": "anomaly.work_queue",
+    "read-only-anomaly": "anomaly.read_only",
+    "read-only-anomaly-deferrable": "anomaly.read_only",
+}
+
+ISOLATION_LEVELS = ("read-uncommitted", "read-committed", "repeatable-read", "serializable")
+
+# see `anomaly.runner.BACKENDS`
+BACKENDS = ("postgres", "memory")
+
+# see `anomaly.base`
+SIMPLE = "simple"
+PIPELINE = "pipeline"
+TRANSPORTS = (SIMPLE, PIPELINE)
+
+# see `anomaly.dataset`
+DISTRIBUTIONS = ("uniform", "zipf")
+INDEX_COLUMNS = ("id", "balance")
+
+# see `anomaly.retry.POLICIES`
+RETRY_POLICIES = ("immediate", "exponential")
@@ -0,0 +1,1264 @@
+import asyncio
+import itertools
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Dict, Iterator, List, NamedTuple, Set, Tuple
+
+import psycopg
+from psycopg import IsolationLevel
+from psycopg.rows import tuple_row
+
+from anomaly.base import LockMonitor
+from anomaly.checker import Checker
+from anomaly.diff import ClientStateDiff
+from anomaly.locks import LockCount, LockSampler
+from anomaly.dataset import DEFAULT, JOBS, Dataset
+from anomaly.pool import Session
+
+
+# In memory replacement for PostgreSQL, covering the `account` and `job` tables and the statements used by the examples.
+# It follows what PostgreSQL does for them:
+# - every row update creates a new version, visible according to its xmin/xmax and the snapshot of the transaction
+#   (one per statement for read committed, one per transaction, taken by its first statement, otherwise)
+# - updating a row locked by another transaction waits for it to end; then read committed updates the latest version
+#   of the row (if it still matches the `where` clause) and repeatable read/serializable fail (first updater wins).
+#   The next transactions wanting the row queue behind the first one waiting for it (its tuple lock), and a deadlock
+#   fails the transaction that PostgreSQL would find it with, the first one waiting for less than `deadlock_timeout`
+# - `select ... for update` locks the rows it returns like an update (without a new version), one at a time in the
+#   order of the query until its `limit`, skipping the rows locked by others with `skip locked` and failing on them
+#   with `nowait`; `select pg_advisory_xact_lock(n)` takes the advisory lock n, both held until the transaction ends
+# - serializable tracks reads (of rows by id, or of the whole table otherwise) and the rw-conflicts between
+#   concurrent transactions, failing a transaction in the middle of a dangerous structure (T_in -rw-> T -rw-> T_out
+#   with T_out committed first); when T_in is read only (or committed without writing), T_out has to have committed
+#   before its snapshot
+# - read only transactions can't modify (or lock) rows; serializable ones stop tracking their reads once no concurrent
+#   read/write transaction can make their snapshot unsafe (commit with a rw-conflict out to a transaction committed
+#   before it), and deferrable ones wait, at their first statement, for such a safe snapshot
+# With a `Checker`, the versions read and written by the transactions are reported to it, so their dependency graph
+# can be checked for cycles (see `anomaly.checker`).
+
+_IN_PROGRESS = "in progress"
+_COMMITTED = "committed"
+_ABORTED = "aborted"
+
+_CONCURRENT_UPDATE = "could not serialize access due to concurrent update"
+_LOCK_NOT_AVAILABLE = 'could not obtain lock on row in relation "{table}"'
+
+# what `select ... for update` does with rows locked by other transactions
+_WAIT = "wait"
+_NOWAIT = "nowait"
+_SKIP_LOCKED = "skip locked"
+_RW_DEPENDENCIES = (
+    "could not serialize access due to read/write dependencies among transactions\n"
+    "DETAIL:  Reason code: Canceled on identification as a pivot, during {stage}.\n"
+    "HINT:  The transaction might succeed if retried."
+)
+
+_ISOLATION_LEVELS = {
+    "read uncommitted": IsolationLevel.READ_UNCOMMITTED,
+    "read committed": IsolationLevel.READ_COMMITTED,
+    "repeatable read": IsolationLevel.REPEATABLE_READ,
+    "serializable": IsolationLevel.SERIALIZABLE,
+}
+
+# transactions ended between two vacuums
+_VACUUM_EVERY = 1000
+
+# seconds PostgreSQL waits for a lock before checking for a deadlock (`deadlock_timeout`, 1s by default)
+_DEADLOCK_TIMEOUT = 1.0
+
+_pids = itertools.count(1)
+
+
+# version of a row, the subclasses add the columns of their table
+class _Version:
+
+    __slots__ = ("id", "xmin", "xmax", "locker")
+
+    TABLE = ""
+    COLUMNS: Tuple[str, ...] = ("id",)
+
+    def __init__(self, id: int, xmin: int):
+        self.id = id
+        self.xmin = xmin
+        self.xmax: int | None = None
+        # transaction that locked the row with `select ... for update`
+        self.locker: int | None = None
+
+    # the row as reported to the checker, the ids of `account` rows as they are
+    @property
+    def key(self) -> Any:
+        return self.id
+
+    # next version of the row, written by `xmin`
+    def copy(self, xmin: int) -> "_Version":
+        raise NotImplementedError()
+
+
+class _Account(_Version):
+
+    __slots__ = ("balance", "version")
+
+    TABLE = "account"
+    COLUMNS = ("id", "balance", "version")
+
+    def __init__(self, id: int, xmin: int, balance: int = 0, version: int = 0):
+        super().__init__(id, xmin)
+        self.balance = balance
+        self.version = version
+
+    def copy(self, xmin: int) -> "_Account":
+        return _Account(self.id, xmin, self.balance, self.version)
+
+
+class _Job(_Version):
+
+    __slots__ = ("status", "payload")
+
+    TABLE = "job"
+    COLUMNS = ("id", "status", "payload")
+
+    def __init__(self, id: int, xmin: int, status: str = "pending", payload: str = ""):
+        super().__init__(id, xmin)
+        self.status = status
+        self.payload = payload
+
+    @property
+    def key(self) -> Any:
+        return f"job {self.id}"
+
+    def copy(self, xmin: int) -> "_Job":
+        return _Job(self.id, xmin, self.status, self.payload)
+
+
+_VERSIONS: Dict[str, type] = {v.TABLE: v for v in (_Account, _Job)}
+
+
+class _Table:
+
+    def __init__(self, version: type):
+        self.name = version.TABLE
+        # class of the versions of its rows
+        self.version = version
+        self.heap: List[_Version] = []
+        self.rows: Dict[int, List[_Version]] = {}
+        self.sequence = 0
+
+
+class _Snapshot(NamedTuple):
+    # first xid not started yet when the snapshot was taken
+    xmax: int
+    # xids in progress when the snapshot was taken
+    active: frozenset
+
+
+class _Transaction:
+
+    def __init__(self, xid: int, pid: int, level: IsolationLevel, implicit: bool):
+        self.xid = xid
+        self.pid = pid
+        self.level = level
+        self.implicit = implicit
+        self.read_only = False
+        self.deferrable = False
+        self.snapshot: _Snapshot | None = None
+        self.failed = False
+        self.doomed = False
+        self.commit_seq: int | None = None
+        # first xid given out after the commit, transactions from then on are not concurrent with this one
+        self.committed_before: int | None = None
+        # serializable only: rows read by table (SIREAD locks), tables read whole and rw-conflicts
+        self.reads: Dict[str, Set[int]] = {}
+        self.tables: Set[str] = set()
+        self.conflicts_in: Set["_Transaction"] = set()
+        self.conflicts_out: Set["_Transaction"] = set()
+        self.wrote = False
+        # serializable read only: concurrent read/write transactions that can still make the snapshot unsafe, and
+        # whether one did; the transaction is safe (and no longer tracked) once none is left
+        self.possibly_unsafe: Set["_Transaction"] = set()
+        self.unsafe = False
+        self.safe = False
+
+    # tracked by serializable snapshot isolation
+    @property
+    def serializable(self) -> bool:
+        return self.level == IsolationLevel.SERIALIZABLE and not self.safe
+
+    @property
+    def snapshot_per_statement(self) -> bool:
+        return self.level in (IsolationLevel.READ_UNCOMMITTED, IsolationLevel.READ_COMMITTED)
+
+
+class MemoryDatabase:
+
+    def __init__(
+        self, balances: List[int] | None = None, checker: Checker | None = None, jobs: List[str] | None = None
+    ):
+        self._checker = checker
+        self._tables: Dict[str, _Table] = {name: _Table(version) for (name, version) in _VERSIONS.items()}
+        self._next_xid = 1
+        self._status: Dict[int, str] = {}
+        self._active: Set[int] = set()
+        self._transactions: Dict[int, _Transaction] = {}
+        # futures of the transactions waiting for each transaction to end
+        self._ends: Dict[int, List[asyncio.Future]] = {}
+        # (table, row id) -> xid of the first transaction waiting for the row (holding its tuple lock, like PostgreSQL),
+        # and the futures of the transactions queued behind it
+        self._tuple_locks: Dict[Tuple[str, int], int] = {}
+        self._tuple_queues: Dict[Tuple[str, int], List[asyncio.Future]] = {}
+        # xid of the transaction each waiting transaction waits for (and since when), and the connections they run on,
+        # with the future waking them up
+        self._waiting: Dict[int, int] = {}
+        self._waiting_since: Dict[int, float] = {}
+        self._blocked: Dict[int, asyncio.Future] = {}
+        # seconds spent waiting for locks, by connection
+        self._lock_waits: Dict[int, float] = {}
+        # advisory lock -> xid of the transaction that took it last
+        self._advisory: Dict[int, int] = {}
+        self._serializable: List[_Transaction] = []
+        self._commits = itertools.count(1)
+        self._since_vacuum = 0
+
+        setup = self._begin(IsolationLevel.READ_COMMITTED, 0, implicit=True)
+        for balance in balances or ():
+            self._insert(setup, self._tables["account"], "balance", balance)
+        for payload in jobs or ():
+            self._insert(setup, self._tables["job"], "payload", payload)
+        self._commit(setup)
+
+    def connect(self) -> "MemoryConnection":
+        return MemoryConnection(self)
+
+    # until the end it waits for (or a deadlock), not until the statement resumes
+    def is_blocked(self, pid: int) -> bool:
+        end = self._blocked.get(pid)
+        return end is not None and not end.done()
+
+    def lock_wait(self, pid: int) -> float:
+        return self._lock_waits.get(pid, 0.0)
+
+    # transactions
+
+    def _begin(self, level: IsolationLevel, pid: int, implicit: bool = False) -> _Transaction:
+        xid = self._next_xid
+        self._next_xid += 1
+        self._status[xid] = _IN_PROGRESS
+        self._active.add(xid)
+        t = _Transaction(xid, pid, level, implicit)
+        self._transactions[xid] = t
+        if self._checker is not None:
+            self._checker.begin(xid, pid)
+        if t.serializable:
+            self._serializable.append(t)
+        return t
+
+    def _commit(self, t: _Transaction):
+        if t.serializable:
+            # T may be the pivot of a dangerous structure, it is then the one to fail
+            if self._dangerous(t):
+                self._abort(t)
+                raise psycopg.errors.SerializationFailure(_RW_DEPENDENCIES.format(stage="commit attempt"))
+
+        t.commit_seq = next(self._commits)
+        t.committed_before = self._next_xid
+        self._end(t, _COMMITTED)
+        if self._checker is not None:
+            self._checker.commit(t.xid)
+        # and it may be the T_out of the transactions with a rw-conflict into it
+        for pivot in list(t.conflicts_in):
+            if pivot.commit_seq is None and self._dangerous(pivot):
+                pivot.doomed = True
+        if t.serializable and not t.read_only:
+            self._read_write_ended(t, committed=True)
+
+    def _abort(self, t: _Transaction):
+        if self._status[t.xid] == _IN_PROGRESS:
+            self._end(t, _ABORTED)
+            if self._checker is not None:
+                self._checker.abort(t.xid)
+            if t.serializable:
+                self._forget(t)
+                if not t.read_only:
+                    self._read_write_ended(t, committed=False)
+
+    def _end(self, t: _Transaction, status: str):
+        self._status[t.xid] = status
+        self._active.discard(t.xid)
+        del self._transactions[t.xid]
+        for wake in self._ends.pop(t.xid, ()):
+            if not wake.done():
+                wake.set_result(None)
+
+        self._since_vacuum += 1
+        if self._since_vacuum == _VACUUM_EVERY:
+            self._vacuum()
+
+    # Drops what no transaction can see anymore, so long runs (see `anomaly.stress`) don't slow down:
+    # row versions deleted (or replaced) by transactions that every snapshot sees as committed, versions written by
+    # aborted transactions, and committed serializable transactions that no running transaction is concurrent with.
+    def _vacuum(self):
+        self._since_vacuum = 0
+        horizon = self._next_xid
+        for t in self._transactions.values():
+            if t.snapshot is not None:
+                horizon = min(horizon, t.snapshot.xmax, *t.snapshot.active)
+            horizon = min(horizon, t.xid)
+
+        def dead(v: _Version) -> bool:
+            if self._status[v.xmin] == _ABORTED:
+                return True
+            return v.xmax is not None and v.xmax < horizon and self._status[v.xmax] == _COMMITTED
+
+        # in place, statements waiting for a lock hold on to the versions of their row
+        for table in self._tables.values():
+            table.heap[:] = [v for v in table.heap if not dead(v)]
+            for (id, versions) in list(table.rows.items()):
+                versions[:] = [v for v in versions if not dead(v)]
+                if not versions:
+                    del table.rows[id]
+
+        oldest = min(self._active, default=self._next_xid)
+        self._serializable = [
+            t for t in self._serializable if t.committed_before is None or t.committed_before > oldest
+        ]
+
+    def _snapshot(self, t: _Transaction) -> _Snapshot:
+        if t.snapshot is None or t.snapshot_per_statement:
+            t.snapshot = _Snapshot(self._next_xid, frozenset(self._active - {t.xid}))
+            if self._checker is not None:
+                self._checker.snapshot(t.xid)
+            if t.serializable and t.read_only:
+                t.possibly_unsafe = {
+                    o for o in self._serializable if not o.read_only and o.commit_seq is None and o.snapshot is not None
+                }
+                t.unsafe = False
+                if not t.possibly_unsafe:
+                    self._release(t)
+        return t.snapshot
+
+    def _sees(self, snapshot: _Snapshot, xid: int) -> bool:
+        return xid < snapshot.xmax and xid not in snapshot.active and self._status[xid] == _COMMITTED
+
+    def _visible(self, t: _Transaction, snapshot: _Snapshot, v: _Version) -> bool:
+        if v.xmin == t.xid:
+            return v.xmax != t.xid
+        if not self._sees(snapshot, v.xmin):
+            return False
+        if v.xmax is None:
+            return True
+        if v.xmax == t.xid:
+            return False
+        return not self._sees(snapshot, v.xmax)
+
+    # waits for transaction `xid` to end, or to wake up `queue`
+    async def _wait_for(self, t: _Transaction, xid: int, queue: List[asyncio.Future] | None = None):
+        # Waiting for a transaction that (indirectly) waits for this one would never end. PostgreSQL looks for such a
+        # cycle once a transaction waited for `deadlock_timeout`, and fails the one looking: the transaction of the
+        # cycle that started waiting first among the ones that didn't look yet, or else this one.
+        cycle = []
+        blocker = xid
+        while blocker in self._waiting and not self._blocked[self._transactions[blocker].pid].done():
+            cycle.append(blocker)
+            blocker = self._waiting[blocker]
+        if blocker == t.xid:
+            now = time.monotonic()
+            checking = [w for w in cycle if now - self._waiting_since[w] < _DEADLOCK_TIMEOUT]
+            if not checking:
+                raise psycopg.errors.DeadlockDetected("deadlock detected")
+            victim = self._transactions[min(checking, key=lambda w: self._waiting_since[w])]
+            self._blocked[victim.pid].set_exception(psycopg.errors.DeadlockDetected("deadlock detected"))
+
+        # woken up by the end of the transaction, or failed by a deadlock
+        wake = asyncio.get_running_loop().create_future()
+        (self._ends.setdefault(xid, []) if queue is None else queue).append(wake)
+        self._waiting[t.xid] = xid
+        self._waiting_since[t.xid] = time.monotonic()
+        self._blocked[t.pid] = wake
+        try:
+            await wake
+        finally:
+            del self._waiting[t.xid]
+            del self._blocked[t.pid]
+            waited = time.monotonic() - self._waiting_since.pop(t.xid)
+            self._lock_waits[t.pid] = self._lock_waits.get(t.pid, 0.0) + waited
+
+    # serializable
+
+    def _read(self, t: _Transaction, versions: List[_Version], visible: _Version | None):
+        if not t.serializable:
+            return
+
+        # versions newer than the visible one (or not visible at all) were written by concurrent transactions
+        newer = versions if visible is None else versions[versions.index(visible):]
+        for v in newer:
+            for xid in (v.xmin, v.xmax) if v is not visible else (v.xmax,):
+                if xid is not None and xid != t.xid and self._status[xid] != _ABORTED:
+                    self._conflict(t, xid)
+
+    def _write(self, t: _Transaction, table: str, id: int | None):
+        if not t.serializable:
+            return
+
+        t.wrote = True
+        for reader in self._serializable:
+            if reader is t or (reader.commit_seq is not None and self._sees(self._snapshot(t), reader.xid)):
+                continue
+            if table in reader.tables or (id is not None and id in reader.reads.get(table, ())):
+                self._conflict_with(reader, t)
+        # the write made T the pivot of a dangerous structure
+        if t.doomed:
+            raise psycopg.errors.SerializationFailure(_RW_DEPENDENCIES.format(stage="write"))
+
+    def _conflict(self, reader: _Transaction, writer_xid: int):
+        for writer in self._serializable:
+            if writer.xid == writer_xid:
+                self._conflict_with(reader, writer)
+                return
+
+    def _conflict_with(self, reader: _Transaction, writer: _Transaction):
+        if writer in reader.conflicts_out:
+            return
+
+        reader.conflicts_out.add(writer)
+        writer.conflicts_in.add(reader)
+        for pivot in (reader, writer):
+            if pivot.commit_seq is None and self._dangerous(pivot):
+                pivot.doomed = True
+        # a committed writer can't fail anymore, the reader is the one left
+        if writer.commit_seq is not None and self._dangerous(writer):
+            reader.doomed = True
+
+    # T_in -rw-> pivot -rw-> T_out, with T_out committed before T_in and the pivot (before the snapshot of T_in, when
+    # T_in is read only, or committed without writing)
+    def _dangerous(self, pivot: _Transaction) -> bool:
+        for t_out in pivot.conflicts_out:
+            if t_out.commit_seq is None or (pivot.commit_seq is not None and t_out.commit_seq > pivot.commit_seq):
+                continue
+            for t_in in pivot.conflicts_in:
+                read_only = t_in.read_only or (t_in.commit_seq is not None and not t_in.wrote)
+                if read_only and not self._sees(t_in.snapshot, t_out.xid):
+                    continue
+                if t_in.commit_seq is None or t_in.commit_seq >= t_out.commit_seq:
+                    return True
+
+        return False
+
+    # no longer tracked: aborted, or read only and safe
+    def _forget(self, t: _Transaction):
+        self._serializable.remove(t)
+        for other in t.conflicts_in:
+            other.conflicts_out.discard(t)
+        for other in t.conflicts_out:
+            other.conflicts_in.discard(t)
+
+    def _release(self, t: _Transaction):
+        self._forget(t)
+        t.safe = True
+        t.reads.clear()
+        t.tables.clear()
+        t.conflicts_in.clear()
+        t.conflicts_out.clear()
+
+    # The read only transactions concurrent with `writer` are unsafe if it committed with a rw-conflict out to a
+    # transaction committed before their snapshot, and safe once no concurrent read/write transaction is left.
+    def _read_write_ended(self, writer: _Transaction, committed: bool):
+        for t in list(self._serializable):
+            if writer not in t.possibly_unsafe:
+                continue
+            if committed and any(self._sees(t.snapshot, out.xid) for out in writer.conflicts_out):
+                t.unsafe = True
+                t.possibly_unsafe.clear()
+                continue
+            t.possibly_unsafe.discard(writer)
+            if not t.possibly_unsafe and not t.unsafe:
+                self._release(t)
+
+    # serializable read only deferrable: waits for the read/write transactions concurrent with its snapshot to end,
+    # taking a new snapshot as long as one of them makes it unsafe
+    async def _safe_snapshot(self, t: _Transaction):
+        while not t.safe:
+            t.snapshot = None
+            self._snapshot(t)
+            while t.possibly_unsafe:
+                await self._wait_for(t, next(iter(t.possibly_unsafe)).xid)
+
+    # statements
+
+    # `observe` tells whether the rows are reported to the checker as read (updates report the row they change instead)
+    def _scan(
+        self,
+        t: _Transaction,
+        table: _Table,
+        where: Callable[[_Version], bool] | None,
+        id: int | None,
+        observe: bool = True,
+    ) -> List[_Version]:
+        snapshot = self._snapshot(t)
+        checker = self._checker if observe else None
+        if id is not None:
+            versions = table.rows.get(id, [])
+            if t.serializable:
+                t.reads.setdefault(table.name, set()).add(id)
+            visible = next((v for v in reversed(versions) if self._visible(t, snapshot, v)), None)
+            self._read(t, versions, visible)
+            if checker is not None and visible is not None:
+                checker.read(t.xid, visible.key, visible.xmin)
+            return [visible] if visible is not None and (where is None or where(visible)) else []
+
+        if t.serializable:
+            t.tables.add(table.name)
+            for versions in table.rows.values():
+                visible = next((v for v in reversed(versions) if self._visible(t, snapshot, v)), None)
+                self._read(t, versions, visible)
+
+        rows = [v for v in table.heap if self._visible(t, snapshot, v)]
+        matching = [v for v in rows if where is None or where(v)]
+        if checker is not None:
+            checker.predicate_read(t.xid, {v.key: v.xmin for v in rows})
+            for v in matching:
+                checker.read(t.xid, v.key, v.xmin)
+        return matching
+
+    # Rows matching `where` in id order, as an index scan of the primary key returns them: the rows are read as they
+    # come, the whole table (rows inserted since included) only once the scan reaches its end. Serializable
+    # transactions taking the first rows (`order by id limit n`) conflict with the writes of the rows before them.
+    def _index_scan(
+        self,
+        t: _Transaction,
+        table: _Table,
+        where: Callable[[_Version], bool] | None,
+        observe: bool = True,
+    ) -> Iterator[_Version]:
+        snapshot = self._snapshot(t)
+        checker = self._checker if observe else None
+        seen: Dict[Any, int] = {}
+        reads = t.reads.setdefault(table.name, set()) if t.serializable else None
+        # rows are created in id order, statements waiting for a lock meanwhile may add some
+        for (id, versions) in list(table.rows.items()):
+            visible = next((v for v in reversed(versions) if self._visible(t, snapshot, v)), None)
+            if reads is not None:
+                reads.add(id)
+            self._read(t, versions, visible)
+            if visible is None:
+                continue
+            seen[visible.key] = visible.xmin
+            if where is None or where(visible):
+                if checker is not None:
+                    checker.read(t.xid, visible.key, visible.xmin)
+                yield visible
+
+        if t.serializable:
+            t.tables.add(table.name)
+        if checker is not None:
+            checker.predicate_read(t.xid, seen)
+
+    # new row of `table`, with `value` for `column` and the defaults for the other columns
+    def _insert(self, t: _Transaction, table: _Table, column: str, value: Any) -> _Version:
+        table.sequence += 1
+        v = table.version(table.sequence, t.xid)
+        setattr(v, column, value)
+        table.heap.append(v)
+        table.rows[v.id] = [v]
+        self._write(t, table.name, None)
+        if self._checker is not None:
+            self._checker.write(t.xid, v.key)
+        return v
+
+    async def _modify(
+        self,
+        t: _Transaction,
+        table: _Table,
+        where: Callable[[_Version], bool] | None,
+        id: int | None,
+        assignments: Tuple[Tuple[str, Callable[[_Version], Any]], ...] | None,
+    ) -> int:
+        modified = 0
+        for target in self._scan(t, table, where, id, observe=False):
+            versions = table.rows[target.id]
+            target = await self._lock(t, table, target, where)
+            if target is None:
+                continue
+
+            target.xmax = t.xid
+            if assignments is not None:
+                v = target.copy(t.xid)
+                for (column, value) in assignments:
+                    setattr(v, column, value(target))
+                table.heap.append(v)
+                versions.append(v)
+            self._write(t, table.name, target.id)
+            if self._checker is not None:
+                self._checker.read(t.xid, target.key, target.xmin)
+                self._checker.write(t.xid, target.key)
+            modified += 1
+
+        return modified
+
+    # `select ... for update`
+    async def _select_for_update(
+        self,
+        t: _Transaction,
+        table: _Table,
+        where: Callable[[_Version], bool] | None,
+        id: int | None,
+        order: str | None = None,
+        limit: int | None = None,
+        wait: str = _WAIT,
+    ) -> List[_Version]:
+        if id is None and order == "id" and limit is not None:
+            rows = self._index_scan(t, table, where, observe=False)
+        else:
+            rows = self._scan(t, table, where, id, observe=False)
+            if order is not None:
+                rows = sorted(rows, key=lambda v: getattr(v, order))
+        locked = []
+        if limit == 0:
+            return locked
+        for target in rows:
+            target = await self._lock(t, table, target, where, wait)
+            if target is None:
+                continue
+
+            target.locker = t.xid
+            if self._checker is not None:
+                self._checker.read(t.xid, target.key, target.xmin)
+            locked.append(target)
+            # the scan stops there, the next rows are not read
+            if len(locked) == limit:
+                break
+
+        return locked
+
+    # Waits for the transactions updating or locking the row of `target` to end, and returns its version to update,
+    # or None if it doesn't match `where` anymore (or is locked, with `skip locked`).
+    async def _lock(
+        self,
+        t: _Transaction,
+        table: _Table,
+        target: _Version,
+        where: Callable[[_Version], bool] | None,
+        wait: str = _WAIT,
+    ) -> _Version | None:
+        row = (table.name, target.id)
+        try:
+            return await self._lock_version(t, table, target, where, wait)
+        finally:
+            if self._tuple_locks.get(row) == t.xid:
+                del self._tuple_locks[row]
+                for wake in self._tuple_queues.pop(row, ()):
+                    if not wake.done():
+                        wake.set_result(None)
+
+    async def _lock_version(
+        self,
+        t: _Transaction,
+        table: _Table,
+        target: _Version,
+        where: Callable[[_Version], bool] | None,
+        wait: str,
+    ) -> _Version | None:
+        versions = table.rows[target.id]
+        row = (table.name, target.id)
+        while True:
+            holder = target.xmax
+            if holder is None or holder == t.xid or self._status[holder] == _ABORTED:
+                locker = target.locker
+                if locker is not None and locker != t.xid and self._status[locker] == _IN_PROGRESS:
+                    if not await self._wait_or_skip(t, row, locker, wait):
+                        return None
+                    continue
+                break
+            if self._status[holder] == _IN_PROGRESS:
+                if not await self._wait_or_skip(t, row, holder, wait):
+                    return None
+                continue
+            # updated (or deleted) by a transaction that committed after the snapshot
+            if not t.snapshot_per_statement:
+                raise psycopg.errors.SerializationFailure(_CONCURRENT_UPDATE)
+            target = next((v for v in reversed(versions) if v.xmin == holder), None)
+            if target is None or (where is not None and not where(target)):
+                break
+
+        if target is None or (where is not None and not where(target)):
+            return None
+        return target
+
+    # False to skip the `row` (table and id) locked by `holder`. The first transaction waiting for the row takes its
+    # tuple lock until it locks the row, the next ones wait for it first: they queue behind it, and so do their
+    # deadlocks.
+    async def _wait_or_skip(self, t: _Transaction, row: Tuple[str, int], holder: int, wait: str) -> bool:
+        if wait == _SKIP_LOCKED:
+            return False
+        if wait == _NOWAIT:
+            raise psycopg.errors.LockNotAvailable(_LOCK_NOT_AVAILABLE.format(table=row[0]))
+        if self._tuple_locks.get(row, t.xid) != t.xid:
+            # then the row may be locked by someone else
+            await self._wait_for(t, self._tuple_locks[row], self._tuple_queues.setdefault(row, []))
+            return True
+        self._tuple_locks[row] = t.xid
+        await self._wait_for(t, holder)
+        return True
+
+    async def _advisory_lock(self, t: _Transaction, key: int):
+        # the statement takes the snapshot before waiting
+        self._snapshot(t)
+        while True:
+            holder = self._advisory.get(key)
+            if holder is None or holder == t.xid or self._status[holder] != _IN_PROGRESS:
+                self._advisory[key] = t.xid
+                return
+            await self._wait_for(t, holder)
+
+
+class MemoryCursor:
+
+    rowcount: int
+
+    def __init__(self, conn: "MemoryConnection", row_factory: Any = None):
+        self._conn = conn
+        self._tuples = row_factory is tuple_row
+        self._records: List[Any] = []
+        self.rowcount = -1
+
+    async def __aenter__(self) -> "MemoryCursor":
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def close(self):
+        pass
+
+    async def execute(self, query: str, params: Any = None, prepare: bool | None = None) -> "MemoryCursor":
+        # like a round trip to the server, let the other tasks run (once per batch in a pipeline), unless a scheduler
+        # decides when they run
+        if self._conn._handoff and not self._conn._pipelined:
+            await asyncio.sleep(0)
+        (columns, rows, rowcount) = await self._conn._execute(query)
+        self._records = [tuple(r) if self._tuples else dict(zip(columns, r)) for r in rows]
+        self.rowcount = rowcount
+        return self
+
+    async def fetchall(self) -> List[Any]:
+        (records, self._records) = (self._records, [])
+        return records
+
+    async def fetchone(self) -> Any:
+        return self._records.pop(0) if self._records else None
+
+    async def fetchmany(self, size: int) -> List[Any]:
+        (records, self._records) = (self._records[:size], self._records[size:])
+        return records
+
+    # only the result of the last statement is kept
+    def nextset(self) -> bool | None:
+        return None
+
+
+class _Info:
+
+    def __init__(self, backend_pid: int):
+        self.backend_pid = backend_pid
+
+
+class MemoryConnection:
+
+    def __init__(self, db: MemoryDatabase):
+        self._db = db
+        self._transaction: _Transaction | None = None
+        self._level = IsolationLevel.READ_COMMITTED
+        self._pipelined = False
+        # let the other tasks run at every statement, see `MemoryLockMonitor.scheduled`
+        self._handoff = True
+        self.info = _Info(next(_pids))
+
+    # `name` (server side cursors) makes no difference, rows are in memory anyway
+    def cursor(self, name: str = "", row_factory: Any = None) -> MemoryCursor:
+        return MemoryCursor(self, row_factory)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        await self.execute("begin")
+        try:
+            yield
+        except BaseException:
+            await self.execute("rollback")
+            raise
+        await self.execute("commit")
+
+    async def execute(self, query: str, params: Any = None) -> MemoryCursor:
+        return await self.cursor().execute(query, params)
+
+    # statements still run one by one as they are sent, but other tasks only run once the batch is sent (on exit)
+    @asynccontextmanager
+    async def pipeline(self) -> AsyncIterator[None]:
+        self._pipelined = True
+        try:
+            yield
+        finally:
+            self._pipelined = False
+        if self._handoff:
+            await asyncio.sleep(0)
+
+    async def _execute(self, query: str) -> Tuple[Tuple[str, ...], List[Tuple], int]:
+        statement = _parse(query)
+        db = self._db
+        t = self._transaction
+
+        match statement.kind:
+            case "begin":
+                t = self._transaction = db._begin(
+                    statement.level or IsolationLevel.READ_COMMITTED, self.info.backend_pid
+                )
+                t.read_only = bool(statement.read_only)
+                t.deferrable = bool(statement.deferrable)
+                return ((), [], -1)
+            case "set":
+                if t is None or t.snapshot is not None:
+                    raise psycopg.errors.ActiveSqlTransaction(
+                        "SET TRANSACTION ISOLATION LEVEL must be called before any query"
+                    )
+                if statement.level is not None:
+                    t.level = statement.level
+                if statement.read_only is not None:
+                    t.read_only = statement.read_only
+                if statement.deferrable is not None:
+                    t.deferrable = statement.deferrable
+                if t.serializable and t not in db._serializable:
+                    db._serializable.append(t)
+                return ((), [], -1)
+            case "commit" | "rollback":
+                self._transaction = None
+                if t is not None:
+                    if statement.kind == "rollback" or t.failed:
+                        db._abort(t)
+                    elif t.doomed:
+                        # like a failed commit in PostgreSQL, it ends the transaction
+                        db._abort(t)
+                        self._check(t, "commit attempt")
+                    else:
+                        db._commit(t)
+                return ((), [], -1)
+
+        if t is None:
+            t = db._begin(self._level, self.info.backend_pid, implicit=True)
+        elif t.failed:
+            raise psycopg.errors.InFailedSqlTransaction(
+                "current transaction is aborted, commands ignored until end of transaction block"
+            )
+
+        # a transaction is doomed by the conflicts of other transactions (checked before the statement) or of its own
+        stage = "conflict out checking" if statement.kind == "select" else "conflict in checking"
+        try:
+            self._check(t, stage)
+            result = await self._run(t, statement)
+            self._check(t, stage)
+        except psycopg.Error:
+            t.failed = True
+            db._abort(t)
+            if t.implicit:
+                self._transaction = None
+            raise
+
+        if t.implicit:
+            db._commit(t)
+        return result
+
+    def _check(self, t: _Transaction, stage: str):
+        if t.doomed:
+            raise psycopg.errors.SerializationFailure(_RW_DEPENDENCIES.format(stage=stage))
+
+    async def _run(self, t: _Transaction, statement: "_Statement") -> Tuple[Tuple[str, ...], List[Tuple], int]:
+        db = self._db
+        if t.read_only and (statement.kind in ("insert", "update", "delete") or statement.lock):
+            command = "SELECT FOR UPDATE" if statement.lock else statement.kind.upper()
+            raise psycopg.errors.ReadOnlySqlTransaction(f"cannot execute {command} in a read-only transaction")
+        if t.deferrable and t.read_only and t.serializable and t.snapshot is None:
+            await db._safe_snapshot(t)
+
+        if statement.kind == "advisory":
+            await db._advisory_lock(t, statement.values[0])
+            return (("pg_advisory_xact_lock",), [("",)], 1)
+
+        table = db._tables[statement.table]
+        match statement.kind:
+            case "select":
+                if statement.lock:
+                    # in the order the rows were locked
+                    rows = await db._select_for_update(
+                        t, table, statement.where, statement.id, statement.order, statement.limit, statement.lock
+                    )
+                elif statement.id is None and statement.order == "id" and statement.limit is not None:
+                    rows = list(itertools.islice(db._index_scan(t, table, statement.where), statement.limit))
+                else:
+                    rows = db._scan(t, table, statement.where, statement.id)
+                    if statement.order:
+                        rows = sorted(rows, key=lambda v: getattr(v, statement.order))
+                    if statement.limit is not None:
+                        rows = rows[:statement.limit]
+                if statement.columns == ("sum",):
+                    total = sum(v.balance for v in rows) if rows else None
+                    return (("sum",), [(total,)], 1)
+                values = [tuple(getattr(v, c) for c in statement.columns) for v in rows]
+                return (statement.columns, values, len(values))
+            case "insert":
+                for value in statement.values:
+                    db._insert(t, table, statement.columns[0], value)
+                return ((), [], len(statement.values))
+            case "update" | "delete":
+                modified = await db._modify(t, table, statement.where, statement.id, statement.assignments)
+                return ((), [], modified)
+            case _:
+                raise psycopg.NotSupportedError(f"Statement not supported by the memory backend: {statement.kind}")
+
+
+# `LockMonitor` asking the memory database directly. Statements only stop when waiting for a lock, so there is no need
+# to poll: it is enough to let the statement run until it either finishes or waits. Statements are started right away
+# and, for scheduled connections, don't let the other tasks run: a schedule in which nothing blocks runs without ever
+# switching tasks, but when the scheduler passes the token.
+class MemoryLockMonitor(LockMonitor):
+
+    def __init__(self, db: MemoryDatabase):
+        self.db = db
+        self.interval = 0
+
+    async def is_blocked(self, pid: int) -> bool:
+        return self.db.is_blocked(pid)
+
+    # runs `statement` until it finishes or waits for a lock, a task only resumes it in the second case
+    def start(self, statement: Awaitable[Any]) -> asyncio.Future:
+        if not asyncio.iscoroutine(statement):
+            return asyncio.ensure_future(statement)
+        try:
+            waiting = statement.send(None)
+        except StopIteration as stop:
+            done = asyncio.get_running_loop().create_future()
+            done.set_result(stop.value)
+            return done
+        except Exception as e:
+            failed = asyncio.get_running_loop().create_future()
+            failed.set_exception(e)
+            return failed
+        return asyncio.ensure_future(_resume(statement, waiting))
+
+    def scheduled(self, conns: List[MemoryConnection]):
+        for conn in conns:
+            conn._handoff = False
+
+    async def wait_until_blocked(self, pid: int, statement: asyncio.Future, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while not statement.done() and time.monotonic() < deadline:
+            if self.db.is_blocked(pid):
+                return True
+            await asyncio.sleep(0)
+
+        return False
+
+    # exact, no need to sample
+    def lock_wait(self, pid: int) -> float:
+        return self.db.lock_wait(pid)
+
+    async def sample(self, pids: List[int], stop: asyncio.Event, interval: float = 0.005):
+        await stop.wait()
+
+
+# Runs the coroutine `statement` started by `MemoryLockMonitor.start` to the end, `waiting` being what it waits for
+# (a future, or None to let the other tasks run): the outcome of the wait is sent back to it as if it awaited it.
+async def _resume(statement: Coroutine[Any, Any, Any], waiting: Any) -> Any:
+    while True:
+        error = None
+        if waiting is not None:
+            # yielded by `statement` as blocking, it is awaited here instead
+            waiting._asyncio_future_blocking = False
+        try:
+            await (asyncio.sleep(0) if waiting is None else waiting)
+        except BaseException as e:
+            # the errors of `waiting` are raised in `statement` anyway, the others (cancelling this task) are sent to it
+            if waiting is None or not waiting.done():
+                error = e
+        try:
+            waiting = statement.send(None) if error is None else statement.throw(error)
+        except StopIteration as stop:
+            return stop.value
+
+
+# `LockSampler` asking the memory database directly. Its predicate locks are the rows read by serializable transactions
+# (tuple) and their reads of the whole table (relation), never escalated, and it has no other locks than the ones
+# transactions wait for.
+class MemoryLockSampler(LockSampler):
+
+    def __init__(self, db: MemoryDatabase):
+        super().__init__(None)
+        self.db = db
+
+    async def _sample(self, pids: List[int]) -> Tuple[List[LockCount], Dict[int, Set[int]]]:
+        counts = []
+        # committed transactions keep their locks as long as running ones are concurrent with them (see `_vacuum`)
+        oldest = min(self.db._active, default=self.db._next_xid)
+        for t in self.db._serializable:
+            if t.pid not in pids or (t.committed_before is not None and t.committed_before <= oldest):
+                continue
+            for table in sorted(t.tables):
+                counts.append(LockCount(t.pid, str(t.xid), True, "relation", table, True, 1))
+            for (table, ids) in sorted(t.reads.items()):
+                if ids:
+                    counts.append(LockCount(t.pid, str(t.xid), True, "tuple", table, True, len(ids)))
+
+        blocking: Dict[int, Set[int]] = {}
+        for (waiter, xid) in self.db._waiting.items():
+            (t, blocker) = (self.db._transactions.get(waiter), self.db._transactions.get(xid))
+            if t is not None and blocker is not None:
+                blocking.setdefault(t.pid, set()).add(blocker.pid)
+        return (counts, blocking)
+
+    async def _settings(self) -> Dict[str, int]:
+        return {}
+
+
+# same interface as `SessionPool`, every run gets a new database (and a new checker of its history with `check`)
+# with the rows of `dataset` and the pending JOBS, the indexes of `dataset` make no difference: there is no planner,
+# rows are found by id or scanned
+class MemorySessionPool:
+
+    def __init__(self, size: int = 1, participants: int = 2, check: bool = False, dataset: Dataset = DEFAULT):
+        # like the connections of `SessionPool`, at most `size` runs at a time
+        self._free = asyncio.Semaphore(size)
+        self._participants = participants
+        self._check = check
+        self._balances = dataset.balances()
+
+    async def __aenter__(self) -> "MemorySessionPool":
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    @asynccontextmanager
+    async def session(self, participants: int = 2) -> AsyncIterator[Session]:
+        if participants > self._participants:
+            raise ValueError(f"Runs of this pool have at most {self._participants} transactions, got {participants}")
+
+        async with self._free:
+            start = time.monotonic()
+            checker = Checker() if self._check else None
+            loading = time.monotonic()
+            db = MemoryDatabase(self._balances, checker, JOBS)
+            load = time.monotonic() - loading
+            conns = [db.connect() for _ in range(participants)]
+            yield Session(
+                conns,
+                MemoryLockMonitor(db),
+                ClientStateDiff(conns[0]),
+                MemoryLockSampler(db),
+                time.monotonic() - start,
+                checker,
+                load,
+            )
+
+
+# parsing
+
+class _Statement(NamedTuple):
+    kind: str
+    level: IsolationLevel | None = None
+    # select, update, delete and insert
+    table: str | None = None
+    # select: the columns returned, insert: the column of the values
+    columns: Tuple[str, ...] = ()
+    where: Callable[[_Version], bool] | None = None
+    # set when the where clause is `id = <n>`, rows are then looked up by id
+    id: int | None = None
+    # column
+    order: str | None = None
+    # update: new value of every column set, computed from the row updated
+    assignments: Tuple[Tuple[str, Callable[[_Version], Any]], ...] | None = None
+    values: Tuple[Any, ...] = ()
+    limit: int | None = None
+    # select ... for update: what to do with the rows locked by other transactions (_WAIT, _NOWAIT or _SKIP_LOCKED)
+    lock: str | None = None
+    # begin and set transaction: access mode and deferrable, None when not given
+    read_only: bool | None = None
+    deferrable: bool | None = None
+
+
+_OPERATORS: Dict[str, Callable[[int, int], bool]] = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<>": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+_LEVEL = r"isolation\s+level\s+(?P<level>read\s+uncommitted|read\s+committed|repeatable\s+read|serializable)"
+# an integer, or a string without quotes in it
+_LITERAL = r"-?\d+|'[^']*'"
+_TABLE = rf"(?P<table>{'|'.join(_VERSIONS)})"
+_CONDITION = rf"(?P<column{{n}}>\w+)\s*(?P<op{{n}}><>|!=|<=|>=|=|<|>)\s*(?P<value{{n}}>{_LITERAL})"
+_WHERE = rf"(?:\s+where\s+{_CONDITION.format(n=1)}(?:\s+and\s+{_CONDITION.format(n=2)})?)?"
+
+_BEGIN = re.compile(r"^(?:begin|start\s+transaction)(?:\s+transaction)?(?P<modes>(?:\s.*)?)$")
+_SET = re.compile(r"^set\s+transaction(?P<modes>\s.*)$")
+# one of the transaction modes of `begin` and `set transaction`, separated by commas or spaces
+_MODE = re.compile(
+    rf"\s*,?\s*(?:{_LEVEL}|read\s+(?P<access>only|write)|(?P<deferrable>(?:not\s+)?deferrable))"
+)
+_SELECT = re.compile(
+    rf"^select\s+(?P<columns>.+?)\s+from\s+{_TABLE}{_WHERE}(?:\s+order\s+by\s+(?P<order>\w+))?"
+    r"(?:\s+limit\s+(?P<limit>\d+))?(?P<lock>\s+for\s+update(?:\s+(?P<wait>nowait|skip\s+locked))?)?$"
+)
+_ADVISORY = re.compile(r"^select\s+pg_advisory_xact_lock\s*\(\s*(?P<key>-?\d+)\s*\)$")
+_UPDATE = re.compile(rf"^update\s+{_TABLE}\s+set\s+(?P<assignments>.+?){_WHERE}$")
+_ASSIGNMENT = re.compile(r"^(?P<column>\w+)\s*=\s*(?P<expr>.+)$")
+_DELETE = re.compile(rf"^delete\s+from\s+{_TABLE}{_WHERE}$")
+_INSERT = re.compile(rf"^insert\s+into\s+{_TABLE}\s*\(\s*(?P<column>\w+)\s*\)\s+values\s*(?P<values>.+)$")
+_VALUE = re.compile(rf"\(\s*({_LITERAL})\s*\)")
+_EXPRESSION = re.compile(rf"^(?P<left>{_LITERAL}|\w+)(?:\s*(?P<op>[+-])\s*(?P<right>\d+))?$")
+
+_parsed: Dict[str, _Statement] = {}
+
+
+def _parse(query: str) -> _Statement:
+    statement = _parsed.get(query)
+    if statement is None:
+        statement = _parsed[query] = _parse_statement(" ".join(query.strip().rstrip(";").lower().split()))
+    return statement
+
+
+def _parse_statement(query: str) -> _Statement:
+    if query in ("commit", "rollback"):
+        return _Statement(query)
+
+    if m := _BEGIN.match(query):
+        return _Statement("begin", **_modes(m.group("modes"), query))
+
+    if m := _SET.match(query):
+        return _Statement("set", **_modes(m.group("modes"), query))
+
+    if m := _ADVISORY.match(query):
+        return _Statement("advisory", values=(int(m.group("key")),))
+
+    if m := _SELECT.match(query):
+        table = m.group("table")
+        columns = m.group("columns")
+        if columns == "*":
+            columns = _VERSIONS[table].COLUMNS
+        elif columns == "sum(balance)" and table == "account":
+            columns = ("sum",)
+        else:
+            columns = tuple(c.strip() for c in columns.split(","))
+            _check_columns(table, columns, query)
+        if m.group("order"):
+            _check_columns(table, (m.group("order"),), query)
+        return _Statement(
+            "select",
+            table=table,
+            columns=columns,
+            order=m.group("order"),
+            limit=int(m.group("limit")) if m.group("limit") else None,
+            lock=" ".join(m.group("wait").split()) if m.group("wait") else _WAIT if m.group("lock") else None,
+            **_where(m, query),
+        )
+
+    if m := _UPDATE.match(query):
+        assignments = _assignments(m.group("table"), m.group("assignments"), query)
+        return _Statement("update", table=m.group("table"), assignments=assignments, **_where(m, query))
+
+    if m := _DELETE.match(query):
+        return _Statement("delete", table=m.group("table"), **_where(m, query))
+
+    if m := _INSERT.match(query):
+        (table, column) = (m.group("table"), m.group("column"))
+        values = _VALUE.findall(m.group("values"))
+        if not values or column == "id":
+            raise psycopg.NotSupportedError(f"Query not supported by the memory backend: {query}")
+        _check_columns(table, (column,), query)
+        return _Statement("insert", table=table, columns=(column,), values=tuple(_literal(v) for v in values))
+
+    raise psycopg.NotSupportedError(f"Query not supported by the memory backend: {query}")
+
+
+def _level(level: str | None) -> IsolationLevel | None:
+    return _ISOLATION_LEVELS[" ".join(level.split())] if level else None
+
+
+def _modes(modes: str, query: str) -> Dict[str, Any]:
+    found: Dict[str, Any] = {}
+    position = 0
+    while position < len(modes):
+        m = _MODE.match(modes, position)
+        if m is None:
+            raise psycopg.NotSupportedError(f"Query not supported by the memory backend: {query}")
+        if m.group("level"):
+            found["level"] = _level(m.group("level"))
+        elif m.group("access"):
+            found["read_only"] = m.group("access") == "only"
+        else:
+            found["deferrable"] = not m.group("deferrable").startswith("not")
+        position = m.end()
+    return found
+
+
+def _check_columns(table: str, columns: Tuple[str, ...], query: str):
+    if any(c not in _VERSIONS[table].COLUMNS for c in columns):
+        raise psycopg.NotSupportedError(f"Query not supported by the memory backend: {query}")
+
+
+def _literal(literal: str) -> Any:
+    return literal[1:-1] if literal.startswith("'") else int(literal)
+
+
+def _where(m: re.Match, query: str) -> Dict[str, Any]:
+    conditions = []
+    id = None
+    for n in (1, 2):
+        column = m.group(f"column{n}")
+        if column is None:
+            continue
+        _check_columns(m.group("table"), (column,), query)
+        (op, value) = (m.group(f"op{n}"), _literal(m.group(f"value{n}")))
+        conditions.append((column, _OPERATORS[op], value))
+        if column == "id" and op == "=":
+            id = value
+
+    if not conditions:
+        return {}
+    where = lambda v: all(op(getattr(v, column), value) for (column, op, value) in conditions)
+    if id is not None:
+        return {"where": where, "id": id}
+    return {"where": where}
+
+
+# `column = expression` separated by commas
+def _assignments(table: str, assignments: str, query: str) -> Tuple[Tuple[str, Callable[[_Version], Any]], ...]:
+    parsed = []
+    for assignment in assignments.split(","):
+        m = _ASSIGNMENT.match(assignment.strip())
+        if m is None or m.group("column") == "id":
+            raise psycopg.NotSupportedError(f"Query not supported by the memory backend: {query}")
+        _check_columns(table, (m.group("column"),), query)
+        parsed.append((m.group("column"), _expression(table, m.group("expr"), query)))
+    return tuple(parsed)
+
+
+# a column or a literal, plus or minus an integer
+def _expression(table: str, expression: str, query: str) -> Callable[[_Version], Any]:
+    m = _EXPRESSION.match(expression.strip())
+    if m is None:
+        raise psycopg.NotSupportedError(f"Query not supported by the memory backend: {query}")
+
+    left = m.group("left")
+    right = int(m.group("right") or 0) * (-1 if m.group("op") == "-" else 1)
+    if re.fullmatch(_LITERAL, left) is None:
+        _check_columns(table, (left,), query)
+        if not right:
+            return lambda v: getattr(v, left)
+        return lambda v: getattr(v, left) + right
+    constant = _literal(left)
+    if right:
+        if isinstance(constant, str):
+            raise psycopg.NotSupportedError(f"Query not supported by the memory backend: {query}")
+        constant += right
+    return lambda v: constant
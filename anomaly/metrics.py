@@ -0,0 +1,196 @@
+import json
+from typing import Any, Dict, List, NamedTuple, TextIO
+
+
+# Statement latencies, split into time waiting for locks and the rest (execution), kept in HDR-style histograms per
+# anomaly, isolation level, transaction and statement. Recording a value is a couple of integer operations and a dict
+# update, cheap enough to leave on during `--stress` runs.
+
+# percentiles reported in both formats
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# sub-buckets per power of two: values are kept with less than 1/64 (~1.6%) relative error
+_SUB_BUCKET_BITS = 7
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_HALF = _SUB_BUCKETS >> 1
+
+# values are recorded in microseconds
+_UNIT = 1e-6
+_PER_UNIT = 1e6
+
+
+# Log-linear histogram (as HdrHistogram): values below 128 have their own bucket, larger ones share a bucket with the
+# values having the same 7 leading bits.
+class Histogram:
+
+    count: int
+    total: float
+    min: float
+    max: float
+    _buckets: Dict[int, int]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self._buckets = {}
+
+    # `value` in seconds, not negative
+    def record(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+        units = int(value * _PER_UNIT)
+        if units < _SUB_BUCKETS:
+            index = units
+        else:
+            shift = units.bit_length() - _SUB_BUCKET_BITS
+            index = _SUB_BUCKETS + (shift - 1) * _HALF + (units >> shift) - _HALF
+        buckets = self._buckets
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def merge(self, other: "Histogram") -> None:
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+        for (index, count) in other._buckets.items():
+            self._buckets[index] = self._buckets.get(index, 0) + count
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    # seconds, the highest value of the bucket holding the `q` quantile (at most the maximum recorded)
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return min(self.max, _upper_bound(index) * _UNIT)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "mean": self.mean,
+            **{f"p{q * 100:g}": self.quantile(q) for q in QUANTILES},
+        }
+
+
+def _upper_bound(index: int) -> int:
+    if index < _SUB_BUCKETS:
+        return index
+    shift = (index - _SUB_BUCKETS) // _HALF + 1
+    top = (index - _SUB_BUCKETS) % _HALF + _HALF
+    return ((top + 1) << shift) - 1
+
+
+class Key(NamedTuple):
+    anomaly: str
+    isolation_level: str
+    transaction: str
+    statement: str
+
+
+class Series:
+
+    latency: Histogram
+    execution: Histogram
+    lock_wait: Histogram
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.execution = Histogram()
+        self.lock_wait = Histogram()
+
+    # seconds, `lock_wait` is the part of `latency` the statement spent waiting for locks
+    def record(self, latency: float, lock_wait: float = 0.0) -> None:
+        if lock_wait > latency:
+            lock_wait = latency
+        self.latency.record(latency)
+        self.execution.record(latency - lock_wait)
+        self.lock_wait.record(lock_wait)
+
+
+class Metrics:
+
+    series: Dict[Key, Series]
+
+    def __init__(self):
+        self.series = {}
+
+    # for callers recording the same statements over and over, to keep the series at hand
+    def get(self, anomaly: str, isolation_level: str, transaction: str, statement: str) -> Series:
+        key = Key(anomaly, isolation_level, transaction, statement)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series()
+        return series
+
+    def observe(
+        self,
+        anomaly: str,
+        isolation_level: str,
+        transaction: str,
+        statement: str,
+        latency: float,
+        lock_wait: float = 0.0,
+    ) -> None:
+        self.get(anomaly, isolation_level, transaction, statement).record(latency, lock_wait)
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                **key._asdict(),
+                "latency": series.latency.summary(),
+                "execution": series.execution.summary(),
+                "lock_wait": series.lock_wait.summary(),
+            }
+            for (key, series) in self.series.items()
+        ]
+
+    def write_json(self, out: TextIO) -> None:
+        json.dump(self.to_json(), out, indent=2)
+        out.write("\n")
+
+    # Prometheus text exposition format, as summaries
+    def write_prometheus(self, out: TextIO) -> None:
+        for (part, help) in (
+            ("latency", "Statement latency"),
+            ("execution", "Statement latency, lock waits excluded"),
+            ("lock_wait", "Time statements spent waiting for locks"),
+        ):
+            name = f"txiso_statement_{part}_seconds"
+            out.write(f"# HELP {name} {help}.\n")
+            out.write(f"# TYPE {name} summary\n")
+            for (key, series) in self.series.items():
+                histogram: Histogram = getattr(series, part)
+                labels = ",".join(f'{label}="{_escape(value)}"' for (label, value) in key._asdict().items())
+                for q in QUANTILES:
+                    out.write(f'{name}{{{labels},quantile="{q:g}"}} {histogram.quantile(q):.9g}\n')
+                out.write(f"{name}_sum{{{labels}}} {histogram.total:.9g}\n")
+                out.write(f"{name}_count{{{labels}}} {histogram.count}\n")
+
+    # the format follows the extension: .json or, for anything else, Prometheus text
+    def write(self, path: str) -> None:
+        with open(path, "w") as out:
+            if path.endswith(".json"):
+                self.write_json(out)
+            else:
+                self.write_prometheus(out)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,41 +1,23 @@
-from anomaly.base import ConcurrentTransactionExample
+from anomaly.steps import commit, modify, select, transaction, yield_to
 from anomaly import registry
 
 
-class T1(ConcurrentTransactionExample):
+T1 = transaction(
+    yield_to(),
+    modify("update account set balance = 10 where id = 1;"),
+    commit(),
+    yield_to(),
+)
 
-    async def run(self):
-        async with self.conn.cursor() as cursor:
-            await self.begin_transaction_with_isolation_level(cursor)
+T2 = transaction(
+    yield_to(),
+    select("select balance from account where id = 1;"),
+    commit(),
+    yield_to(),
+)
 
-            await self.yield_for_another_task()
 
-            query = "update account set balance = 10 where id = 1;"
-            await cursor.execute(query)
-            self.print_text(query, f"MODIFIED: {cursor.rowcount}")
-            
-            await cursor.execute("commit;")
-            self.print_text("COMMIT")
-            await self.yield_for_another_task()
-
-
-class T2(ConcurrentTransactionExample):
-
-    async def run(self):
-        async with self.conn.cursor() as cursor:
-            await self.begin_transaction_with_isolation_level(cursor)
-
-            await self.yield_for_another_task()
-
-            query = "select balance from account where id = 1;"
-            await cursor.execute(query)
-            self.print_query_result(query, await cursor.fetchall())
-
-            await cursor.execute("commit;")
-            self.print_text("COMMIT")
-            await self.yield_for_another_task()
-
-registry.register("non-repeatable-read-snapshot", T1, T2, description="""
+registry.register_transactions("non-repeatable-read-snapshot", T1, T2, description="""
 This example is similar to `non-repetable-read`, but it is intended to show when the DB takes the snapshop for repeatable reads.
 For PostgreSQL, the value snapshot is taken on the first read (`select`), and not before `begin transaction`.
                   
@@ -0,0 +1,233 @@
+import asyncio
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from os import environ
+from typing import AsyncIterator, List, NamedTuple, Tuple
+
+from psycopg import AsyncConnection, sql
+from psycopg.rows import dict_row, tuple_row
+from psycopg_pool import AsyncConnectionPool
+
+from anomaly.base import LockMonitor
+from anomaly.checker import Checker
+from anomaly.dataset import DEFAULT, JOBS, Dataset
+from anomaly.diff import StateDiff
+from anomaly.locks import LockSampler
+
+
+# schemas created for runs are named SCHEMA_PREFIX<backend pid of the pool owner connection>_<slot>
+SCHEMA_PREFIX = "txiso_"
+
+# `copy` payload of the default dataset, built once
+_DEFAULT_COPY: bytes = DEFAULT.copy_payload()
+
+
+class Session(NamedTuple):
+    # one per transaction, in order
+    transactions: List[AsyncConnection]
+    monitor: LockMonitor
+    # state of the `account` table before and after the run
+    state: StateDiff
+    # locks of the transactions, sampled on the connection of the lock monitor
+    locks: LockSampler
+    # seconds spent getting the connections and resetting the tables
+    setup: float
+    # dependency graph of the run, only for backends that can report the versions read and written
+    checker: Checker | None = None
+    # part of `setup` spent loading the rows (and building the indexes)
+    load: float = 0.0
+
+
+class _Slot:
+
+    schema: str
+    ready: bool
+
+    def __init__(self, schema: str):
+        self.schema = schema
+        self.ready = False
+
+
+# Hands the connections of a run (one per transaction plus the lock monitor) out of a connection pool.
+# At most `size` runs, of up to `participants` transactions each, happen at the same time, each one in its own slot
+# with its own schema, so any number of pools (and processes) can share the same database. A slot creates its schema
+# and tables on its first run and only resets their content (truncate + copy) on the following ones. The rows are the
+# ones of `dataset` (see `anomaly.dataset`).
+# The pool keeps an extra "owner" connection open while it is in use. Schemas are named after its backend pid, so the
+# schemas of a crashed process can be told apart from the ones in use (see `collect_garbage`).
+class SessionPool:
+
+    _pool: AsyncConnectionPool
+    _owner: AsyncConnection | None
+    _size: int
+    _participants: int
+    _dataset: Dataset
+    _copy: bytes
+    _slots: List[_Slot]
+    _free: asyncio.Queue
+
+    def __init__(self, size: int = 1, participants: int = 2, dataset: Dataset = DEFAULT):
+        # runs never hold more than max_size connections all together, so they can't starve each other
+        self._pool = AsyncConnectionPool(
+            connection_string(),
+            kwargs={"row_factory": dict_row, "autocommit": True},
+            min_size=min(3, participants + 1) * size,
+            max_size=(participants + 1) * size,
+            open=False,
+        )
+        self._owner = None
+        self._size = size
+        self._participants = participants
+        self._dataset = dataset
+        self._copy = _DEFAULT_COPY if dataset == DEFAULT else dataset.copy_payload()
+        self._slots = []
+        self._free = asyncio.Queue()
+
+    async def __aenter__(self) -> "SessionPool":
+        self._owner = await AsyncConnection.connect(connection_string(), autocommit=True)
+        try:
+            await collect_garbage(self._owner)
+            await self._pool.open(wait=True)
+        except BaseException:
+            await self._owner.close()
+            raise
+
+        owner_pid = self._owner.info.backend_pid
+        self._slots = [_Slot(f"{SCHEMA_PREFIX}{owner_pid}_{i}") for i in range(self._size)]
+        for slot in self._slots:
+            self._free.put_nowait(slot)
+
+        return self
+
+    async def __aexit__(self, *_):
+        try:
+            for slot in self._slots:
+                if slot.ready:
+                    await drop_schema(self._owner, slot.schema)
+        finally:
+            await self._pool.close()
+            await self._owner.close()
+
+    @asynccontextmanager
+    async def session(self, participants: int = 2) -> AsyncIterator[Session]:
+        if participants > self._participants:
+            raise ValueError(f"Runs of this pool have at most {self._participants} transactions, got {participants}")
+
+        slot = await self._free.get()
+        try:
+            start = time.monotonic()
+            async with AsyncExitStack() as stack:
+                conns = [await stack.enter_async_context(self._pool.connection()) for _ in range(participants + 1)]
+                if not slot.ready:
+                    await create_schema(conns[0], slot.schema)
+
+                await asyncio.gather(*[set_search_path(conn, slot.schema) for conn in conns])
+
+                loading = time.monotonic()
+                if not slot.ready:
+                    await create_tables(conns[0], self._copy, self._dataset.indexes)
+                    slot.ready = True
+                else:
+                    await reset_tables(conns[0], self._copy)
+                load = time.monotonic() - loading
+
+                yield Session(
+                    conns[:-1],
+                    LockMonitor(conns[-1]),
+                    StateDiff(conns[0]),
+                    LockSampler(conns[-1]),
+                    time.monotonic() - start,
+                    None,
+                    load,
+                )
+        finally:
+            self._free.put_nowait(slot)
+
+
+# server_version_num of the database
+async def server_version() -> int:
+    async with await AsyncConnection.connect(connection_string()) as conn:
+        return conn.info.server_version
+
+
+def connection_string() -> str:
+    connection_string = environ.get("PG_CONNECTION_STRING")
+    if not connection_string:
+        raise RuntimeError("Missing PG_CONNECTION_STRING env")
+
+    return connection_string
+
+
+async def set_search_path(conn: AsyncConnection, schema: str):
+    await conn.execute(sql.SQL("set search_path to {};").format(sql.Identifier(schema)))
+
+
+async def create_schema(conn: AsyncConnection, schema: str):
+    await drop_schema(conn, schema)
+    await conn.execute(sql.SQL("create schema {};").format(sql.Identifier(schema)))
+
+
+async def drop_schema(conn: AsyncConnection, schema: str):
+    await conn.execute(sql.SQL("drop schema if exists {} cascade;").format(sql.Identifier(schema)))
+
+
+# drops the run schemas left behind by pools whose owner connection is gone (e.g. a crashed process)
+async def collect_garbage(conn: AsyncConnection) -> List[str]:
+    async with conn.cursor(row_factory=tuple_row) as c:
+        await c.execute(
+            """
+                select nspname from (
+                    select nspname, substring(nspname from %s)::int as owner_pid from pg_namespace
+                ) as s
+                where owner_pid is not null and owner_pid not in (select pid from pg_stat_activity);
+            """,
+            (f"^{SCHEMA_PREFIX}([0-9]+)_[0-9]+$",),
+        )
+        schemas = [schema for (schema,) in await c.fetchall()]
+
+    for schema in schemas:
+        await drop_schema(conn, schema)
+
+    return schemas
+
+
+# indexes are built once the rows are loaded, and the statistics of the planner gathered: following resets load the
+# same rows, the indexes are kept up to date by `copy` and the statistics stay right
+async def create_tables(
+    conn: AsyncConnection, payload: bytes = _DEFAULT_COPY, indexes: Tuple[Tuple[str, ...], ...] = ()
+):
+    async with conn.cursor() as c:
+        await c.execute("drop table if exists account, job;")
+        await c.execute("""
+            create table account (
+                id serial primary key,
+                balance int not null,
+                -- incremented by the updates doing an optimistic compare and set on it
+                version int not null default 0
+            );
+        """)
+        # the queue of `anomaly.work_queue`
+        await c.execute("""
+            create table job (
+                id serial primary key,
+                status text not null default 'pending',
+                payload text not null
+            );
+        """)
+
+    await reset_tables(conn, payload)
+
+    async with conn.cursor() as c:
+        for columns in indexes:
+            columns_sql = sql.SQL(", ").join(map(sql.Identifier, columns))
+            await c.execute(sql.SQL("create index on account ({});").format(columns_sql))
+        await c.execute("analyze account, job;")
+
+
+# `payload` as built by `Dataset.copy_payload`, the jobs are JOBS
+async def reset_tables(conn: AsyncConnection, payload: bytes = _DEFAULT_COPY):
+    async with conn.cursor() as c:
+        await c.execute("truncate account, job restart identity;")
+        async with c.copy("copy account (balance) from stdin (format binary);") as copy:
+            await copy.write(payload)
+        await c.execute("insert into job (payload) select unnest(%s::text[]);", (JOBS,))
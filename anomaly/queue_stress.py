@@ -0,0 +1,272 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Set
+
+import psycopg
+from psycopg import AsyncConnection, IsolationLevel
+
+from anomaly.dataset import DEFAULT, JOBS, Dataset
+from anomaly.retry import RetryCost, RetryPolicy, retry
+from anomaly.runner import ISOLATION_LEVELS, create_pool
+from anomaly.steps import StepKind, Transaction, check_expected
+from anomaly.stress import percentile
+from anomaly import registry
+
+
+# Load mode of the work queue examples (see `anomaly.work_queue`): `producers` connections insert jobs while
+# `consumers` connections claim them, running the transactions of the example over and over (consumer i runs T(i mod n))
+# for a given time or number of claims. A claim is the job bound as `id` by a transaction that committed; a job
+# claimed by more than one is counted as a duplicate claim. A consumer finding no pending job rolls back and polls
+# again a bit later, producers stop inserting while BACKLOG jobs are pending.
+# Lock waits of the consumers are sampled by the lock monitor of the session (exact with the memory backend).
+
+JOB = "id"
+
+PRODUCE = "insert into job (payload) values ('produced');"
+
+# pending jobs past which producers wait
+BACKLOG = 64
+
+# seconds to wait before polling an empty queue again, or inserting into a full one
+_IDLE = 0.001
+
+_LATENCY_PERCENTILES = (50, 95, 99)
+
+
+class QueueResult(NamedTuple):
+    anomaly: str
+    isolation_level: str
+    producers: int
+    consumers: int
+    elapsed: float
+    produced: int
+    claims: int
+    # claims of a job claimed before
+    duplicates: int
+    # claims finding no pending job
+    empty: int
+    serialization_failures: int
+    deadlocks: int
+    lock_failures: int
+    # claims the retry policy gave up on
+    gave_up: int
+    # seconds the consumers waited for locks, together
+    lock_wait: float
+    # seconds from begin (of the first attempt) to commit of every claim, sorted
+    latencies: List[float]
+
+
+class _NoJob(Exception):
+    pass
+
+
+class _Counters:
+
+    def __init__(self, pending: int):
+        self.produced = 0
+        self.pending = pending
+        self.claims = 0
+        self.duplicates = 0
+        self.empty = 0
+        self.serialization_failures = 0
+        self.deadlocks = 0
+        self.lock_failures = 0
+        self.gave_up = 0
+        self.claimed: Set[Any] = set()
+        self.latencies: List[float] = []
+
+
+async def queue_matrix(
+    anomalies: List[str],
+    isolation_levels: List[str],
+    producers: int,
+    consumers: List[int],
+    duration: float | None,
+    iterations: int | None,
+    backend: str = "postgres",
+    policy: RetryPolicy | None = None,
+    dataset: Dataset = DEFAULT,
+) -> List[QueueResult]:
+    results = []
+    async with create_pool(backend, 1, producers + max(consumers), dataset=dataset) as pool:
+        for anomaly in anomalies:
+            for level in isolation_levels:
+                for count in consumers:
+                    results.append(await queue(pool, anomaly, level, producers, count, duration, iterations, policy))
+    return results
+
+
+async def queue(
+    pool: Any,
+    anomaly: str,
+    isolation_level: str,
+    producers: int,
+    consumers: int,
+    duration: float | None,
+    iterations: int | None,
+    policy: RetryPolicy | None = None,
+) -> QueueResult:
+    transactions = registry.resolve_transactions(anomaly)
+    if transactions is None or any(not any(step.bind == JOB for step in t.steps) for t in transactions):
+        raise ValueError(f"Anomaly {anomaly} doesn't claim jobs (binding `{JOB}`), it can't be run as a queue")
+
+    level = ISOLATION_LEVELS[isolation_level]
+    counters = _Counters(len(JOBS))
+    async with pool.session(producers + consumers) as session:
+        start = time.monotonic()
+        deadline = start + duration if duration is not None else None
+
+        def done() -> bool:
+            if deadline is not None and time.monotonic() >= deadline:
+                return True
+            return iterations is not None and counters.claims >= iterations
+
+        pids = [conn.info.backend_pid for conn in session.transactions[producers:]]
+        waited = sum(session.monitor.lock_wait(pid) for pid in pids)
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(session.monitor.sample(pids, stop))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for conn in session.transactions[:producers]:
+                    tg.create_task(_producer(conn, level, counters, done))
+                for (i, conn) in enumerate(session.transactions[producers:]):
+                    tg.create_task(_consumer(conn, transactions[i % len(transactions)], level, counters, done, policy))
+        finally:
+            stop.set()
+            await sampler
+
+        elapsed = time.monotonic() - start
+        lock_wait = sum(session.monitor.lock_wait(pid) for pid in pids) - waited
+
+    return QueueResult(
+        anomaly,
+        isolation_level,
+        producers,
+        consumers,
+        elapsed,
+        counters.produced,
+        counters.claims,
+        counters.duplicates,
+        counters.empty,
+        counters.serialization_failures,
+        counters.deadlocks,
+        counters.lock_failures,
+        counters.gave_up,
+        lock_wait,
+        sorted(counters.latencies),
+    )
+
+
+async def _producer(conn: AsyncConnection, level: IsolationLevel, counters: _Counters, done: Callable[[], bool]):
+    isolation = level.name.lower().replace("_", " ")
+    async with conn.cursor() as cursor:
+
+        async def attempt(cost: RetryCost):
+            await cursor.execute("begin transaction")
+            await cursor.execute(f"set transaction isolation level {isolation}")
+            await cursor.execute(PRODUCE)
+            await cursor.execute("commit;")
+
+        async def on_abort(exc: Exception):
+            await cursor.execute("rollback;")
+
+        while not done():
+            if counters.pending >= BACKLOG:
+                await asyncio.sleep(_IDLE)
+                continue
+            # inserting the job has to succeed, whatever the consumers do
+            await retry(RetryPolicy(), attempt, on_abort)
+            counters.produced += 1
+            counters.pending += 1
+
+
+async def _consumer(
+    conn: AsyncConnection,
+    transaction: Transaction,
+    level: IsolationLevel,
+    counters: _Counters,
+    done: Callable[[], bool],
+    policy: RetryPolicy | None,
+):
+    isolation = level.name.lower().replace("_", " ")
+    async with conn.cursor() as cursor:
+        values: Dict[str, Any] = {}
+
+        async def attempt(cost: RetryCost):
+            values.clear()
+            await cursor.execute("begin transaction")
+            await cursor.execute(f"set transaction isolation level {isolation}")
+            for step in transaction.steps:
+                if step.kind == StepKind.YIELD:
+                    continue
+                cost.statements += 1
+                await cursor.execute(step.sql.format(**values) if values else step.sql)
+                check_expected(step, cursor.rowcount)
+                if step.bind:
+                    row = await cursor.fetchone()
+                    if row is None:
+                        raise _NoJob()
+                    values[step.bind] = row[step.bind]
+
+        async def on_abort(exc: Exception):
+            await cursor.execute("rollback;")
+            if isinstance(exc, psycopg.errors.SerializationFailure):
+                counters.serialization_failures += 1
+            elif isinstance(exc, psycopg.errors.LockNotAvailable):
+                counters.lock_failures += 1
+            else:
+                counters.deadlocks += 1
+
+        while not done():
+            start = time.monotonic()
+            try:
+                cost = await retry(policy or RetryPolicy(max_attempts=1), attempt, on_abort)
+            except _NoJob:
+                await cursor.execute("rollback;")
+                counters.empty += 1
+                await asyncio.sleep(_IDLE)
+                continue
+
+            if not cost.committed:
+                counters.gave_up += 1
+                continue
+            job = values[JOB]
+            if job in counters.claimed:
+                counters.duplicates += 1
+            else:
+                counters.claimed.add(job)
+                counters.pending -= 1
+            counters.claims += 1
+            counters.latencies.append(time.monotonic() - start)
+
+
+def format_queue(results: List[QueueResult]) -> str:
+    header = ["anomaly", "isolation level", "producers", "consumers", "claims/s", "duplicates", "empty polls",
+              "serialization failures", "lock not available", "deadlocks", "gave up", "lock wait ms/claim",
+              *[f"p{p} ms" for p in _LATENCY_PERCENTILES], "max ms"]
+
+    rows = [header]
+    for r in results:
+        attempts = r.claims + r.serialization_failures + r.lock_failures + r.deadlocks or 1
+        rows.append([
+            r.anomaly,
+            r.isolation_level,
+            str(r.producers),
+            str(r.consumers),
+            f"{r.claims / r.elapsed:.1f}" if r.elapsed else "-",
+            str(r.duplicates),
+            str(r.empty),
+            f"{r.serialization_failures} ({100 * r.serialization_failures / attempts:.1f}%)",
+            f"{r.lock_failures} ({100 * r.lock_failures / attempts:.1f}%)",
+            f"{r.deadlocks} ({100 * r.deadlocks / attempts:.1f}%)",
+            str(r.gave_up),
+            f"{r.lock_wait * 1000 / r.claims:.2f}" if r.claims else "-",
+            *[f"{percentile(r.latencies, p) * 1000:.2f}" for p in _LATENCY_PERCENTILES],
+            f"{r.latencies[-1] * 1000:.2f}" if r.latencies else "-",
+        ])
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join(
+        "|" + "|".join(value.ljust(width) for (value, width) in zip(row, widths)) + "|"
+        for row in rows
+    )
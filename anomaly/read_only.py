@@ -0,0 +1,101 @@
+from anomaly.steps import commit, modify, select, transaction, yield_to
+from anomaly import registry
+
+
+# The read only transaction anomaly (Fekete, O'Neil and O'Neil, "A Read-Only Transaction Anomaly Under Snapshot
+# Isolation"): account 1 is the checking account of a customer and the other rows are their savings, every deposit
+# adding a row. A withdrawal from checking leaving the customer with less than nothing overall costs an overdraft fee
+# of 1. T1 withdraws 100, T2 deposits 20 into savings and T3 is a report of the balances, which only reads.
+# The deposit is an insert: an update would have to find its row first, which PostgreSQL does with a sequential scan
+# of the two rows, reading (and predicate locking) the whole table: T1 and T2 would then fail without T3.
+#
+# The readers of `--readers` (see `anomaly.reader_stress`) are the T3s of these examples.
+
+
+WITHDRAWAL_T1 = transaction(
+    select("select balance from account where id = 1;"),
+    select("select sum(balance) from account where id >= 2;"),
+    yield_to(),
+    # 67 + 31 - 100 < 0, so the fee is due
+    modify("update account set balance = balance - 101 where id = 1;"),
+    commit(),
+)
+
+DEPOSIT_T2 = transaction(
+    modify("insert into account (balance) values (20);"),
+    commit(),
+)
+
+REPORT_T3 = transaction(
+    select("select * from account order by id;"),
+    commit(),
+)
+
+
+registry.register_transactions("read-only-anomaly", WITHDRAWAL_T1, DEPOSIT_T2, REPORT_T3, description="""
+T1 reads the checking and savings balances (98 in all) and withdraws 100 from checking with the overdraft fee.
+Meanwhile T2 deposits 20 into savings (a new row) and commits, then T3 reports the balances: the deposit, without the
+withdrawal. The fee only makes sense if T1 ran before T2, but the report shows T2 ran before T1: with
+`repeatable read`, the only cycle of dependencies goes through T3, the transaction that only reads. Without T3, T1
+and T2 are serializable. `serializable` fails T1, which T3 turned into a pivot. Opening T3 `read only`
+(`--read-only`) changes nothing, T2 committed before its snapshot; `deferrable` (`--deferrable`, or
+read-only-anomaly-deferrable) does.
+
+┌────┐              ┌────┐                   ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ T3 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘                   └──┬─┘
+   │                   │                        │                        │
+   ├──select balances──┼────────────────────────┼───────────────────────►│ 67, 31
+   │                   │                        │                        │
+   │                   ├──insert deposit of 20──┼───────────────────────►│
+   │                   │                        │                        │
+   │                   ├──commit────────────────┼───────────────────────►│
+   │                   │                        │                        │
+   │                   │                        ├──select balances──────►│ 67, 31, 20
+   │                   │                        │                        │
+   │                   │                        ├──commit───────────────►│
+   │                   │                        │                        │
+   ├──withdraw 100 + 1 fee from 1───────────────┼───────────────────────►│ raises an error for `serializable`
+   │                   │                        │                        │
+   ├──commit/rollback──┼────────────────────────┼───────────────────────►│
+   │                   │                        │                        │
+""")
+
+
+# the report waits for a snapshot no anomaly can go through
+DEFERRABLE_REPORT_T3 = transaction(
+    select("select * from account order by id;"),
+    commit(),
+    read_only=True,
+    deferrable=True,
+)
+
+
+registry.register_transactions(
+    "read-only-anomaly-deferrable", WITHDRAWAL_T1, DEPOSIT_T2, DEFERRABLE_REPORT_T3, description="""
+Same as read-only-anomaly, with T3 opened `read only deferrable`. With `serializable`, the select of T3 waits for the
+serializable transactions running when it started (T1) to end: T1 committed with a rw-conflict out to T2, which
+committed before the snapshot of T3, so T3 takes a new one, seeing the withdrawal too, and runs without any predicate
+lock or rw-conflict, neither failing nor failing others. The other isolation levels ignore `deferrable`, and report
+the deposit without the withdrawal.
+
+┌────┐              ┌────┐                   ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ T3 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘                   └──┬─┘
+   │                   │                        │                        │
+   ├──select balances──┼────────────────────────┼───────────────────────►│ 67, 31
+   │                   │                        │                        │
+   │                   ├──insert deposit of 20──┼───────────────────────►│
+   │                   │                        │                        │
+   │                   ├──commit────────────────┼───────────────────────►│
+   │                   │                        │                        │
+   │                   │                        ├──select balances──────►│ waits for T1 with `serializable`
+   │                   │                        │                        │
+   ├──withdraw 100 + 1 fee from 1───────────────┼───────────────────────►│
+   │                   │                        │                        │
+   ├──commit───────────┼────────────────────────┼───────────────────────►│
+   │                   │                        │                        │
+   │                   │                        │                        │ T3 selects -34, 31, 20
+   │                   │                        ├──commit───────────────►│
+   │                   │                        │                        │
+""")
@@ -0,0 +1,213 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+from psycopg import AsyncConnection
+
+from anomaly.base import access_mode
+from anomaly.dataset import DEFAULT, Dataset
+from anomaly.retry import RetryCost, RetryPolicy, retry
+from anomaly.runner import create_pool
+from anomaly.steps import StepKind, Transaction, check_expected, reads_only
+from anomaly.stress import percentile
+from anomaly import registry
+
+
+# Load mode of the read only examples (see `anomaly.read_only`), measuring what serializable readers cost: `writers`
+# connections run the transactions of the example that write while `readers` connections run the ones that only read,
+# all serializable, over and over for a given time or number of reports (reader transactions committed). It runs once
+# per access mode of the readers:
+# - read write: the readers are tracked by serializable snapshot isolation like the writers
+# - read only: they are only tracked until no concurrent writer can make their snapshot unsafe, and can't be T_in of a
+#   dangerous structure whose T_out committed after their snapshot
+# - read only deferrable: their first statement waits for a safe snapshot, after which they are not tracked at all
+# Reported for each: reports/s, writer commits/s, the abort rates of both, the most predicate locks a reader transaction
+# held (sampled by the lock sampler of the session, exact with the memory backend, not counting the ones committed
+# transactions of the same connection keep) and the startup wait of the readers, the time their first statement took.
+
+READ_WRITE = "read write"
+READ_ONLY = "read only"
+DEFERRABLE = "read only deferrable"
+
+# access mode -> (read_only, deferrable)
+ACCESS_MODES: Dict[str, Tuple[bool, bool]] = {
+    READ_WRITE: (False, False),
+    READ_ONLY: (True, False),
+    DEFERRABLE: (True, True),
+}
+
+_STARTUP_PERCENTILES = (50, 99)
+
+
+class ReaderResult(NamedTuple):
+    anomaly: str
+    access_mode: str
+    writers: int
+    readers: int
+    elapsed: float
+    reports: int
+    reader_aborts: int
+    writer_commits: int
+    writer_aborts: int
+    # most predicate locks (SIRead, all granularities) held at once by a reader transaction
+    predicate_locks: int
+    # seconds the first statement of every reader attempt took, sorted
+    startup: List[float]
+
+
+class _Counters:
+
+    def __init__(self):
+        self.commits = 0
+        self.aborts = 0
+        self.startup: List[float] = []
+
+
+async def reader_matrix(
+    anomalies: List[str],
+    writers: List[int],
+    readers: int,
+    duration: float | None,
+    iterations: int | None,
+    backend: str = "postgres",
+    policy: RetryPolicy | None = None,
+    dataset: Dataset = DEFAULT,
+) -> List[ReaderResult]:
+    results = []
+    async with create_pool(backend, 1, max(writers) + readers, dataset=dataset) as pool:
+        for anomaly in anomalies:
+            for count in writers:
+                for mode in ACCESS_MODES:
+                    results.append(await reader_load(
+                        pool, anomaly, mode, count, readers, duration, iterations, policy
+                    ))
+    return results
+
+
+async def reader_load(
+    pool: Any,
+    anomaly: str,
+    mode: str,
+    writers: int,
+    readers: int,
+    duration: float | None,
+    iterations: int | None,
+    policy: RetryPolicy | None = None,
+) -> ReaderResult:
+    transactions = registry.resolve_transactions(anomaly)
+    if transactions is None:
+        raise ValueError(f"Anomaly {anomaly} is not described as a list of steps, it can't be run with readers")
+    (read_only, deferrable) = ACCESS_MODES[mode]
+    reporting = [t._replace(read_only=read_only, deferrable=deferrable) for t in transactions if reads_only(t)]
+    writing = [t for t in transactions if not reads_only(t)]
+    if not reporting or not writing:
+        raise ValueError(f"Anomaly {anomaly} needs transactions that only read and others that write")
+
+    (reads, writes) = (_Counters(), _Counters())
+    async with pool.session(writers + readers) as session:
+        start = time.monotonic()
+        deadline = start + duration if duration is not None else None
+
+        def done() -> bool:
+            if deadline is not None and time.monotonic() >= deadline:
+                return True
+            return iterations is not None and reads.commits >= iterations
+
+        names = {conn.info.backend_pid: f"R{i + 1}" for (i, conn) in enumerate(session.transactions[writers:])}
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(session.locks.sample(names, stop, lambda line: None))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for (i, conn) in enumerate(session.transactions[:writers]):
+                    tg.create_task(_client(conn, writing[i % len(writing)], writes, done, policy))
+                for (i, conn) in enumerate(session.transactions[writers:]):
+                    tg.create_task(_client(conn, reporting[i % len(reporting)], reads, done, policy))
+        finally:
+            stop.set()
+            await sampler
+
+        elapsed = time.monotonic() - start
+        predicate_locks = max(session.locks.predicate_peaks.get(pid, 0) for pid in names)
+
+    return ReaderResult(
+        anomaly,
+        mode,
+        writers,
+        readers,
+        elapsed,
+        reads.commits,
+        reads.aborts,
+        writes.commits,
+        writes.aborts,
+        predicate_locks,
+        sorted(reads.startup),
+    )
+
+
+async def _client(
+    conn: AsyncConnection,
+    transaction: Transaction,
+    counters: _Counters,
+    done: Callable[[], bool],
+    policy: RetryPolicy | None,
+):
+    modes = access_mode(transaction.read_only, transaction.deferrable)
+    async with conn.cursor() as cursor:
+        values: Dict[str, Any] = {}
+
+        async def attempt(cost: RetryCost):
+            values.clear()
+            await cursor.execute("begin transaction")
+            await cursor.execute(f"set transaction isolation level serializable{modes}")
+            first = True
+            for step in transaction.steps:
+                if step.kind == StepKind.YIELD:
+                    continue
+                cost.statements += 1
+                start = time.monotonic()
+                await cursor.execute(step.sql.format(**values) if values else step.sql)
+                if first:
+                    counters.startup.append(time.monotonic() - start)
+                    first = False
+                check_expected(step, cursor.rowcount)
+                if step.bind:
+                    values[step.bind] = (await cursor.fetchone())[step.bind]
+
+        async def on_abort(exc: Exception):
+            await cursor.execute("rollback;")
+            counters.aborts += 1
+
+        while not done():
+            cost = await retry(policy or RetryPolicy(max_attempts=1), attempt, on_abort)
+            if cost.committed:
+                counters.commits += 1
+
+
+def format_readers(results: List[ReaderResult]) -> str:
+    header = ["anomaly", "access mode", "writers", "readers", "reports/s", "writer commits/s", "reader aborts",
+              "writer aborts", "SIRead locks/reader", *[f"startup p{p} ms" for p in _STARTUP_PERCENTILES],
+              "startup max ms"]
+
+    rows = [header]
+    for r in results:
+        reader_attempts = r.reports + r.reader_aborts or 1
+        writer_attempts = r.writer_commits + r.writer_aborts or 1
+        rows.append([
+            r.anomaly,
+            r.access_mode,
+            str(r.writers),
+            str(r.readers),
+            f"{r.reports / r.elapsed:.1f}" if r.elapsed else "-",
+            f"{r.writer_commits / r.elapsed:.1f}" if r.elapsed else "-",
+            f"{r.reader_aborts} ({100 * r.reader_aborts / reader_attempts:.1f}%)",
+            f"{r.writer_aborts} ({100 * r.writer_aborts / writer_attempts:.1f}%)",
+            str(r.predicate_locks),
+            *[f"{percentile(r.startup, p) * 1000:.2f}" for p in _STARTUP_PERCENTILES],
+            f"{r.startup[-1] * 1000:.2f}" if r.startup else "-",
+        ])
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join(
+        "|" + "|".join(value.ljust(width) for (value, width) in zip(row, widths)) + "|"
+        for row in rows
+    )
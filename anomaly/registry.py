@@ -1,33 +1,86 @@
-from anomaly.base import ConcurrentTransactionExample
+import importlib
+from typing import TYPE_CHECKING, Dict, List, Tuple, Type
 
-from typing import Dict, List, Tuple, Type
+from anomaly.manifest import SCENARIOS
 
+if TYPE_CHECKING:
+    from anomaly.base import ConcurrentTransactionExample
+    from anomaly.steps import Transaction
 
-_ANOMALIES: Dict[str, Tuple[Type[ConcurrentTransactionExample], Type[ConcurrentTransactionExample], str]] = dict()
 
+# Anomalies are listed in `anomaly.manifest`, along with the module registering them, which is only imported when the
+# anomaly is resolved: listing them doesn't load any scenario (nor psycopg). Modules not in the manifest can register
+# anomalies too, once imported.
 
+_ANOMALIES: Dict[str, Tuple[Tuple[Type["ConcurrentTransactionExample"], ...], str]] = dict()
+
+# step lists of the anomalies registered with `register_transactions`
+_TRANSACTIONS: Dict[str, Tuple["Transaction", ...]] = dict()
+
+
+# transactions are named T1, T2, ... in the given order and T1 runs first
 def register(
     anomaly_key: str,
-    t1: Type[ConcurrentTransactionExample],
-    t2: Type[ConcurrentTransactionExample],
+    *transactions: Type["ConcurrentTransactionExample"],
     description: str | None = None
 ) -> None:
     if anomaly_key in _ANOMALIES:
         raise ValueError(f"Anomaly {anomaly_key} already registered")
 
+    if len(transactions) < 2:
+        raise ValueError(f"Anomaly {anomaly_key} needs at least two transactions")
+
     if description:
         description = description.strip()
 
-    _ANOMALIES[anomaly_key] = (t1, t2, description)
+    _ANOMALIES[anomaly_key] = (transactions, description)
+
+
+# same as `register`, for transactions described as a list of steps (see `anomaly.steps`)
+def register_transactions(
+    anomaly_key: str,
+    *transactions: "Transaction",
+    description: str | None = None
+) -> None:
+    from anomaly.steps import compile_transaction
 
+    compiled = [compile_transaction(f"T{i + 1}", t) for (i, t) in enumerate(transactions)]
+    register(anomaly_key, *compiled, description=description)
+    _TRANSACTIONS[anomaly_key] = tuple(transactions)
 
-def resolve(anomaly: str) -> Tuple[Type[ConcurrentTransactionExample], Type[ConcurrentTransactionExample], str]:
-    anomaly = _ANOMALIES.get(anomaly, None)
-    if anomaly is None:
+
+def resolve(anomaly: str) -> Tuple[Tuple[Type["ConcurrentTransactionExample"], ...], str]:
+    resolved = _ANOMALIES.get(anomaly, None)
+    if resolved is None:
+        _load(anomaly)
+        resolved = _ANOMALIES.get(anomaly, None)
+    if resolved is None:
         raise ValueError(f"Unknown anomaly: {anomaly}.")
 
-    return anomaly
+    return resolved
+
+
+# None for anomalies with hand written transactions
+def resolve_transactions(anomaly: str) -> Tuple["Transaction", ...] | None:
+    resolve(anomaly)
+    return _TRANSACTIONS.get(anomaly, None)
+
+
+# module registering `anomaly`
+def module(anomaly: str) -> str:
+    (transactions, _) = resolve(anomaly)
+    return SCENARIOS.get(anomaly, transactions[0].__module__)
 
 
 def get_registered() -> List[str]:
-    return list(_ANOMALIES.keys())
+    return list(dict.fromkeys([*SCENARIOS, *_ANOMALIES]))
+
+
+def _load(anomaly: str):
+    module = SCENARIOS.get(anomaly, None)
+    if module is None:
+        return
+
+    importlib.import_module(module)
+    if anomaly not in _ANOMALIES:
+        raise ValueError(f"Module {module} does not register anomaly {anomaly}, as listed in anomaly.manifest")
@@ -0,0 +1,116 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict
+
+import psycopg
+
+
+# Retrying transactions aborted by the database, as applications do, and accounting for the work thrown away.
+# A policy tells how long to wait before the next attempt, or None to give up:
+#   cost = await retry(ExponentialBackoff(max_attempts=5), attempt, on_abort)
+
+# LockNotAvailable: a `for update nowait` found a row locked by another transaction
+RETRYABLE = (psycopg.errors.SerializationFailure, psycopg.errors.DeadlockDetected, psycopg.errors.LockNotAvailable)
+
+
+class RetryPolicy:
+
+    # None for no limit
+    max_attempts: int | None
+
+    def __init__(self, max_attempts: int | None = None):
+        self.max_attempts = max_attempts
+
+    # seconds to wait after the failed attempt number `attempt` (from 1), None to give up
+    def delay(self, attempt: int) -> float | None:
+        if self.max_attempts is not None and attempt >= self.max_attempts:
+            return None
+        return self._delay(attempt)
+
+    def _delay(self, attempt: int) -> float:
+        return 0.0
+
+
+# retries right away
+class Immediate(RetryPolicy):
+    pass
+
+
+# waits a random time between 0 and base * 2^(attempt - 1), capped ("full jitter")
+class ExponentialBackoff(RetryPolicy):
+
+    base: float
+    cap: float
+
+    def __init__(self, base: float = 0.001, cap: float = 0.1, max_attempts: int | None = None):
+        super().__init__(max_attempts)
+        self.base = base
+        self.cap = cap
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+
+POLICIES: Dict[str, Callable[[int | None], RetryPolicy]] = {
+    "immediate": lambda max_attempts: Immediate(max_attempts),
+    "exponential": lambda max_attempts: ExponentialBackoff(max_attempts=max_attempts),
+}
+
+
+# work done by a transaction across its attempts
+class RetryCost:
+
+    attempts: int
+    statements: int
+    # statements and seconds of the attempts that aborted
+    wasted_statements: int
+    wasted_time: float
+    # seconds spent waiting between attempts
+    backoff: float
+    committed: bool
+
+    def __init__(self):
+        self.attempts = 0
+        self.statements = 0
+        self.wasted_statements = 0
+        self.wasted_time = 0.0
+        self.backoff = 0.0
+        self.committed = False
+
+    def __str__(self) -> str:
+        return (
+            f"{self.attempts} attempt{'s' if self.attempts != 1 else ''}"
+            f"{'' if self.committed else ' (gave up)'}, "
+            f"{self.wasted_statements}/{self.statements} statements wasted, "
+            f"{self.wasted_time * 1000:.1f}ms wasted, {self.backoff * 1000:.1f}ms backing off"
+        )
+
+
+# Runs `attempt` until it doesn't fail with a retryable error or `policy` gives up. `attempt` counts the statements it
+# runs in the cost it is given, `on_abort` ends the failed attempt (rolls back).
+async def retry(
+    policy: RetryPolicy,
+    attempt: Callable[[RetryCost], Awaitable[None]],
+    on_abort: Callable[[Exception], Awaitable[None]],
+) -> RetryCost:
+    cost = RetryCost()
+    while True:
+        start = time.monotonic()
+        statements = cost.statements
+        cost.attempts += 1
+        try:
+            await attempt(cost)
+            cost.committed = True
+            return cost
+        except RETRYABLE as exc:
+            await on_abort(exc)
+            cost.wasted_statements += cost.statements - statements
+            cost.wasted_time += time.monotonic() - start
+
+        delay = policy.delay(cost.attempts)
+        if delay is None:
+            return cost
+        if delay > 0:
+            cost.backoff += delay
+            await asyncio.sleep(delay)
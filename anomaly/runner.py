@@ -0,0 +1,291 @@
+import asyncio
+import functools
+import io
+import time
+from typing import Callable, Dict, List, NamedTuple, TextIO, Tuple
+
+import psycopg
+
+from anomaly.base import Printer, Scheduler
+from anomaly.cache import OutcomeCache, cell_key
+from anomaly.checker import format_anomaly
+from anomaly.dataset import DEFAULT, Dataset
+from anomaly.diff import StateDiff
+from anomaly.history import History
+from anomaly.locks import format_locks
+from anomaly.manifest import SIMPLE
+from anomaly.metrics import Metrics
+from anomaly.retry import RetryPolicy
+from anomaly.table import LIMIT, write_query
+from anomaly.memory import MemorySessionPool
+from anomaly.pool import SessionPool, server_version
+from anomaly import registry
+
+
+ISOLATION_LEVELS: Dict[str, psycopg.IsolationLevel] = {
+    "read-uncommitted": psycopg.IsolationLevel.READ_UNCOMMITTED,
+    "read-committed": psycopg.IsolationLevel.READ_COMMITTED,
+    "repeatable-read": psycopg.IsolationLevel.REPEATABLE_READ,
+    "serializable": psycopg.IsolationLevel.SERIALIZABLE,
+}
+
+# session pools by backend, called with (size, participants) and optionally a dataset (see `anomaly.dataset`)
+BACKENDS: Dict[str, Callable[..., SessionPool | MemorySessionPool]] = {
+    "postgres": SessionPool,
+    "memory": MemorySessionPool,
+}
+
+
+class CellResult(NamedTuple):
+    anomaly: str
+    isolation_level: str
+    outcome: str
+    output: str
+    elapsed: float
+    setup: float
+    # phenomenon found by the checker (G0, G1c, G2-item or G2), "-" for none, None when not checked
+    cycle: str | None = None
+    # seconds of `setup` spent loading the rows
+    load: float = 0.0
+    # taken from the cache instead of run
+    cached: bool = False
+
+
+class RunResult(NamedTuple):
+    outcome: str
+    # seconds, setup included
+    elapsed: float
+    setup: float
+    cycle: str | None = None
+    load: float = 0.0
+
+
+# `read_only` opens the transactions that don't write READ ONLY, and `deferrable` DEFERRABLE (see `anomaly.steps`)
+async def run(
+    pool: SessionPool,
+    anomaly: str,
+    isolation_level: str,
+    printer: Printer,
+    timeout: float = 2,
+    retry: RetryPolicy | None = None,
+    transport: str = SIMPLE,
+    locks: float | None = None,
+    read_only: bool = False,
+    deferrable: bool = False,
+) -> RunResult:
+    out = printer.out
+    (transactions, description) = registry.resolve(anomaly)
+    printer.start_run(anomaly, isolation_level)
+    async with pool.session(len(transactions)) as session:
+        start = time.monotonic()
+        level = get_isolation_level(isolation_level)
+        scheduler = Scheduler(len(transactions))
+        session.monitor.scheduled(session.transactions)
+        runs = [
+            T(conn, level, scheduler, i, printer, session.monitor, timeout, retry, transport, read_only, deferrable)
+            for (i, (T, conn)) in enumerate(zip(transactions, session.transactions))
+        ]
+
+        if description:
+            print(anomaly, ":", isolation_level, file=out)
+            print(description, file=out)
+            print(file=out)
+
+        await print_account(session.transactions[0], "BEFORE", out, printer.max_rows, session.state)
+        # sampled every `locks` seconds while the transactions run, what is seen is printed as steps of its own
+        names = {conn.info.backend_pid: t.name for (conn, t) in zip(session.transactions, runs)}
+        stop = asyncio.Event()
+        if locks is not None:
+            report = functools.partial(printer.print_step, "LOCKS")
+            sampler = asyncio.create_task(session.locks.sample(names, stop, report, locks))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for t in runs:
+                    tg.create_task(t())
+        finally:
+            stop.set()
+            if locks is not None:
+                await sampler
+        await print_changes(session.state, out, printer.max_rows)
+        elapsed = session.setup + time.monotonic() - start
+
+        if retry is not None:
+            print("RETRIES:", file=out)
+            for t in runs:
+                print(f"{t.name}: {t.cost if t.cost is not None else '-'}", file=out)
+            print(file=out)
+
+        if locks is not None:
+            print("LOCKS:", format_locks(session.locks, names), file=out, sep="\n")
+            print(file=out)
+
+        cycle = None
+        if session.checker is not None:
+            print("DEPENDENCY CYCLES:", file=out)
+            for a in session.checker.anomalies:
+                print(format_anomaly(a, names), file=out)
+            cycle = session.checker.worst() or "-"
+            print("none, serializable" if cycle == "-" else "", file=out)
+
+    return RunResult("/".join(t.outcome or "-" for t in runs), elapsed, session.setup, cycle, session.load)
+
+
+# Cells run concurrently, at most `concurrency` at the same time, each one in its own schema.
+# With a `cache`, only the cells it has no result for run (see `anomaly.cache`), failed ones aren't kept. It doesn't
+# know about `history`, `metrics` and `locks`, which are only filled by the cells that run.
+async def run_matrix(
+    anomalies: List[str],
+    isolation_levels: List[str],
+    concurrency: int,
+    timeout: float = 2,
+    backend: str = "postgres",
+    history: History | None = None,
+    check: bool = False,
+    retry: RetryPolicy | None = None,
+    metrics: Metrics | None = None,
+    transport: str = SIMPLE,
+    max_rows: int | None = LIMIT,
+    dataset: Dataset = DEFAULT,
+    locks: float | None = None,
+    cache: OutcomeCache | None = None,
+    read_only: bool = False,
+    deferrable: bool = False,
+) -> List[CellResult]:
+    cells = [(anomaly, level) for anomaly in anomalies for level in isolation_levels]
+    results: Dict[Tuple[str, str], CellResult] = {}
+    keys: Dict[Tuple[str, str], str] = {}
+    if cache is not None:
+        version = await server_version() if backend == "postgres" else 0
+        options = (
+            backend, version, timeout, check, _policy(retry), transport, max_rows, dataset, read_only, deferrable
+        )
+        for (anomaly, level) in cells:
+            (_, description) = registry.resolve(anomaly)
+            key = cell_key(
+                registry.module(anomaly), anomaly, description, registry.resolve_transactions(anomaly), level, options
+            )
+            cached = cache.get(key)
+            if cached is not None:
+                results[(anomaly, level)] = CellResult(**cached)._replace(cached=True)
+            keys[(anomaly, level)] = key
+
+    todo = [cell for cell in cells if cell not in results]
+    if todo:
+        participants = max(participant_count(anomaly) for (anomaly, _) in todo)
+        async with create_pool(backend, min(concurrency, len(todo)), participants, check, dataset) as pool:
+            done = await asyncio.gather(*[
+                _run_cell(
+                    pool, anomaly, level, timeout, history, retry, metrics, transport, max_rows, locks, read_only,
+                    deferrable,
+                )
+                for (anomaly, level) in todo
+            ])
+        for (cell, result) in zip(todo, done):
+            results[cell] = result
+            if cache is not None and not result.outcome.startswith("ERROR"):
+                cache.put(keys[cell], result._asdict())
+
+    return [results[cell] for cell in cells]
+
+
+def _policy(retry: RetryPolicy | None) -> str | None:
+    return None if retry is None else f"{retry.__class__.__name__}({vars(retry)})"
+
+
+async def _run_cell(
+    pool: SessionPool,
+    anomaly: str,
+    isolation_level: str,
+    timeout: float,
+    history: History | None,
+    retry: RetryPolicy | None,
+    metrics: Metrics | None,
+    transport: str,
+    max_rows: int | None,
+    locks: float | None,
+    read_only: bool,
+    deferrable: bool,
+) -> CellResult:
+    out = io.StringIO()
+    printer = Printer(out, history, metrics, max_rows)
+    try:
+        (outcome, elapsed, setup, cycle, load) = await run(
+            pool, anomaly, isolation_level, printer, timeout, retry, transport, locks, read_only, deferrable
+        )
+    except Exception as exc:
+        print(exc, file=out)
+        (outcome, elapsed, setup, cycle, load) = (f"ERROR: {exc.__class__.__name__}", 0, 0, None, 0)
+
+    return CellResult(anomaly, isolation_level, outcome, out.getvalue(), elapsed, setup, cycle, load)
+
+
+# `check` builds the dependency graph of every run (see `anomaly.checker`), only the memory backend supports it
+def create_pool(
+    backend: str,
+    size: int,
+    participants: int,
+    check: bool = False,
+    dataset: Dataset = DEFAULT,
+) -> SessionPool | MemorySessionPool:
+    if not check:
+        return BACKENDS[backend](size, participants, dataset=dataset)
+    if backend != "memory":
+        raise ValueError("Checking the dependency graph of the runs needs the memory backend")
+
+    return MemorySessionPool(size, participants, check=True, dataset=dataset)
+
+
+def participant_count(anomaly: str) -> int:
+    (transactions, _) = registry.resolve(anomaly)
+    return len(transactions)
+
+
+def format_grid(results: List[CellResult]) -> str:
+    anomalies = list(dict.fromkeys(r.anomaly for r in results))
+    levels = list(dict.fromkeys(r.isolation_level for r in results))
+    outcomes = {
+        (r.anomaly, r.isolation_level): r.outcome if r.cycle is None else f"{r.outcome} {r.cycle}" for r in results
+    }
+
+    rows = [["anomaly (T1/T2/...)", *levels]]
+    for anomaly in anomalies:
+        rows.append([anomaly, *[outcomes.get((anomaly, level), "") for level in levels]])
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join(
+        "|" + "|".join(value.ljust(width) for (value, width) in zip(row, widths)) + "|"
+        for row in rows
+    )
+
+
+def get_isolation_level(isolation_level: str) -> psycopg.IsolationLevel:
+    level = ISOLATION_LEVELS.get(isolation_level, None)
+    if level is None:
+        raise ValueError(f"Unknown isolation level {isolation_level}")
+
+    return level
+
+
+# with `state`, takes its snapshot too
+async def print_account(
+    conn: psycopg.AsyncConnection,
+    tag: str,
+    out: TextIO,
+    max_rows: int | None = LIMIT,
+    state: StateDiff | None = None,
+):
+    if state is None:
+        print("DB STATE:", tag, file=out)
+    else:
+        print(f"DB STATE: {tag} ({await state.snapshot()})", file=out)
+    # ids and balances, the versions only matter to the compare and set of `hot-row-version`
+    await write_query(conn, "select id, balance from account;", out, max_rows)
+    print(file=out)
+
+
+# the rows changed since `state.snapshot()` instead of the whole table
+async def print_changes(state: StateDiff, out: TextIO, max_rows: int | None = LIMIT):
+    after = await state.fingerprint()
+    print(f"DB STATE: AFTER ({after})", file=out)
+    await state.write_diff(out, after, max_rows)
+    print(file=out)
@@ -0,0 +1,248 @@
+import re
+import time
+from enum import Enum
+from typing import Any, Dict, List, NamedTuple, Tuple, Type
+
+import psycopg
+from psycopg import AsyncCursor
+
+from anomaly.base import ConcurrentTransactionExample
+from anomaly.retry import RetryCost
+
+
+# Declarative form of an example: every transaction is a list of steps instead of a hand written `run`.
+# The transaction always starts with `begin_transaction_with_isolation_level`. If a step fails with a serialization
+# failure (or finds a row locked, with `nowait`), the error is printed, the transaction is rolled back and the
+# `on_failure` steps run, or, with a retry policy (see `anomaly.retry`), the transaction starts over.
+#
+#   transaction(
+#       select("select balance from account where id = 1;", bind="balance"),
+#       yield_to(),
+#       modify("update account set balance = {balance} + 10 where id = 1;"),
+#       commit(),
+#   )
+
+
+# locking selects (`blocking` and `queued` steps) print their result
+_SELECT = re.compile(r"^\s*select\b", re.IGNORECASE)
+
+# selects that lock rows are writes, for read only transactions
+_LOCKING = re.compile(r"\bfor\s+update\b", re.IGNORECASE)
+
+
+class StepKind(str, Enum):
+    SELECT = "select"
+    MODIFY = "modify"
+    BLOCKING = "blocking"
+    QUEUED = "queued"
+    YIELD = "yield"
+    COMMIT = "commit"
+    ROLLBACK = "rollback"
+
+
+class Step(NamedTuple):
+    kind: StepKind
+    sql: str | None = None
+    # SELECT (and BLOCKING or QUEUED selects): stores the column with this name, from the first row, to be used as
+    # `{bind}` by the following steps
+    bind: str | None = None
+    # YIELD, BLOCKING and QUEUED: transaction that runs next, the next one still running by default
+    to: str | None = None
+    # MODIFY: rows the statement has to modify, see `check_expected`
+    expect: int | None = None
+
+
+class Transaction(NamedTuple):
+    steps: Tuple[Step, ...]
+    on_failure: Tuple[Step, ...] = ()
+    # opened READ ONLY (and DEFERRABLE), whatever the access mode of the run
+    read_only: bool = False
+    deferrable: bool = False
+
+
+def transaction(
+    *steps: Step,
+    on_failure: List[Step] | None = None,
+    read_only: bool = False,
+    deferrable: bool = False,
+) -> Transaction:
+    return Transaction(tuple(steps), tuple(on_failure or ()), read_only, deferrable)
+
+
+# transactions that neither modify nor lock rows, the only ones a read only access mode applies to
+def reads_only(transaction: Transaction) -> bool:
+    return all(
+        step.kind in (StepKind.SELECT, StepKind.YIELD, StepKind.COMMIT, StepKind.ROLLBACK)
+        and not _LOCKING.search(step.sql or "")
+        for step in (*transaction.steps, *transaction.on_failure)
+    )
+
+
+# runs a query and prints its result
+def select(sql: str, bind: str | None = None) -> Step:
+    return Step(StepKind.SELECT, sql, bind=bind)
+
+
+# runs an update/insert/delete and prints the number of modified rows
+def modify(sql: str, expect: int | None = None) -> Step:
+    return Step(StepKind.MODIFY, sql, expect=expect)
+
+
+# like `modify`, but the statement is expected to wait for a lock held by another transaction,
+# which runs in the meantime (see `ConcurrentTransactionExample.yield_for_another_task`), it can be a locking select
+# (`for update`, `pg_advisory_xact_lock`) binding a value like `select`
+def blocking(sql: str, to: str | None = None, bind: str | None = None) -> Step:
+    return Step(StepKind.BLOCKING, sql, bind=bind, to=to)
+
+
+# like `blocking`, but it resumes as soon as it gets the lock (see `ConcurrentTransactionExample.wait_for_lock`)
+def queued(sql: str, to: str | None = None, bind: str | None = None) -> Step:
+    return Step(StepKind.QUEUED, sql, bind=bind, to=to)
+
+
+# Optimistic concurrency control: a statement guarded by the values read before (`... where balance = {balance}`)
+# modifies fewer rows than `expect` when another transaction changed them meanwhile. The transaction then fails like
+# it would on a serialization failure, and is retried the same way.
+def check_expected(step: Step, rowcount: int):
+    if step.expect is not None and rowcount != step.expect:
+        raise psycopg.errors.SerializationFailure(
+            f"{rowcount} rows modified instead of {step.expect}, they were changed by another transaction"
+        )
+
+
+def yield_to(to: str | None = None) -> Step:
+    return Step(StepKind.YIELD, to=to)
+
+
+def commit() -> Step:
+    return Step(StepKind.COMMIT, "commit;")
+
+
+def rollback() -> Step:
+    return Step(StepKind.ROLLBACK, "rollback;")
+
+
+class StepTransactionExample(ConcurrentTransactionExample):
+
+    transaction: Transaction
+
+    # the access mode of the run only applies to the transactions that don't write, the others would fail
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._read_only = self.transaction.read_only or (self._read_only and reads_only(self.transaction))
+        self._deferrable = self.transaction.deferrable or (self._deferrable and self._read_only)
+
+    async def run(self):
+        if self._retry is not None:
+            await self._run_with_retry()
+            return
+
+        values: Dict[str, Any] = {}
+        async with self.conn.cursor() as cursor:
+            await self.begin_transaction_with_isolation_level(cursor)
+
+            step = None
+            start = 0.0
+            try:
+                for step in self.transaction.steps:
+                    start = time.monotonic()
+                    await self._run_step(cursor, step, values)
+            except (psycopg.errors.SerializationFailure, psycopg.errors.LockNotAvailable) as exc:
+                await self._abort(cursor, step.sql, values, start, exc, self._end_wait())
+
+                for step in self.transaction.on_failure:
+                    await self._run_step(cursor, step, values)
+
+    # runs the steps again, from `begin`, when they fail, the `on_failure` steps only run if the retry policy gives up
+    async def _run_with_retry(self):
+        values: Dict[str, Any] = {}
+        async with self.conn.cursor() as cursor:
+            failed = (None, 0.0)
+
+            async def attempt(cost: RetryCost):
+                nonlocal failed
+                values.clear()
+                await self.begin_transaction_with_isolation_level(cursor)
+                for step in self.transaction.steps:
+                    failed = (step, time.monotonic())
+                    if step.sql is not None:
+                        cost.statements += 1
+                    await self._run_step(cursor, step, values)
+
+            async def on_abort(exc: Exception):
+                (step, start) = failed
+                await self._abort(cursor, step.sql, values, start, exc, self._end_wait())
+
+            cost = await self.with_retry(attempt, on_abort)
+            if not cost.committed:
+                for step in self.transaction.on_failure:
+                    await self._run_step(cursor, step, values)
+
+    # `blocked`: seconds the failed statement (`sql` formatted with `values`) waited for a lock before failing
+    async def _abort(
+        self, cursor: AsyncCursor, sql: str | None, values: Dict[str, Any], start: float, exc: Exception, blocked: float
+    ):
+        query = _format(sql, values)
+        self.print_text(query, f"ERROR: {exc}")
+        self.record(query, start, blocked=blocked, error=exc, statement=sql)
+        start = time.monotonic()
+        await cursor.execute("rollback;")
+        self.print_text("ROLLBACK")
+        self.record("rollback;", start)
+
+    async def _run_step(self, cursor: AsyncCursor, step: Step, values: Dict[str, Any]):
+        query = _format(step.sql, values)
+        start = time.monotonic()
+        match step.kind:
+            case StepKind.SELECT:
+                blocked = await self.wait_for_snapshot(cursor.execute(query))
+                records = await cursor.fetchall()
+                self.print_query_result(query, records)
+                self.record(query, start, read=len(records), blocked=blocked, statement=step.sql)
+                if step.bind:
+                    values[step.bind] = records[0][step.bind]
+            case StepKind.MODIFY:
+                await cursor.execute(query)
+                self.print_text(query, f"MODIFIED: {cursor.rowcount}")
+                self.record(query, start, written=cursor.rowcount, statement=step.sql)
+                check_expected(step, cursor.rowcount)
+            case StepKind.BLOCKING | StepKind.QUEUED:
+                awaitable = cursor.execute(query)
+                self.print_text(query, "waiting...")
+                if step.kind == StepKind.BLOCKING:
+                    blocked = await self.yield_for_another_task(awaitable, step.to)
+                else:
+                    blocked = await self.wait_for_lock(awaitable, step.to)
+                if _SELECT.match(query):
+                    records = await cursor.fetchall()
+                    self.print_query_result(query, records)
+                    self.record(query, start, read=len(records), blocked=blocked, statement=step.sql)
+                    if step.bind:
+                        values[step.bind] = records[0][step.bind]
+                else:
+                    self.print_text(query, f"MODIFIED: {cursor.rowcount}")
+                    self.record(query, start, written=cursor.rowcount, blocked=blocked, statement=step.sql)
+            case StepKind.YIELD:
+                await self.yield_for_another_task(to=step.to)
+            case StepKind.COMMIT:
+                await cursor.execute(query)
+                self.print_text("COMMIT")
+                self.record(query, start, statement=step.sql)
+            case StepKind.ROLLBACK:
+                await cursor.execute(query)
+                self.print_text("ROLLBACK")
+                self.record(query, start, statement=step.sql)
+            case _:
+                raise ValueError(f"Unknown step {step.kind}.")
+
+
+# builds the ConcurrentTransactionExample class that runs the given transaction
+def compile_transaction(name: str, transaction: Transaction) -> Type[StepTransactionExample]:
+    return type(name, (StepTransactionExample,), {"transaction": transaction})
+
+
+def _format(sql: str | None, values: Dict[str, Any]) -> str | None:
+    if sql is None or not values:
+        return sql
+
+    return sql.format(**values)
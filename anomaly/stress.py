@@ -0,0 +1,376 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, NamedTuple
+
+import psycopg
+from psycopg import AsyncConnection, IsolationLevel
+
+from anomaly.base import LockMonitor, access_mode, begin_statement
+from anomaly.dataset import DEFAULT, Dataset
+from anomaly.manifest import PIPELINE, SIMPLE
+from anomaly.metrics import Metrics, Series
+from anomaly.retry import RetryCost, RetryPolicy, retry
+from anomaly.runner import ISOLATION_LEVELS, create_pool
+from anomaly.steps import Step, StepKind, Transaction, check_expected
+from anomaly import registry
+
+
+# Load mode: the transactions of an example run over and over from `clients` concurrent connections, without the
+# choreography of their `yield_to` steps, for a given time or number of transactions. Client i runs the transaction
+# T(i mod n) of the example, so the mix of transactions follows the example.
+# Every attempt is counted as committed, rolled back by the transaction itself, or aborted by a serialization failure,
+# a deadlock or a row found locked by `for update nowait`. Aborted transactions are given up, or retried following a
+# retry policy (see `anomaly.retry`).
+# With `metrics`, the latency of every statement is recorded (see `anomaly.metrics`), its lock waits sampled meanwhile.
+# Round trips to the database are counted: with the pipeline transport (see `anomaly.base`) a transaction
+# takes one per run of statements that don't need the result of a previous one, instead of one per statement (plus
+# `begin` and `set transaction`).
+
+_LATENCY_PERCENTILES = (50, 95, 99)
+
+
+class StressResult(NamedTuple):
+    anomaly: str
+    isolation_level: str
+    clients: int
+    elapsed: float
+    commits: int
+    rollbacks: int
+    serialization_failures: int
+    deadlocks: int
+    # seconds from begin (of the first attempt) to commit of every committed transaction, sorted
+    latencies: List[float]
+    # phenomenon found by the checker (see `anomaly.checker`), "-" for none, None when not checked
+    cycle: str | None = None
+    # transactions the retry policy gave up on
+    gave_up: int = 0
+    # attempts of the committed transactions
+    committed_attempts: int = 0
+    # seconds spent running transactions, and the part of it spent in attempts that aborted
+    busy: float = 0.0
+    wasted: float = 0.0
+    retried: bool = False
+    # round trips over all attempts, rollbacks of aborted ones included
+    round_trips: int = 0
+    # seconds spent loading the rows before the transactions started
+    load: float = 0.0
+    # attempts aborted by `for update nowait`
+    lock_failures: int = 0
+
+    @property
+    def attempts(self) -> int:
+        return self.commits + self.rollbacks + self.serialization_failures + self.deadlocks + self.lock_failures
+
+
+class _Counters:
+
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+        self.serialization_failures = 0
+        self.deadlocks = 0
+        self.lock_failures = 0
+        self.gave_up = 0
+        self.committed_attempts = 0
+        self.busy = 0.0
+        self.wasted = 0.0
+        self.round_trips = 0
+        self.latencies: List[float] = []
+
+    # transactions that committed, rolled back or were given up on
+    @property
+    def finished(self) -> int:
+        return self.commits + self.rollbacks + self.gave_up
+
+
+async def stress_matrix(
+    anomalies: List[str],
+    isolation_levels: List[str],
+    clients: List[int],
+    duration: float | None,
+    iterations: int | None,
+    backend: str = "postgres",
+    check: bool = False,
+    policy: RetryPolicy | None = None,
+    metrics: Metrics | None = None,
+    transport: str = SIMPLE,
+    dataset: Dataset = DEFAULT,
+) -> List[StressResult]:
+    # pairs (and client counts) run one after the other, so they don't compete for the database
+    results = []
+    async with create_pool(backend, 1, max(clients), check, dataset) as pool:
+        for anomaly in anomalies:
+            for level in isolation_levels:
+                for count in clients:
+                    results.append(await stress(
+                        pool, anomaly, level, count, duration, iterations, policy, metrics, transport
+                    ))
+    return results
+
+
+async def stress(
+    pool: Any,
+    anomaly: str,
+    isolation_level: str,
+    clients: int,
+    duration: float | None,
+    iterations: int | None,
+    policy: RetryPolicy | None = None,
+    metrics: Metrics | None = None,
+    transport: str = SIMPLE,
+) -> StressResult:
+    transactions = registry.resolve_transactions(anomaly)
+    if transactions is None:
+        raise ValueError(f"Anomaly {anomaly} is not described as a list of steps, it can't be stressed")
+
+    level = ISOLATION_LEVELS[isolation_level]
+    counters = _Counters()
+    async with pool.session(clients) as session:
+        start = time.monotonic()
+        deadline = start + duration if duration is not None else None
+
+        def done() -> bool:
+            if deadline is not None and time.monotonic() >= deadline:
+                return True
+            return iterations is not None and counters.finished >= iterations
+
+        stop = asyncio.Event()
+        if metrics is not None:
+            pids = [conn.info.backend_pid for conn in session.transactions]
+            sampler = asyncio.create_task(session.monitor.sample(pids, stop))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for (i, conn) in enumerate(session.transactions):
+                    n = i % len(transactions)
+                    observe = None
+                    if metrics is not None:
+                        observe = _observer(metrics, anomaly, isolation_level, f"T{n + 1}", session.monitor, conn)
+                    tg.create_task(
+                        _client(conn, transactions[n], level, counters, done, policy, observe, transport)
+                    )
+        finally:
+            stop.set()
+            if metrics is not None:
+                await sampler
+
+        elapsed = time.monotonic() - start
+        cycle = None
+        if session.checker is not None:
+            cycle = session.checker.worst() or "-"
+
+    return StressResult(
+        anomaly,
+        isolation_level,
+        clients,
+        elapsed,
+        counters.commits,
+        counters.rollbacks,
+        counters.serialization_failures,
+        counters.deadlocks,
+        sorted(counters.latencies),
+        cycle,
+        counters.gave_up,
+        counters.committed_attempts,
+        counters.busy,
+        counters.wasted,
+        policy is not None,
+        counters.round_trips,
+        session.load,
+        counters.lock_failures,
+    )
+
+
+async def _client(
+    conn: AsyncConnection,
+    transaction: Transaction,
+    level: IsolationLevel,
+    counters: _Counters,
+    done: Callable[[], bool],
+    policy: RetryPolicy | None,
+    observe: Callable[[str, float], None] | None = None,
+    transport: str = SIMPLE,
+):
+    isolation = level.name.lower().replace("_", " ")
+    modes = access_mode(transaction.read_only, transaction.deferrable)
+    batches = _batches(transaction)
+    async with conn.cursor() as cursor:
+        values: Dict[str, Any] = {}
+
+        async def attempt(cost: RetryCost):
+            values.clear()
+            counters.round_trips += 2
+            await cursor.execute("begin transaction")
+            await cursor.execute(f"set transaction isolation level {isolation}{modes}")
+            for step in transaction.steps:
+                if step.kind == StepKind.YIELD:
+                    continue
+                cost.statements += 1
+                counters.round_trips += 1
+                start = time.monotonic()
+                try:
+                    await cursor.execute(step.sql.format(**values) if values else step.sql)
+                finally:
+                    if observe is not None:
+                        observe(step.sql, start)
+                check_expected(step, cursor.rowcount)
+                if step.bind:
+                    values[step.bind] = (await cursor.fetchone())[step.bind]
+
+        # the statements of a batch are sent together, their results (and errors) come back when the pipeline ends
+        async def pipelined_attempt(cost: RetryCost):
+            values.clear()
+            for (i, batch) in enumerate(batches):
+                cost.statements += len(batch)
+                counters.round_trips += 1
+                start = time.monotonic()
+                error = None
+                try:
+                    # Statements are not prepared: psycopg would count as prepared the ones skipped once a batch
+                    # fails. An error may come back while the batch is still being sent, the pipeline then fails
+                    # on exit as aborted, but the first error is the one that matters.
+                    try:
+                        async with conn.pipeline():
+                            try:
+                                if i == 0:
+                                    await cursor.execute(
+                                        begin_statement(level, transaction.read_only, transaction.deferrable),
+                                        prepare=False,
+                                    )
+                                for step in batch:
+                                    await cursor.execute(
+                                        step.sql.format(**values) if values else step.sql, prepare=False
+                                    )
+                            except psycopg.Error as exc:
+                                error = exc
+                    except psycopg.Error as exc:
+                        error = error or exc
+                    if error is not None:
+                        raise error
+                finally:
+                    if observe is not None:
+                        observe("; ".join(step.sql for step in batch), start)
+                last = batch[-1]
+                if last.bind or last.expect is not None:
+                    # the cursor holds the results of the whole batch, the statement comes last
+                    while cursor.nextset():
+                        pass
+                    check_expected(last, cursor.rowcount)
+                    if last.bind:
+                        values[last.bind] = (await cursor.fetchone())[last.bind]
+
+        async def on_abort(exc: Exception):
+            counters.round_trips += 1
+            await cursor.execute("rollback;")
+            if isinstance(exc, psycopg.errors.SerializationFailure):
+                counters.serialization_failures += 1
+            elif isinstance(exc, psycopg.errors.LockNotAvailable):
+                counters.lock_failures += 1
+            else:
+                counters.deadlocks += 1
+
+        while not done():
+            start = time.monotonic()
+            cost = await retry(
+                policy or RetryPolicy(max_attempts=1),
+                pipelined_attempt if transport == PIPELINE else attempt,
+                on_abort,
+            )
+            latency = time.monotonic() - start
+            counters.busy += latency - cost.backoff
+            counters.wasted += cost.wasted_time
+            if not cost.committed:
+                counters.gave_up += 1
+            elif transaction.steps[-1].kind == StepKind.ROLLBACK:
+                counters.rollbacks += 1
+            else:
+                counters.commits += 1
+                counters.committed_attempts += cost.attempts
+                counters.latencies.append(latency)
+
+
+# Statements of `transaction` grouped into the batches sent in one round trip by the pipeline transport: a batch ends
+# with a select whose result the following statements need, or a statement whose modified rows are checked
+# (`check_expected`) before going on.
+def _batches(transaction: Transaction) -> List[List[Step]]:
+    batches: List[List[Step]] = [[]]
+    for step in transaction.steps:
+        if step.kind == StepKind.YIELD:
+            continue
+        batches[-1].append(step)
+        if step.bind or step.expect is not None:
+            batches.append([])
+    return [batch for batch in batches if batch]
+
+
+# records in `metrics` the statements of `conn` (by their template), with the lock waits seen by `monitor` meanwhile
+def _observer(
+    metrics: Metrics, anomaly: str, isolation_level: str, transaction: str, monitor: LockMonitor, conn: AsyncConnection
+) -> Callable[[str, float], None]:
+    pid = conn.info.backend_pid
+    waited = monitor.lock_wait(pid)
+    series: Dict[str, Series] = {}
+
+    def observe(statement: str, start: float):
+        nonlocal waited
+        latency = time.monotonic() - start
+        (previous, waited) = (waited, monitor.lock_wait(pid))
+        s = series.get(statement)
+        if s is None:
+            s = series[statement] = metrics.get(anomaly, isolation_level, transaction, statement)
+        s.record(latency, waited - previous)
+
+    return observe
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def format_stress(results: List[StressResult]) -> str:
+    header = ["anomaly", "isolation level", "clients", "commits/s", "serialization failures", "deadlocks",
+              *[f"p{p} ms" for p in _LATENCY_PERCENTILES], "max ms", "round trips/txn", "load ms"]
+    retried = any(r.retried for r in results)
+    if retried:
+        header += ["gave up", "attempts/commit", "wasted %"]
+    locked = any(r.lock_failures for r in results)
+    if locked:
+        header.append("lock not available")
+    checked = any(r.cycle is not None for r in results)
+    if checked:
+        header.append("cycle")
+
+    rows = [header]
+    for r in results:
+        attempts = r.attempts or 1
+        transactions = r.commits + r.rollbacks + r.gave_up
+        row = [
+            r.anomaly,
+            r.isolation_level,
+            str(r.clients),
+            f"{r.commits / r.elapsed:.1f}" if r.elapsed else "-",
+            f"{r.serialization_failures} ({100 * r.serialization_failures / attempts:.1f}%)",
+            f"{r.deadlocks} ({100 * r.deadlocks / attempts:.1f}%)",
+            *[f"{percentile(r.latencies, p) * 1000:.2f}" for p in _LATENCY_PERCENTILES],
+            f"{r.latencies[-1] * 1000:.2f}" if r.latencies else "-",
+            f"{r.round_trips / transactions:.2f}" if transactions else "-",
+            f"{r.load * 1000:.1f}",
+        ]
+        if retried:
+            row += [
+                str(r.gave_up),
+                f"{r.committed_attempts / r.commits:.2f}" if r.commits else "-",
+                f"{100 * r.wasted / r.busy:.1f}" if r.busy else "-",
+            ]
+        if locked:
+            row.append(f"{r.lock_failures} ({100 * r.lock_failures / attempts:.1f}%)")
+        if checked:
+            row.append(r.cycle or "")
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join(
+        "|" + "|".join(value.ljust(width) for (value, width) in zip(row, widths)) + "|"
+        for row in rows
+    )
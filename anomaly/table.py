@@ -0,0 +1,121 @@
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, TextIO
+
+from psycopg import AsyncConnection
+from psycopg.rows import dict_row
+
+
+# Query results as text tables, one row per line:
+# |     id|balance|
+# |      1|     67|
+# Column widths come from the header and the first `sample` rows, later rows wider than that overflow their column.
+# Rows are written as they come, so a table takes the same memory whatever its size, and past `limit` rows only counted
+# (and summed up in a last line).
+
+# rows printed by default
+LIMIT = 50
+
+# rows the column widths are computed from
+SAMPLE = 100
+
+# lines written to the output at once
+_CHUNK = 256
+
+# rows fetched from a server side cursor at once
+_FETCH = 1000
+
+
+def format_table(records: List[Dict], limit: int | None = LIMIT) -> str:
+    return "\n".join(_Table(limit).lines(records))
+
+
+def write_table(
+    records: Iterable[Dict], out: TextIO, limit: int | None = LIMIT, sample: int = SAMPLE, empty: str = "EMPTY"
+):
+    _write(_Table(limit, sample).lines(records, empty=empty), out)
+
+
+# runs `query` in a server side cursor, so that the rows are fetched a few at a time
+async def write_query(
+    conn: AsyncConnection,
+    query: str,
+    out: TextIO,
+    limit: int | None = LIMIT,
+    sample: int = SAMPLE,
+    empty: str = "EMPTY",
+):
+    async with conn.transaction():
+        async with conn.cursor(name="table", row_factory=dict_row) as cursor:
+            await cursor.execute(query)
+            table = _Table(limit, sample)
+            head = await cursor.fetchmany(sample)
+            if not head:
+                out.write(f"{empty}\n")
+                return
+
+            _write(table.lines(head, last=False), out)
+            while records := await cursor.fetchmany(_FETCH):
+                _write(filter(None, map(table.line, records)), out)
+            _write(table.end(), out)
+
+
+class _Table:
+
+    _limit: int | None
+    _sample: int
+    _widths: List[int]
+    _rows: int
+
+    def __init__(self, limit: int | None = LIMIT, sample: int = SAMPLE):
+        self._limit = limit
+        self._sample = sample
+        self._widths = []
+        self._rows = 0
+
+    # lines of all the `records` or, when more of them follow (not `last`), of the first ones (the sample included)
+    def lines(self, records: Iterable[Dict], last: bool = True, empty: str = "EMPTY") -> Iterator[str]:
+        records = iter(records)
+        head = list(itertools.islice(records, self._sample))
+        if not head:
+            if last:
+                yield empty
+            return
+
+        columns = list(head[0].keys())
+        self._widths = [len(str(c)) for c in columns]
+        for record in head:
+            self._widths = [max(w, len(_text(v))) for (w, v) in zip(self._widths, record.values())]
+        yield self._format(columns)
+
+        for record in itertools.chain(head, records):
+            line = self.line(record)
+            if line is not None:
+                yield line
+        if last:
+            yield from self.end()
+
+    # None past the limit
+    def line(self, record: Dict) -> str | None:
+        self._rows += 1
+        if self._limit is not None and self._rows > self._limit:
+            return None
+        return self._format(map(_text, record.values()))
+
+    def end(self) -> Iterator[str]:
+        if self._limit is not None and self._rows > self._limit:
+            more = self._rows - self._limit
+            yield f"... {more} more row{'s' if more != 1 else ''} ({self._rows} in total)"
+
+    def _format(self, values: Iterable[Any]) -> str:
+        return "|" + "|".join(str(v).rjust(w) for (v, w) in zip(values, self._widths)) + "|"
+
+
+def _text(value: Any) -> str:
+    return "NULL" if value is None else str(value)
+
+
+def _write(lines: Iterable[str], out: TextIO):
+    lines = iter(lines)
+    while chunk := list(itertools.islice(lines, _CHUNK)):
+        out.write("\n".join(chunk) + "\n")
+
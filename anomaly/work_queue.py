@@ -0,0 +1,220 @@
+from anomaly.steps import blocking, commit, modify, select, transaction, yield_to
+from anomaly import registry
+
+
+# Consumers of a work queue, the `job` table (its rows start as JOBS, see `anomaly.dataset`): a consumer claims the
+# first pending job (by id) and marks it done. Each way of claiming is an example of two consumers, and a benchmark with
+# `--queue` (see `anomaly.queue_stress`), where producers insert jobs meanwhile:
+#
+#   python main.py --queue -l read-committed,serializable --producers 2 --clients 1,4,16
+#
+# The job claimed is bound as `id`. The state printed before and after a run is the one of `account`, which the
+# examples leave as is: the jobs claimed show in the results of their statements.
+
+PENDING = "select id from job where status = 'pending' order by id limit 1"
+
+DONE = "update job set status = 'done' where id = {id};"
+
+
+# no lock: both consumers can claim the same job
+SELECT_T1 = transaction(
+    select(f"{PENDING};", bind="id"),
+    yield_to(),
+    modify(DONE),
+    commit(),
+    yield_to(),
+)
+
+SELECT_T2 = transaction(
+    select(f"{PENDING};", bind="id"),
+    yield_to(),
+    modify(DONE),
+    commit(),
+)
+
+
+registry.register_transactions("queue-select", SELECT_T1, SELECT_T2, description="""
+T1 and T2 pick the first pending job with a plain `select` and mark it done: with `read committed` both claim (and
+process) the same job. `repeatable read` and `serializable` fail T2 instead, the job changed after its snapshot.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──select first pending job─────────────────►│ job 1
+   │                   │                        │
+   │                   ├──select first pending─►│ job 1 too
+   │                   │                        │
+   ├──mark job done────────────────────────────►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   ├──mark job done────────►│ claims job 1 again for `read committed`, raises an error for
+   │                   │                        │ `repeatable read` and `serializable`
+   │                   ├──commit/rollback──────►│
+   │                   │                        │
+""")
+
+
+# the claim locks the job, the other consumer waits for it
+FOR_UPDATE_T1 = transaction(
+    select(f"{PENDING} for update;", bind="id"),
+    yield_to(),
+    modify(DONE),
+    commit(),
+)
+
+FOR_UPDATE_T2 = transaction(
+    # this will lock until T1 commits
+    blocking(f"{PENDING} for update;", bind="id"),
+    modify(DONE),
+    commit(),
+)
+
+
+registry.register_transactions("queue-for-update", FOR_UPDATE_T1, FOR_UPDATE_T2, description="""
+T1 and T2 claim the first pending job with `select ... for update`: T2 waits for T1, then `read committed` finds the
+job done and locks the next one instead. Consumers take turns: one claim at a time, however many there are.
+`repeatable read` and `serializable` fail T2, the job changed after its snapshot.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──select first pending job for update──────►│ job 1
+   │                   │                        │
+   │                   ├──select for update────►│ blocks on T1
+   │                   │                        │
+   ├──mark job done────────────────────────────►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   │                        │ T2 claims job 2, or raises an error for `repeatable read`
+   │                   │                        │ and `serializable`
+   │                   ├──mark job done────────►│
+   │                   │                        │
+   │                   ├──commit/rollback──────►│
+   │                   │                        │
+""")
+
+
+# the claim locks the job, the other consumer skips it
+SKIP_LOCKED_T1 = transaction(
+    select(f"{PENDING} for update skip locked;", bind="id"),
+    yield_to(),
+    modify(DONE),
+    commit(),
+)
+
+SKIP_LOCKED_T2 = transaction(
+    select(f"{PENDING} for update skip locked;", bind="id"),
+    modify(DONE),
+    commit(),
+)
+
+
+registry.register_transactions("queue-skip-locked", SKIP_LOCKED_T1, SKIP_LOCKED_T2, description="""
+T1 and T2 claim the first pending job with `select ... for update skip locked`: T2 skips the job T1 locked and
+claims the next one, neither waits nor fails, with every isolation level. Scanning the primary key, T1 stops at job 1
+and never reads job 2, so `serializable` finds no dependency from T1 to T2.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──select first pending job skip locked─────►│ job 1
+   │                   │                        │
+   │                   ├──select skip locked───►│ job 2
+   │                   │                        │
+   │                   ├──mark job done────────►│
+   │                   │                        │
+   │                   ├──commit───────────────►│
+   │                   │                        │
+   ├──mark job done────────────────────────────►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+""")
+
+
+# the claim locks the job, the other consumer fails right away
+NOWAIT_T1 = transaction(
+    select(f"{PENDING} for update nowait;", bind="id"),
+    yield_to(),
+    modify(DONE),
+    commit(),
+)
+
+NOWAIT_T2 = transaction(
+    select(f"{PENDING} for update nowait;", bind="id"),
+    modify(DONE),
+    commit(),
+)
+
+
+registry.register_transactions("queue-nowait", NOWAIT_T1, NOWAIT_T2, description="""
+T1 and T2 claim the first pending job with `select ... for update nowait`: T2 finds it locked by T1 and fails right
+away, without waiting, with every isolation level. The consumer tries again (`--retry`), claiming the next job if T1
+is done by then.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──select first pending job nowait──────────►│ job 1
+   │                   │                        │
+   │                   ├──select nowait────────►│ raises an error, job 1 is locked
+   │                   │                        │
+   │                   ├──rollback─────────────►│
+   │                   │                        │
+   ├──mark job done────────────────────────────►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+""")
+
+
+# an advisory lock on the whole queue: consumers claim one at a time
+ADVISORY_T1 = transaction(
+    select("select pg_advisory_xact_lock(0);"),
+    select(f"{PENDING};", bind="id"),
+    yield_to(),
+    modify(DONE),
+    commit(),
+)
+
+ADVISORY_T2 = transaction(
+    # this will lock until T1 commits
+    blocking("select pg_advisory_xact_lock(0);"),
+    select(f"{PENDING};", bind="id"),
+    modify(DONE),
+    commit(),
+)
+
+
+registry.register_transactions("queue-advisory", ADVISORY_T1, ADVISORY_T2, description="""
+T1 and T2 take the advisory lock of the queue (`pg_advisory_xact_lock`) before picking the first pending job: T2
+waits for T1 to commit, then `read committed` picks the next job. With `repeatable read` and `serializable`, the
+snapshot of T2 was taken by the statement waiting for the lock: T2 picks job 1 again and fails marking it done.
+
+┌────┐              ┌────┐                   ┌────┐
+│ T1 │              │ T2 │                   │ DB │
+└──┬─┘              └──┬─┘                   └──┬─┘
+   │                   │                        │
+   ├──pg_advisory_xact_lock(0)─────────────────►│
+   │                   │                        │
+   ├──select first pending job─────────────────►│ job 1
+   │                   │                        │
+   │                   ├──pg_advisory_xact_lock►│ blocks on T1
+   │                   │                        │
+   ├──mark job done────────────────────────────►│
+   │                   │                        │
+   ├──commit───────────┼───────────────────────►│
+   │                   │                        │
+   │                   ├──select first pending─►│ job 2, or job 1 for `repeatable read` and `serializable`
+   │                   │                        │
+   │                   ├──mark job done────────►│ raises an error for `repeatable read` and `serializable`
+   │                   │                        │
+   │                   ├──commit/rollback──────►│
+   │                   │                        │
+""")
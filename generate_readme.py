@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import difflib
+import os
+import re
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from anomaly import manifest, registry
+
+
+# Writes the "Examples" section of README.md: the output of every anomaly with every isolation level, each one between
+# `<!-- example: ANOMALY LEVEL -->` and `<!-- /example -->`, after a grid of their outcomes, all of it between
+# `<!-- examples -->` and `<!-- /examples -->`. The cells run concurrently, through the cache of `main.py --all`
+# (see `anomaly.cache`), so that only the ones whose scenario (or the package) changed since run again. Sections are
+# written in the order of `anomaly.manifest`, and the file only when one of them changed.
+# With --check nothing is written, the command fails if a section would change.
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the database picks the order in which the queue drains, the output changes from one run to the next
+_NONDETERMINISTIC = ("lock-queue",)
+
+_OUTCOMES = "outcomes"
+
+_REGION = re.compile(r"(<!-- examples -->\n)(.*?)(<!-- /examples -->\n)", re.S)
+_SECTION = re.compile(r"<!-- example: (.+?) -->\n.*?<!-- /example -->\n", re.S)
+
+
+def _parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Regenerates the examples of README.md")
+    ap.add_argument("--check", action="store_true", help="fail, without writing, if the examples are out of date")
+    ap.add_argument("--readme", default=os.path.join(_HERE, "README.md"), help="file to update (README.md)")
+    ap.add_argument(
+        "--backend",
+        "-b",
+        choices=manifest.BACKENDS,
+        default="postgres",
+        help="database the examples run against, both give the same output",
+    )
+    ap.add_argument("--concurrency", "-c", type=int, default=8, help="how many examples run at the same time")
+    ap.add_argument("--no-cache", action="store_true", help="run every example, even the unchanged ones")
+    return ap.parse_args()
+
+
+# section name -> its text, markers included, in order; and how many of the cells ran
+async def _generate(args: argparse.Namespace) -> Tuple[Dict[str, str], int]:
+    from anomaly import runner
+    from anomaly.cache import OutcomeCache
+
+    anomalies = [a for a in registry.get_registered() if a not in _NONDETERMINISTIC]
+    cache = None if args.no_cache else OutcomeCache()
+    results = await runner.run_matrix(
+        anomalies, list(manifest.ISOLATION_LEVELS), args.concurrency, backend=args.backend, cache=cache
+    )
+    errors = [r for r in results if r.outcome.startswith("ERROR")]
+    if errors:
+        for r in errors:
+            print(f"{r.anomaly} {r.isolation_level}: {r.outcome}\n{r.output}", file=sys.stderr)
+        raise SystemExit(f"{len(errors)} examples failed, {args.readme} is left as it is")
+
+    sections = {_OUTCOMES: _section(_OUTCOMES, runner.format_grid(results))}
+    for r in results:
+        name = f"{r.anomaly} {r.isolation_level}"
+        sections[name] = _section(name, r.output)
+    return (sections, sum(1 for r in results if not r.cached))
+
+
+def _section(name: str, output: str) -> str:
+    return f"<!-- example: {name} -->\n```\n{output.rstrip()}\n```\n<!-- /example -->\n"
+
+
+def _sections(region: str) -> Dict[str, str]:
+    return {m.group(1): m.group(0) for m in _SECTION.finditer(region)}
+
+
+# names of the sections added, changed and removed
+def _changes(before: Dict[str, str], after: Dict[str, str]) -> List[str]:
+    return [
+        *(f"added {name}" for name in after if name not in before),
+        *(f"changed {name}" for name in after if name in before and before[name] != after[name]),
+        *(f"removed {name}" for name in before if name not in after),
+    ]
+
+
+def main(args: argparse.Namespace):
+    with open(args.readme) as f:
+        readme = f.read()
+    region = _REGION.search(readme)
+    if region is None:
+        raise SystemExit(f"{args.readme} has no <!-- examples --> ... <!-- /examples --> markers")
+
+    start = time.monotonic()
+    (sections, ran) = asyncio.run(_generate(args))
+    before = _sections(region.group(2))
+    changes = _changes(before, sections)
+    print(f"{len(sections) - 1} examples, {ran} run in {time.monotonic() - start:.2f}s")
+
+    updated = readme[:region.start(2)] + "\n".join(sections.values()) + readme[region.end(2):]
+    if updated == readme:
+        print(f"{args.readme} is up to date")
+        return
+
+    for change in changes:
+        print(change)
+    if args.check:
+        sys.stdout.writelines(
+            difflib.unified_diff(readme.splitlines(True), updated.splitlines(True), args.readme, "generated")
+        )
+        raise SystemExit(f"{args.readme} is out of date, run generate_readme.py")
+
+    with open(args.readme, "w") as f:
+        f.write(updated)
+    print(f"{args.readme} updated")
+
+
+if __name__ == "__main__":
+    main(_parse_args())
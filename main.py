@@ -1,13 +1,9 @@
 import argparse
-import asyncio
 import sys
-from os import environ
+import time
+from typing import Callable, List
 
-import psycopg
-from psycopg.rows import dict_row
-
-from anomaly.base import format_table
-from anomaly import registry
+from anomaly import manifest, registry
 
 
 def _parse_args() -> argparse.Namespace:
@@ -16,104 +12,533 @@ def _parse_args() -> argparse.Namespace:
     ap.add_argument(
         "--anomaly",
         "-a",
-        type=str,
-        required=True,
-        choices=registry.get_registered()
+        type=_comma_separated(registry.get_registered()),
+        help="one or more (comma separated) of: " + ", ".join(registry.get_registered()),
     )
 
     ap.add_argument(
         "--isolation-level",
         "-l",
-        type=str,
-        required=True,
-        choices=[
-            "read-uncommitted",
-            "read-committed",
-            "repeatable-read",
-            "serializable"
-        ]
+        type=_comma_separated(list(manifest.ISOLATION_LEVELS)),
+        help="one or more (comma separated) of: " + ", ".join(manifest.ISOLATION_LEVELS),
     )
 
-    return ap.parse_args()
+    ap.add_argument(
+        "--all",
+        action="store_true",
+        help="run every anomaly with every isolation level, unless narrowed by --anomaly/--isolation-level",
+    )
 
+    ap.add_argument(
+        "--concurrency",
+        "-c",
+        type=int,
+        default=8,
+        help="how many anomaly/isolation level pairs run at the same time when running more than one",
+    )
 
-async def main(args: argparse.Namespace):
-    async with (await _connect() as c1, await _connect() as c2):
-        await _create_tables(c1)
-
-        isolation_level = _get_isolation_level(args.isolation_level)
-        (T1, T2, description) = registry.resolve(args.anomaly)
-        t1_event = asyncio.Event()
-        t1_event.set()
-        t2_event = asyncio.Event()
-        t1 = T1(c1, isolation_level, t1_event, t2_event)
-        t2 = T2(c2, isolation_level, t2_event, t1_event)
-
-        if description:
-            print(args.anomaly, ":", args.isolation_level)
-            print(description)
-            print()
+    ap.add_argument(
+        "--explore",
+        action="store_true",
+        help="run every (not equivalent) interleaving of the steps of the examples and group them by outcome",
+    )
 
-        await _print_account(c1, "BEFORE")
-        async with asyncio.TaskGroup() as tg:
-            tg.create_task(t1())
-            tg.create_task(t2())
-        await _print_account(c1, "AFTER")
+    ap.add_argument(
+        "--max-interleavings",
+        type=int,
+        default=10000,
+        help="with --explore, how many interleavings to run at most per anomaly/isolation level pair",
+    )
 
+    ap.add_argument(
+        "--fuzz",
+        type=int,
+        metavar="CASES",
+        help="run CASES random programs (reads, range predicates, transfers, inserts and deletes) with a random "
+             "interleaving at every isolation level, check that they are serializable, lose no update and keep the "
+             "sum of the balances, and print the smallest failing case of every check as a scenario to register",
+    )
 
-async def _connect() -> psycopg.AsyncConnection:
-    connection_string = environ.get("PG_CONNECTION_STRING")
-    if not connection_string:
-        raise RuntimeError("Missing PG_CONNECTION_STRING env")
+    ap.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="with --fuzz, seed of the first case, case i being generated from seed + i (0 by default)",
+    )
 
-    return await psycopg.AsyncConnection.connect(
-        connection_string,
-        row_factory=dict_row,
-        autocommit=True,
+    ap.add_argument(
+        "--stress",
+        action="store_true",
+        help="run the transactions of the examples over and over from --clients connections, without their "
+             "choreography, and report commits/s, abort rates and latencies",
     )
 
+    ap.add_argument(
+        "--queue",
+        action="store_true",
+        help="run the work queue examples (queue-*, or the ones given with --anomaly) as a load test: --producers "
+             "connections insert jobs while --clients connections claim them, and report claims/s, duplicate claims, "
+             "lock waits and latencies",
+    )
 
-async def _create_tables(conn: psycopg.AsyncConnection):
-    async with conn.cursor() as c:
-        await c.execute("drop table if exists account;")
-        await c.execute("""
-            create table account (
-                id serial primary key,
-                balance int not null
-            );
-        """)
+    ap.add_argument(
+        "--producers",
+        type=int,
+        default=1,
+        help="with --queue, how many connections insert jobs",
+    )
 
-        await c.execute("""
-            insert into account (balance) values (67);
-            insert into account (balance) values (31);
-        """)
+    ap.add_argument(
+        "--readers",
+        type=int,
+        metavar="READERS",
+        help="run the read only examples (read-only-*, or the ones given with --anomaly) as a load test: READERS "
+             "connections run their transactions that only read while --clients connections run the others, all "
+             "serializable, once per access mode of the readers (read write, read only, read only deferrable), and "
+             "report reports/s, abort rates, predicate locks per reader and the startup wait of the readers",
+    )
 
+    ap.add_argument(
+        "--clients",
+        type=_counts,
+        default=[8],
+        help="with --stress (or --queue, --readers), how many connections run transactions at the same time, or a "
+             "comma separated list of counts to run each anomaly/isolation level pair with (1,4,16,64)",
+    )
 
-def _get_isolation_level(isolation_level: str) -> psycopg.IsolationLevel:
-    match isolation_level:
-        case "read-uncommitted":
-            return psycopg.IsolationLevel.READ_UNCOMMITTED
-        case "read-committed":
-            return psycopg.IsolationLevel.READ_COMMITTED
-        case "repeatable-read":
-            return psycopg.IsolationLevel.REPEATABLE_READ
-        case "serializable":
-            return psycopg.IsolationLevel.SERIALIZABLE
-        case _:
-            raise ValueError(f"Unknown isolation level {isolation_level}")
+    ap.add_argument(
+        "--duration",
+        type=float,
+        help="with --stress, seconds to run each anomaly/isolation level pair for (5 unless --iterations is given)",
+    )
 
+    ap.add_argument(
+        "--iterations",
+        type=int,
+        help="with --stress, how many transactions to run per anomaly/isolation level pair",
+    )
 
-async def _print_account(conn: psycopg.Connection, tag: str):
-    async with conn.cursor() as cur:
-        print("DB STATE:", tag)
-        await cur.execute("select * from account;")
-        print(format_table(await cur.fetchall()))
-        print()
+    ap.add_argument(
+        "--retry",
+        choices=manifest.RETRY_POLICIES,
+        help="retry transactions aborted by a serialization failure or a deadlock: right away (immediate) or after "
+             "an exponential backoff with jitter (exponential), and print the attempts and wasted work",
+    )
+
+    ap.add_argument(
+        "--max-attempts",
+        type=int,
+        default=10,
+        help="with --retry, how many times to run a transaction at most",
+    )
+
+    ap.add_argument(
+        "--transport",
+        choices=manifest.TRANSPORTS,
+        default=manifest.SIMPLE,
+        help="simple: every statement is a round trip to the database, and opening a transaction takes two; pipeline: "
+             "transactions open with a single statement and, with --stress, statements that don't need each other's "
+             "results are sent together (psycopg pipeline mode)",
+    )
+
+    ap.add_argument(
+        "--read-only",
+        action="store_true",
+        help="open the transactions of the examples that only read (no modify, blocking or locking step) READ ONLY",
+    )
+
+    ap.add_argument(
+        "--deferrable",
+        action="store_true",
+        help="with --read-only, open them READ ONLY DEFERRABLE: with serializable, their first statement waits for the "
+             "serializable transactions running then to end, and they take no predicate locks",
+    )
+
+    ap.add_argument(
+        "--backend",
+        "-b",
+        choices=manifest.BACKENDS,
+        default="postgres",
+        help="database the examples run against: postgres or memory (an in process model of PostgreSQL, no server "
+             "needed)",
+    )
+
+    ap.add_argument(
+        "--check",
+        action="store_true",
+        help="find the cycles in the dependency graph of every run and classify them (G0, G1c, G2-item, G2), "
+             "needs --backend memory",
+    )
+
+    ap.add_argument(
+        "--history",
+        metavar="PATH",
+        help="write every statement run (transaction, query, rows, timings, error) to PATH, as NDJSON or, "
+             "for .arrow/.parquet files, Arrow/Parquet (needs pyarrow)",
+    )
+
+    ap.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="write latency percentiles of every statement, split into execution and lock wait, to PATH, as JSON "
+             "for .json files or else in the Prometheus text format",
+    )
+
+    ap.add_argument(
+        "--max-rows",
+        type=int,
+        default=50,
+        help="rows printed per query result or table, the others are only counted (0 for all)",
+    )
+
+    ap.add_argument(
+        "--locks",
+        type=float,
+        nargs="?",
+        const=0.005,
+        metavar="SECONDS",
+        help="sample the locks of the transactions every SECONDS (0.005 by default) while they run, print the "
+             "escalations of predicate locks and the waits seen along the steps, and the most locks each transaction "
+             "held, by granularity, at the end",
+    )
+
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="run every anomaly/isolation level pair, instead of reusing the results of the previous runs whose "
+             "example, options and server version are the same (kept in $XDG_CACHE_HOME/txiso)",
+    )
+
+    ap.add_argument(
+        "--rows",
+        type=int,
+        help="rows of the account table: the two rows the examples are written for and more with balances of at most "
+             "30, which the examples don't select by value (2 by default)",
+    )
+
+    ap.add_argument(
+        "--distribution",
+        choices=manifest.DISTRIBUTIONS,
+        help="with --rows, distribution of the balances of the added rows between 0 and 30: uniform (default) or "
+             "zipf (balance b with a probability proportional to 1 / (b + 1))",
+    )
+
+    ap.add_argument(
+        "--index",
+        type=_comma_separated(list(manifest.INDEX_COLUMNS)),
+        action="append",
+        metavar="COLUMNS",
+        help="create an index on the account table, on the comma separated columns (" +
+             ", ".join(manifest.INDEX_COLUMNS) + "), can be repeated",
+    )
+
+    ap.add_argument(
+        "--timeout",
+        type=float,
+        default=2,
+        help="seconds to wait for the other transaction or for a blocked statement before giving up",
+    )
+
+    args = ap.parse_args()
+    if args.deferrable and not args.read_only:
+        ap.error("--deferrable needs --read-only")
+    if args.read_only and (args.fuzz is not None or args.explore or args.stress or args.queue or args.readers):
+        ap.error("--read-only is not supported with --fuzz, --explore, --stress, --queue or --readers")
+
+    if args.fuzz is not None:
+        if args.anomaly or args.explore or args.stress or args.queue or args.readers:
+            ap.error(
+                "--fuzz generates its own examples, it is not supported with --anomaly, --explore, --stress, --queue "
+                "or --readers"
+            )
+        if args.history or args.metrics or args.locks is not None or args.retry or args.check or args.index:
+            ap.error("--fuzz is not supported with --history, --metrics, --locks, --retry, --check or --index")
+        if args.transport != manifest.SIMPLE:
+            ap.error("--transport is not supported with --fuzz")
+        if args.fuzz < 1:
+            ap.error("--fuzz must be at least 1")
+        args.isolation_level = args.isolation_level or list(manifest.ISOLATION_LEVELS)
+    elif args.readers is not None:
+        if args.explore or args.stress or args.queue:
+            ap.error("--readers is not supported with --explore, --stress or --queue")
+        if args.isolation_level:
+            ap.error("--readers runs every transaction serializable, --isolation-level is not supported")
+        if args.history or args.metrics or args.locks is not None or args.check:
+            ap.error("--readers is not supported with --history, --metrics, --locks or --check")
+        if args.transport != manifest.SIMPLE:
+            ap.error("--transport is not supported with --readers")
+        if args.readers < 1:
+            ap.error("--readers must be at least 1")
+        args.anomaly = args.anomaly or [a for a in registry.get_registered() if a.startswith("read-only-")]
+        if args.duration is None and args.iterations is None:
+            args.duration = 5
+    elif args.queue:
+        if args.explore or args.stress:
+            ap.error("--queue is not supported with --explore or --stress")
+        if args.history or args.metrics or args.locks is not None or args.check:
+            ap.error("--queue is not supported with --history, --metrics, --locks or --check")
+        if args.transport != manifest.SIMPLE:
+            ap.error("--transport is not supported with --queue")
+        if args.producers < 1:
+            ap.error("--producers must be at least 1")
+        args.anomaly = args.anomaly or [a for a in registry.get_registered() if a.startswith("queue-")]
+        args.isolation_level = args.isolation_level or list(manifest.ISOLATION_LEVELS)
+        if args.duration is None and args.iterations is None:
+            args.duration = 5
+    elif args.all:
+        # the work queue examples only run under load with --queue
+        args.anomaly = args.anomaly or [
+            a for a in registry.get_registered() if not (args.stress and a.startswith("queue-"))
+        ]
+        args.isolation_level = args.isolation_level or list(manifest.ISOLATION_LEVELS)
+    elif not args.anomaly or not args.isolation_level:
+        ap.error("--anomaly and --isolation-level are required unless --all is given")
+
+    if args.concurrency < 1:
+        ap.error("--concurrency must be at least 1")
+
+    if args.timeout <= 0:
+        ap.error("--timeout must be positive")
+
+    if args.max_rows < 0:
+        ap.error("--max-rows can't be negative")
+
+    if args.rows is not None and args.rows < 2:
+        ap.error("--rows must be at least 2, the examples need the first two rows")
+
+    if args.distribution and args.rows is None:
+        ap.error("--distribution needs --rows")
+
+    if args.index and args.backend != "postgres":
+        ap.error("--index needs --backend postgres")
+
+    if args.locks is not None and (args.explore or args.stress):
+        ap.error("--locks is not supported with --explore or --stress")
+
+    if args.locks is not None and args.locks <= 0:
+        ap.error("--locks must be positive")
+
+    if args.explore and (args.rows is not None or args.index):
+        ap.error("--rows and --index are not supported with --explore")
+
+    if args.explore and args.history:
+        ap.error("--history is not supported with --explore")
+
+    if args.explore and args.metrics:
+        ap.error("--metrics is not supported with --explore")
+
+    if args.check and (args.backend != "memory" or args.explore):
+        ap.error("--check needs --backend memory and is not supported with --explore")
+
+    if args.stress and (args.explore or args.history):
+        ap.error("--stress is not supported with --explore or --history")
+
+    if args.stress and any(a.startswith("queue-") for a in args.anomaly):
+        ap.error("the queue-* examples drain the queue without producers, run them with --queue")
+
+    if min(args.clients) < 1:
+        ap.error("--clients must be at least 1")
+
+    if args.max_attempts < 1:
+        ap.error("--max-attempts must be at least 1")
+
+    if args.transport != manifest.SIMPLE and args.explore:
+        ap.error("--transport is not supported with --explore")
+
+    if args.retry and args.explore:
+        ap.error("--retry is not supported with --explore")
+
+    if args.stress and args.duration is None and args.iterations is None:
+        args.duration = 5
+
+    return args
+
+
+def _comma_separated(choices: List[str]) -> Callable[[str], List[str]]:
+    def parse(value: str) -> List[str]:
+        values = [v.strip() for v in value.split(",") if v.strip()]
+        for v in values:
+            if v not in choices:
+                raise argparse.ArgumentTypeError(f"invalid choice: '{v}' (choose from {', '.join(choices)})")
+        return values
+
+    return parse
+
+
+def _counts(value: str) -> List[int]:
+    try:
+        counts = [int(v) for v in value.split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid counts: '{value}' (comma separated integers)")
+    if not counts:
+        raise argparse.ArgumentTypeError("no count given")
+    return counts
+
+
+async def main(args: argparse.Namespace):
+    # only imported once the arguments are checked, they bring psycopg along (see `anomaly.manifest`)
+    from anomaly import explorer, fuzzer, queue_stress, reader_stress, runner, stress
+    from anomaly.base import Printer
+    from anomaly.cache import OutcomeCache
+    from anomaly.dataset import DEFAULT, UNIFORM, Dataset
+    from anomaly.history import History
+    from anomaly.metrics import Metrics
+    from anomaly.retry import POLICIES
+
+    policy = POLICIES[args.retry](args.max_attempts) if args.retry else None
+    metrics = Metrics() if args.metrics else None
+    max_rows = args.max_rows or None
+    dataset = Dataset(
+        args.rows or DEFAULT.rows, args.distribution or UNIFORM, tuple(tuple(columns) for columns in args.index or ())
+    )
+    if args.stress:
+        results = await stress.stress_matrix(
+            args.anomaly,
+            args.isolation_level,
+            args.clients,
+            args.duration,
+            args.iterations,
+            args.backend,
+            args.check,
+            policy,
+            metrics,
+            args.transport,
+            dataset,
+        )
+        print(stress.format_stress(results))
+        if metrics is not None:
+            metrics.write(args.metrics)
+        return
+
+    if args.readers is not None:
+        results = await reader_stress.reader_matrix(
+            args.anomaly,
+            args.clients,
+            args.readers,
+            args.duration,
+            args.iterations,
+            args.backend,
+            policy,
+            dataset,
+        )
+        print(reader_stress.format_readers(results))
+        return
+
+    if args.queue:
+        results = await queue_stress.queue_matrix(
+            args.anomaly,
+            args.isolation_level,
+            args.producers,
+            args.clients,
+            args.duration,
+            args.iterations,
+            args.backend,
+            policy,
+            dataset,
+        )
+        print(queue_stress.format_queue(results))
+        return
+
+    if args.fuzz is not None:
+        start = time.monotonic()
+        seeds = range(args.seed, args.seed + args.fuzz)
+        report = await fuzzer.fuzz(
+            seeds,
+            args.isolation_level,
+            args.concurrency,
+            Dataset(args.rows or fuzzer.ROWS, args.distribution or UNIFORM),
+            args.timeout,
+            args.backend,
+        )
+        print(f"{args.fuzz} cases (seeds {seeds.start} to {seeds.stop - 1}) in {time.monotonic() - start:.2f}s")
+        print(fuzzer.format_report(report, args.isolation_level))
+        return
+
+    if args.explore:
+        for exploration in await explorer.explore_matrix(
+            args.anomaly, args.isolation_level, args.concurrency, args.max_interleavings, args.timeout, args.backend
+        ):
+            print(explorer.format_exploration(exploration))
+            print()
+        return
+
+    history = History() if args.history else None
+    if len(args.anomaly) == 1 and len(args.isolation_level) == 1:
+        participants = runner.participant_count(args.anomaly[0])
+        printer = Printer(history=history, metrics=metrics, max_rows=max_rows)
+        async with runner.create_pool(args.backend, 1, participants, args.check, dataset) as pool:
+            result = await runner.run(
+                pool,
+                args.anomaly[0],
+                args.isolation_level[0],
+                printer,
+                args.timeout,
+                policy,
+                args.transport,
+                args.locks,
+                args.read_only,
+                args.deferrable,
+            )
+        if dataset != DEFAULT:
+            print(f"{dataset}, loaded in {result.load * 1000:.1f}ms")
+        if history is not None:
+            history.write(args.history)
+        if metrics is not None:
+            metrics.write(args.metrics)
+        return
+
+    # the cells of a run with --history, --metrics or --locks all run, for their statements or locks
+    cache = None if args.no_cache or args.history or args.metrics or args.locks is not None else OutcomeCache()
+    start = time.monotonic()
+    results = await runner.run_matrix(
+        args.anomaly,
+        args.isolation_level,
+        args.concurrency,
+        args.timeout,
+        args.backend,
+        history,
+        args.check,
+        policy,
+        metrics,
+        args.transport,
+        max_rows,
+        dataset,
+        args.locks,
+        cache,
+        args.read_only,
+        args.deferrable,
+    )
+    elapsed = time.monotonic() - start
+    if history is not None:
+        history.write(args.history)
+    if metrics is not None:
+        metrics.write(args.metrics)
+
+    for result in results:
+        print(result.output)
+
+    print(runner.format_grid(results))
+    print()
+    ran = [r for r in results if not r.cached]
+    cached = f"{len(results) - len(ran)} from the cache, " if cache is not None else ""
+    print(f"{len(results)} runs in {elapsed:.2f}s ({cached}sum of run times {sum(r.elapsed for r in ran):.2f}s)")
+    if not ran:
+        return
+    setups = sorted(r.setup * 1000 for r in ran)
+    print(f"setup per run: min {setups[0]:.1f}ms, avg {sum(setups) / len(setups):.1f}ms, max {setups[-1]:.1f}ms")
+    if dataset != DEFAULT:
+        loads = sorted(r.load * 1000 for r in ran)
+        average = sum(loads) / len(loads)
+        print(f"{dataset}, load per run: min {loads[0]:.1f}ms, avg {average:.1f}ms, max {loads[-1]:.1f}ms")
 
 
 if __name__ == "__main__":
+    args = _parse_args()
+    # like the modules imported by `main`, asyncio takes longer to import than the arguments take to check
+    import asyncio
+
     try:
-        asyncio.run(main(_parse_args()))
+        asyncio.run(main(args))
         sys.exit(0)
     except Exception as exc:
         print(exc)
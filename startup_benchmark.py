@@ -0,0 +1,78 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+
+# How long the command line takes before it runs anything: each case starts a new interpreter `--repeat` times, the
+# first one ("python") being the cost of the interpreter alone. Then lists the slowest imports of `main.py -h`
+# (python -X importtime), psycopg should not be among them.
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+CASES: Dict[str, List[str]] = {
+    "python": ["-c", "pass"],
+    "main.py -h": ["main.py", "-h"],
+    # rejected by argparse, after building the parser
+    "main.py (bad arguments)": ["main.py", "--anomaly", "none"],
+    # what a run pays on top: every scenario and the database driver
+    "load every scenario": [
+        "-c",
+        "from anomaly import registry\nfor a in registry.get_registered(): registry.resolve(a)\nimport anomaly.runner",
+    ],
+}
+
+
+def _parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Measures the startup time of main.py")
+    ap.add_argument("--repeat", type=int, default=20, help="runs per case")
+    ap.add_argument("--imports", type=int, default=10, help="how many of the slowest imports to list")
+    return ap.parse_args()
+
+
+def _time(args: List[str], repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=_HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# (cumulative microseconds, module) of every import, slowest first, nested imports indented
+def _imports(args: List[str]) -> List[Tuple[int, str]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args], cwd=_HERE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        (_, cumulative, module) = line.split("|")
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), module[1:]))
+    return sorted(imports, reverse=True)
+
+
+def main(args: argparse.Namespace):
+    print(f"{'case':<25} {'min ms':>8} {'median ms':>10}")
+    for (name, case) in CASES.items():
+        times = _time(case, args.repeat)
+        print(f"{name:<25} {min(times) * 1000:>8.1f} {statistics.median(times) * 1000:>10.1f}")
+
+    imports = _imports(CASES["main.py -h"])
+    top = [(cumulative, module) for (cumulative, module) in imports if not module.startswith(" ")]
+    print()
+    print(f"slowest imports of main.py -h (total {sum(t for (t, _) in top) / 1000:.1f}ms):")
+    for (cumulative, module) in top[:args.imports]:
+        print(f"{cumulative / 1000:>8.1f}ms {module}")
+    if any(module.strip().split(".")[0] == "psycopg" for (_, module) in imports):
+        print("psycopg is imported")
+
+
+if __name__ == "__main__":
+    main(_parse_args())